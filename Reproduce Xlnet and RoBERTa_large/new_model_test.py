@@ -1,18 +1,14 @@
-from transformers import BertForSequenceClassification, BertTokenizer, RobertaTokenizer, RobertaForSequenceClassification, AutoTokenizer, AutoModelForSequenceClassification, XLNetForSequenceClassification, XLNetTokenizer
-import pandas as pd
 import os
 import sys
-from time import time, sleep
-from transformers import BertForSequenceClassification, BertTokenizerFast, RobertaTokenizerFast, RobertaForSequenceClassification, AutoTokenizer, AutoModelForSequenceClassification, XLNetForSequenceClassification, XLNetTokenizerFast
+
 import torch
-from torch.utils.data import TensorDataset, DataLoader
-import torch.optim as optim
-from sklearn.metrics import f1_score
-import numpy as np
 
-from transformers import XLNetTokenizerFast, XLNetForSequenceClassification
-import pandas as pd
-import os
+sys.path.append('../code_model')
+
+from batch_inference import load_classifier, find_corpus_files, StreamingLabeler, FOLDER_NAMES
+from file_manifest import FileManifest, model_identifier
+from prediction_cache import PredictionCache
+from cascade import RulePrefilter
 
 
 # 模型路径
@@ -25,58 +21,23 @@ data_path = "C:/Users/11570/Desktop/7607 final project/fomc-hawkish-dovish/data/
 output_path = "C:/Users/11570/Desktop/7607 final project/fomc-hawkish-dovish/data/filtered_data"
 
 # 文件夹名称列表
-folder_names = ["meeting_minutes", "press_conference", "speech"]
+folder_names = FOLDER_NAMES
+
+device = torch.device("cpu")
 
 # 加载模型和分词器
-tokenizer = XLNetTokenizerFast.from_pretrained(model_path, do_lower_case=True, do_basic_tokenize=True)
-model = XLNetForSequenceClassification.from_pretrained(model_path, num_labels=3)
+model, tokenizer = load_classifier(model_path, device)
 
 # Set max length
 max_length = 256
 
-# Classification function
-'''def classify_sentences(sentences):
-    inputs = tokenizer(sentences, return_tensors="pt", padding=True, truncation=True, max_length=max_length)
-    logits = model(**inputs).logits
-    predicted_classes = logits.argmax(dim=1).tolist()
-    return predicted_classes'''
-def classify_sentences(sentences):
-    if not sentences:
-        return []  # Return an empty list if there are no sentences
-    
-    inputs = tokenizer(sentences, return_tensors="pt", padding=True, truncation=True, max_length=max_length)
-    
-    if 'input_ids' not in inputs or 'attention_mask' not in inputs:
-        return []  # Return an empty list if tokenization fails or inputs are invalid
-    
-    logits = model(**inputs).logits
-    predicted_classes = logits.argmax(dim=1).tolist()
-    return predicted_classes
-
-# Iterate over each folder
-for folder_name in folder_names:
-    folder_path = os.path.join(data_path, folder_name)
-    output_folder_path = os.path.join(output_path, f"{folder_name}_labeled")
-    
-    # Create a new folder to store processed files
-    os.makedirs(output_folder_path, exist_ok=True)
-    
-    # Iterate over CSV files in the folder
-    for root, dirs, files in os.walk(folder_path):
-        for file in files:
-            if file.endswith(".csv"):
-                file_path = os.path.join(root, file)
-                
-                # Read CSV file
-                df = pd.read_csv(file_path)
-                sentences = df["sentence"].tolist()
-                
-                # Classify sentences and get labels
-                labels = classify_sentences(sentences)
-                
-                # Add labels to the DataFrame
-                df["label"] = labels
-                
-                # Save the labeled DataFrame to a new CSV file
-                output_file = os.path.join(output_folder_path, f"labeled_{file}")
-                df.to_csv(output_file, index=False)
\ No newline at end of file
+# Stream the sentences of every file through one length-sorted queue and write labeled_{file} with label and score
+cache = PredictionCache(model_identifier(model_path))
+# Cascade: only sentences with a monetary policy lexicon hit go through the model, the others are labeled neutral
+cascade = False
+prefilter = RulePrefilter(route="any", fast_label=2) if cascade else None
+model_id = model_identifier(model_path) + (":rule_prefilter" if cascade else "")
+labeler = StreamingLabeler(model, tokenizer, device, batch_size=32, max_length=max_length, cache=cache, prefilter=prefilter)
+# Only files that are new or changed since the last run with this model are labeled again
+manifest = FileManifest(os.path.join(output_path, "labeling_manifest.json"))
+labeler.label_files(find_corpus_files(data_path, output_path, folder_names), manifest=manifest, model_id=model_id)
@@ -1,86 +1,154 @@
+import sys
 import pandas as pd
 import re
 import numpy as np
+from concurrent.futures import ThreadPoolExecutor
 
-data_directory = "../data/filtered_data/press_conference_labeled/"#"../data/filtered_data/speech_labeled/" #"../data/filtered_data/meeting_minutes_labeled/"
+sys.path.append('../code_model')
 
+from file_manifest import FileManifest
+from columnar_store import LABELED_DIRECTORIES, LABELED_DATASET_PATH, document_id, read_labeled, write_aggregate_measure
 
-def get_new_file_path_mm(file):
+
+def get_new_file_path_mm(file, data_directory=LABELED_DIRECTORIES["mm"]):
     file_name = re.sub("[^0-9]", "", file.split("/")[-1])  # gets file name that follows yyyy-mm-dd format
     return data_directory + "labeled_" + file_name + "_filtered" + ".csv"
 
-def get_new_file_path_sp(file):
+def get_new_file_path_sp(file, data_directory=LABELED_DIRECTORIES["sp"]):
     file_split = file.split("/")[-1]
     file_name = file_split.split(".")[0]
     return data_directory + "labeled_" + file_name + "_filtered" + ".csv"
 
-def get_new_file_path_pc(file):
+def get_new_file_path_pc(file, data_directory=LABELED_DIRECTORIES["pc"]):
     file_split = file.split("/")[-1]
     file_name = file_split.split(".")[0]
     return data_directory + "labeled_" + file_name + "_select_filtered" + ".csv"
 
-def calculate_hawkish_dovish_measure(file_path):
-    try:
-        print(file_path)
-        df_meeting_data = pd.read_csv(file_path, usecols=["sentence", "label"])
-    except:
-        return np.nan
-    count_total_sentences = len(df_meeting_data.index)
-    if count_total_sentences > 0:
-        # count hawkish sentences
-        df_hawkish = df_meeting_data.loc[df_meeting_data['label'] == "LABEL_1"]
-        count_hawkish_sentences = len(df_hawkish.index)
-
-        # count dovish sentences
-        df_dovish = df_meeting_data.loc[df_meeting_data['label'] == "LABEL_0"]
-        count_dovish_sentences = len(df_dovish.index)
-
-        our_measure = (count_hawkish_sentences - count_dovish_sentences)/count_total_sentences
-    else:
-        our_measure = 0
-    return our_measure
-
-'''
-## for meeting minutes
-master_file_path = "../data/master_files/master_mm_final.xlsx"
-
-df_master = pd.read_excel(master_file_path, usecols=["Year", "Date", "StartDate", "EndDate", "ReleaseDate", "Url"])
-
-df_master["labeled_data_path"] = df_master["Url"].apply(lambda x: get_new_file_path_mm(x))
-
-df_master["our_measure"] = df_master["labeled_data_path"].apply(lambda x: calculate_hawkish_dovish_measure(x))
-
-df_master.to_excel("../data/market_analysis_data/aggregate_measure_mm.xlsx", index=False)
-
-
-## for Speeches
-master_file_path = "../data/master_files/master_speech_final.csv"
-
-df_master = pd.read_csv(master_file_path, usecols=["Date", "Title", "Speaker", "Location", "LocalPath"])
-
-df_master["labeled_data_path"] = df_master["LocalPath"].apply(lambda x: get_new_file_path_sp(x))
 
-print(df_master.shape)
+# master file, its columns and the column pointing at the raw document of every source
+SOURCES = {
+    "mm": {"master_file_path": "../data/master_files/master_mm_final.xlsx", "columns": ["Year", "Date", "StartDate", "EndDate", "ReleaseDate", "Url"],
+           "path_column": "Url", "get_new_file_path": get_new_file_path_mm},
+    "sp": {"master_file_path": "../data/master_files/master_speech_final.csv", "columns": ["Date", "Title", "Speaker", "Location", "LocalPath"],
+           "path_column": "LocalPath", "get_new_file_path": get_new_file_path_sp},
+    "pc": {"master_file_path": "../data/master_files/master_pc_final.xlsx", "columns": ["Year", "Date", "StartDate", "EndDate", "TranscriptUrl"],
+           "path_column": "TranscriptUrl", "get_new_file_path": get_new_file_path_pc},
+}
 
-df_master["our_measure"] = df_master["labeled_data_path"].apply(lambda x: calculate_hawkish_dovish_measure(x))
 
-df_master = df_master.dropna()
-df_master = df_master.drop_duplicates("labeled_data_path")
-print(df_master.shape)
-
-df_master.to_excel("../data/market_analysis_data/aggregate_measure_sp.xlsx", index=False)
-'''
-
-
-## for PC
-master_file_path = "../data/master_files/master_pc_final.xlsx"
-
-df_master = pd.read_excel(master_file_path, usecols=["Year", "Date", "StartDate", "EndDate", "TranscriptUrl"])
-
-df_master["labeled_data_path"] = df_master["TranscriptUrl"].apply(lambda x: get_new_file_path_pc(x))
-
-df_master["our_measure"] = df_master["labeled_data_path"].apply(lambda x: calculate_hawkish_dovish_measure(x))
-
-print(df_master.shape)
-
-df_master.to_excel("../data/market_analysis_data/aggregate_measure_pc.xlsx", index=False)
+def read_labels(file_path):
+    try:
+        return pd.read_csv(file_path, usecols=["sentence", "label"])["label"]
+    except:
+        return None
+
+
+def measures_from_labels(df_labels):
+    """
+    Description: (hawkish - dovish) / total sentences per key, from a frame with one (key, label) row per sentence
+    """
+    counts = df_labels.groupby("key")["label"].value_counts().unstack(fill_value=0)
+    counts = counts.reindex(columns=["LABEL_0", "LABEL_1"], fill_value=0)
+    totals = df_labels.groupby("key").size()
+    return ((counts["LABEL_1"] - counts["LABEL_0"]) / totals.where(totals > 0)).fillna(0)
+
+
+def calculate_hawkish_dovish_measures(file_paths, manifest=None, max_workers: int = 16):
+    """
+    Description: (hawkish - dovish) / total sentences for many labeled files at once. Files are read in parallel by a
+    thread pool, concatenated and counted with a single grouped value_counts. Unreadable files get NaN, and files that
+    are unchanged since the last run (according to the manifest) reuse their stored measure.
+    """
+    measures = {}
+    to_read = []
+    for file_path in dict.fromkeys(file_paths):
+        if manifest is not None and manifest.is_current(file_path):
+            measures[file_path] = manifest.get(file_path, "our_measure")
+        else:
+            to_read.append(file_path)
+    print("Aggregating %d labeled files, %d unchanged" % (len(to_read), len(measures)))
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        labels = dict(zip(to_read, executor.map(read_labels, to_read)))
+    labels = {file_path: series for file_path, series in labels.items() if series is not None}
+    for file_path in to_read:
+        if file_path not in labels:
+            measures[file_path] = np.nan
+
+    if labels:
+        df_labels = pd.concat(labels, names=["key", "row"]).rename("label").reset_index(level="key")
+        # empty files have no rows in df_labels and keep a measure of 0
+        our_measure = measures_from_labels(df_labels).reindex(list(labels.keys())).fillna(0)
+        for file_path, value in our_measure.items():
+            measures[file_path] = float(value)
+            if manifest is not None:
+                manifest.record(file_path, our_measure=float(value))
+    return measures
+
+
+def calculate_hawkish_dovish_measure(file_path, manifest=None):
+    return calculate_hawkish_dovish_measures([file_path], manifest)[file_path]
+
+
+def load_master(source):
+    config = SOURCES[source]
+    if config["master_file_path"].endswith(".csv"):
+        df_master = pd.read_csv(config["master_file_path"], usecols=config["columns"])
+    else:
+        df_master = pd.read_excel(config["master_file_path"], usecols=config["columns"])
+    df_master["labeled_data_path"] = df_master[config["path_column"]].apply(lambda x: config["get_new_file_path"](x))
+    return df_master
+
+
+def calculate_hawkish_dovish_measures_parquet(df_masters, dataset_path: str = LABELED_DATASET_PATH):
+    """
+    Description: Measures of all labeled files from the Parquet corpus, scanning only the source, document_id and label columns
+    """
+    df_labels = read_labeled(columns=["source", "document_id", "label"], sources=list(df_masters.keys()), dataset_path=dataset_path)
+    df_labels["key"] = df_labels["source"].astype(str) + "/" + df_labels["document_id"].astype(str)
+    measures_by_document = measures_from_labels(df_labels)
+    measures = {}
+    missing = []
+    for source, df_master in df_masters.items():
+        for file_path in df_master["labeled_data_path"]:
+            key = source + "/" + document_id(file_path)
+            if key in measures_by_document.index:
+                measures[file_path] = measures_by_document[key]
+            else:
+                missing.append(file_path)
+    # files without any labeled sentence have no rows in the corpus, reading them directly gives them the same
+    # measure of 0 as the csv path, and files that do not exist or cannot be read NaN
+    if missing:
+        measures.update(calculate_hawkish_dovish_measures(missing))
+    return measures
+
+
+def build_aggregate_measures(sources=("mm", "sp", "pc"), manifest=None, dataset_path: str = None, excel: bool = True):
+    """
+    Description: aggregate_measure_{source} tables for all sources from one bulk pass over every labeled file, read
+    from the labeled csv files or, if dataset_path is given, from the Parquet corpus. Tables are written as Parquet
+    and, if excel is set, also as the usual xlsx.
+    """
+    df_masters = {source: load_master(source) for source in sources}
+    if dataset_path is not None:
+        measures = calculate_hawkish_dovish_measures_parquet(df_masters, dataset_path)
+    else:
+        all_paths = [file_path for df_master in df_masters.values() for file_path in df_master["labeled_data_path"]]
+        measures = calculate_hawkish_dovish_measures(all_paths, manifest)
+
+    for source, df_master in df_masters.items():
+        df_master["our_measure"] = df_master["labeled_data_path"].map(measures)
+        if source == "sp":
+            # not all speeches were labeled, and several master rows point to the same file
+            df_master = df_master.dropna()
+            df_master = df_master.drop_duplicates("labeled_data_path")
+        print(source, df_master.shape)
+        write_aggregate_measure(df_master, source, excel=excel)
+        df_masters[source] = df_master
+    return df_masters
+
+
+if __name__ == "__main__":
+    manifest = FileManifest("../data/market_analysis_data/aggregate_manifest.json")
+    build_aggregate_measures(manifest=manifest)
+    manifest.save()
@@ -0,0 +1,228 @@
+import os
+import sys
+
+import dateutil.parser
+import numpy as np
+import pandas as pd
+from scipy import stats
+
+sys.path.append('../code_model')
+
+from columnar_store import AGGREGATE_DIRECTORY, read_aggregate_measure
+
+MARKET_DATA_DIR = AGGREGATE_DIRECTORY
+# the date every source's measure becomes public
+EVENT_DATE_COLUMNS = {"mm": "ReleaseDate", "pc": "EndDate", "sp": "Date"}
+# (first, last) trading day of a window relative to the first trading day on or after the event (day 0)
+WINDOWS = [(0, 0), (0, 1), (-1, 1), (0, 5), (0, 10)]
+TREASURY_COLUMNS = ["3 Mo", "1 Yr", "2 Yr", "10 Yr", "slope_10_1", "slope_10y_3m"]
+# an event counts as covered by a series only if its day 0 is at most this many calendar days after the event
+MAX_GAP_DAYS = 7
+
+
+class DateSeries:
+    """
+    Description: Columns of a market series as a (dates, columns) float array on an ascending np.datetime64[D]
+    date axis, so events can be looked up with np.searchsorted
+    """
+    def __init__(self, dates, values, columns):
+        self.dates = np.asarray(dates, dtype="datetime64[D]")
+        self.values = np.asarray(values, dtype=np.float64).reshape(len(self.dates), -1)
+        self.columns = list(columns)
+        order = np.argsort(self.dates, kind="stable")
+        self.dates, self.values = self.dates[order], self.values[order]
+
+    @classmethod
+    def from_frame(cls, df, date_column: str, columns):
+        return cls(df[date_column].to_numpy(dtype="datetime64[D]"), df[columns].to_numpy(dtype=np.float64), columns)
+
+    def select(self, columns):
+        return DateSeries(self.dates, self.values[:, [self.columns.index(column) for column in columns]], columns)
+
+    def asof(self, dates):
+        """
+        Description: (len(dates), columns) values of the last observation on or before every date, NaN before the first
+        """
+        index = np.searchsorted(self.dates, np.asarray(dates, dtype="datetime64[D]"), side="right") - 1
+        values = self.values[np.clip(index, 0, None)]
+        values[index < 0] = np.nan
+        return values
+
+    def next_observation(self, dates):
+        """
+        Description: (len(dates), columns) values of the first observation on or after every date, NaN after the last
+        """
+        index = np.searchsorted(self.dates, np.asarray(dates, dtype="datetime64[D]"), side="left")
+        values = self.values[np.clip(index, None, len(self.dates) - 1)]
+        values[index >= len(self.dates)] = np.nan
+        return values
+
+
+def load_treasury(path: str = os.path.join(MARKET_DATA_DIR, "daily-treasury-rates.csv")):
+    """
+    Description: Daily treasury yields in percent, plus the 10y-1y and 10y-3m slopes. The file is newest first and
+    its dates are MM/DD/YYYY, older rows MM-DD-YYYY.
+    """
+    df = pd.read_csv(path)
+    df["Date"] = pd.to_datetime(df["Date"].str.replace("-", "/", regex=False), format="%m/%d/%Y")
+    df["slope_10_1"] = df["10 Yr"] - df["1 Yr"]
+    df["slope_10y_3m"] = df["10 Yr"] - df["3 Mo"]
+    columns = [column for column in df.columns if column != "Date"]
+    return DateSeries.from_frame(df, "Date", columns)
+
+
+def load_qqq(path: str = os.path.join(MARKET_DATA_DIR, "QQQ.csv")):
+    df = pd.read_csv(path)
+    df["Date"] = pd.to_datetime(df["Date"], format="%Y-%m-%d")
+    return DateSeries.from_frame(df, "Date", ["Open", "High", "Low", "Close", "Adj Close", "Volume"])
+
+
+def load_monthly(path: str, column: str):
+    """
+    Description: Monthly FRED index with its year over year change in percent
+    """
+    df = pd.read_csv(path)
+    df["DATE"] = pd.to_datetime(df["DATE"], format="%Y-%m-%d")
+    df[column + "_change"] = df[column].pct_change(12) * 100
+    return DateSeries.from_frame(df, "DATE", [column, column + "_change"])
+
+
+def load_market_data(directory: str = MARKET_DATA_DIR):
+    """
+    Description: Every market series of the market analysis data, parsed once
+    """
+    return {"treasury": load_treasury(os.path.join(directory, "daily-treasury-rates.csv")),
+            "qqq": load_qqq(os.path.join(directory, "QQQ.csv")),
+            "cpi": load_monthly(os.path.join(directory, "CPIAUCSL.csv"), "CPIAUCSL"),
+            "ppi": load_monthly(os.path.join(directory, "PPIACO.csv"), "PPIACO")}
+
+
+def aligned_panel(series, dates=None):
+    """
+    Description: (dates, {name: (len(dates), columns) array}) of several DateSeries on one calendar, the union of
+    their dates unless dates is given, each series carried forward from its last observation
+    """
+    if dates is None:
+        dates = np.unique(np.concatenate([s.dates for s in series.values()]))
+    return dates, {name: s.asof(dates) for name, s in series.items()}
+
+
+def parse_dates(values):
+    """
+    Description: Dates of an aggregate measure column, which come as datetimes, as 'January/31/2006' or as free text
+    """
+    values = pd.Series(values)
+    if pd.api.types.is_datetime64_any_dtype(values):
+        return values
+    dates = pd.to_datetime(values, format="%B/%d/%Y", errors="coerce")
+    missing = dates.isna() & values.notna()
+    if missing.any():
+        dates[missing] = pd.to_datetime(values[missing].astype(str).apply(dateutil.parser.parse))
+    return dates
+
+
+def load_events(source: str, date_column: str = None):
+    """
+    Description: (event dates, our_measure) of one source, without events missing either, in date order
+    """
+    date_column = date_column or EVENT_DATE_COLUMNS[source]
+    df = read_aggregate_measure(source, columns=[date_column, "our_measure"])
+    df[date_column] = parse_dates(df[date_column])
+    df = df.dropna().sort_values(date_column, kind="stable")
+    return df[date_column].to_numpy(dtype="datetime64[D]"), df["our_measure"].to_numpy(dtype=np.float64)
+
+
+def event_window_moves(series: DateSeries, event_dates, windows=WINDOWS, kind: str = "change", max_gap_days: int = MAX_GAP_DAYS):
+    """
+    Description: (events, windows, columns) moves of every column over every window around every event, from the
+    close of the trading day before the window's first day to the close of its last day. All events and windows are
+    looked up at once: day 0 of every event is one searchsorted into the date axis, the window ends are offsets from it.
+    kind: 'change' for differences (yields, in percentage points) or 'return' for percent returns (prices)
+    Windows reaching outside the series, and events whose day 0 is more than max_gap_days after the event
+    (before the series starts or in a data gap), are NaN.
+    """
+    event_dates = np.asarray(event_dates, dtype="datetime64[D]")
+    windows = np.asarray(windows, dtype=np.int64).reshape(-1, 2)
+    day0 = np.searchsorted(series.dates, event_dates, side="left")
+    covered = day0 < len(series.dates)
+    covered[covered] &= (series.dates[day0[covered]] - event_dates[covered]).astype(np.int64) <= max_gap_days
+
+    start = day0[:, None] + windows[None, :, 0] - 1
+    end = day0[:, None] + windows[None, :, 1]
+    valid = covered[:, None] & (start >= 0) & (end < len(series.dates))
+    before = series.values[np.clip(start, 0, len(series.dates) - 1)]
+    after = series.values[np.clip(end, 0, len(series.dates) - 1)]
+    if kind == "return":
+        with np.errstate(divide="ignore", invalid="ignore"):
+            moves = (after / before - 1) * 100
+    elif kind == "change":
+        moves = after - before
+    else:
+        raise ValueError("kind must be 'change' or 'return', got %r" % kind)
+    moves[~valid] = np.nan
+    return moves
+
+
+def regress_on_measure(measure, moves):
+    """
+    Description: OLS of every column of moves (events, ...) on a constant and the measure, vectorized over the
+    columns with each column's own NaN rows left out. Returns (..., 6) arrays of
+    [observations, alpha, beta, standard error of beta, t statistic of beta, two-sided p value of beta] and R squared.
+    """
+    x = np.asarray(measure, dtype=np.float64).reshape(-1, *([1] * (moves.ndim - 1)))
+    mask = ~np.isnan(moves) & ~np.isnan(x)
+    n = mask.sum(axis=0)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        x_mean = np.where(mask, x, 0).sum(axis=0) / n
+        y_mean = np.where(mask, moves, 0).sum(axis=0) / n
+        dx = np.where(mask, x - x_mean, 0)
+        dy = np.where(mask, moves - y_mean, 0)
+        sxx = (dx * dx).sum(axis=0)
+        beta = (dx * dy).sum(axis=0) / sxx
+        alpha = y_mean - beta * x_mean
+        residual = ((dy - beta * dx) ** 2).sum(axis=0)
+        beta_se = np.sqrt(residual / (n - 2) / sxx)
+        t_stat = beta / beta_se
+        r_squared = 1 - residual / (dy * dy).sum(axis=0)
+    p_value = 2 * stats.t.sf(np.abs(t_stat), np.maximum(n - 2, 1))
+    return np.stack([n, alpha, beta, beta_se, t_stat, p_value], axis=-1), r_squared
+
+
+def event_study(source: str, series: DateSeries, windows=WINDOWS, kind: str = "change", date_column: str = None):
+    """
+    Description: Window moves of a series around every event of a source and their regressions on our_measure.
+    Returns (moves: one row per event and column with one column per window, regressions: one row per column and window)
+    """
+    event_dates, measure = load_events(source, date_column)
+    moves = event_window_moves(series, event_dates, windows, kind)
+    window_names = ["[%+d,%+d]" % tuple(window) for window in windows]
+
+    df_moves = pd.DataFrame(moves.transpose(0, 2, 1).reshape(-1, len(windows)), columns=window_names)
+    df_moves.insert(0, "event_date", np.repeat(event_dates, len(series.columns)))
+    df_moves.insert(1, "our_measure", np.repeat(measure, len(series.columns)))
+    df_moves.insert(2, "series", np.tile(series.columns, len(event_dates)))
+
+    results, r_squared = regress_on_measure(measure, moves)
+    df_regressions = pd.DataFrame(results.transpose(1, 0, 2).reshape(-1, results.shape[-1]),
+                                  columns=["observations", "alpha", "beta", "beta_se", "t_stat", "p_value"])
+    df_regressions.insert(0, "source", source)
+    df_regressions.insert(1, "series", np.repeat(series.columns, len(windows)))
+    df_regressions.insert(2, "window", np.tile(window_names, len(series.columns)))
+    df_regressions["r_squared"] = r_squared.T.reshape(-1)
+    df_regressions["observations"] = df_regressions["observations"].astype(int)
+    return df_moves, df_regressions
+
+
+if __name__ == "__main__":
+    market_data = load_market_data()
+    studies = {"treasury": (market_data["treasury"].select(TREASURY_COLUMNS), "change"), "qqq": (market_data["qqq"].select(["Adj Close"]), "return")}
+    all_regressions = []
+    with pd.ExcelWriter(os.path.join(MARKET_DATA_DIR, "event_study_moves.xlsx")) as writer:
+        for source in EVENT_DATE_COLUMNS:
+            for name, (series, kind) in studies.items():
+                df_moves, df_regressions = event_study(source, series, WINDOWS, kind)
+                df_moves.to_excel(writer, sheet_name="%s_%s" % (source, name), index=False)
+                all_regressions.append(df_regressions)
+    df_regressions = pd.concat(all_regressions, ignore_index=True)
+    df_regressions.to_excel(os.path.join(MARKET_DATA_DIR, "event_study_regressions.xlsx"), index=False)
+    print(df_regressions.to_string())
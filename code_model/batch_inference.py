@@ -0,0 +1,222 @@
+import os
+from time import time
+
+import numpy as np
+import pandas as pd
+import torch
+from transformers import AutoTokenizer, AutoModelForSequenceClassification
+
+from dynamic_padding import TokenThroughputMeter
+
+FOLDER_NAMES = ["meeting_minutes", "press_conference", "speech"]
+TEST_DATA_DIR = "../training_data/test-and-training/test_data/"
+
+
+def load_classifier(model_path: str, device, num_labels: int = 3):
+    """
+    Description: Fine-tuned FOMC classifier and its tokenizer from a save_pretrained directory or a hub id
+    """
+    tokenizer = AutoTokenizer.from_pretrained(model_path, do_lower_case=True, do_basic_tokenize=True)
+    model = AutoModelForSequenceClassification.from_pretrained(model_path, num_labels=num_labels).to(device)
+    model.eval()
+    return model, tokenizer
+
+
+def find_corpus_files(data_path: str, output_path: str, folder_names=FOLDER_NAMES):
+    """
+    Description: (input csv, output csv) pairs for every filtered file, written to {folder}_labeled/labeled_{file}
+    """
+    file_pairs = []
+    for folder_name in folder_names:
+        output_folder_path = os.path.join(output_path, f"{folder_name}_labeled")
+        for root, dirs, files in os.walk(os.path.join(data_path, folder_name)):
+            for file in sorted(files):
+                if file.endswith(".csv"):
+                    file_pairs.append((os.path.join(root, file), os.path.join(output_folder_path, f"labeled_{file}")))
+    return file_pairs
+
+
+def read_test_splits(test_data_dir: str = TEST_DATA_DIR):
+    """
+    Description: (file name, sentences, labels) for every annotated test split
+    """
+    for f in sorted(os.listdir(test_data_dir)):
+        df = pd.read_excel(os.path.join(test_data_dir, f))
+        yield f, df['sentence'].tolist(), df['label'].astype(int).to_numpy()
+
+
+def softmax(logits):
+    exp = np.exp(logits - logits.max(axis=1, keepdims=True))
+    return exp / exp.sum(axis=1, keepdims=True)
+
+
+def write_labeled_file(df, logits, output_file: str, id2label):
+    """
+    Description: Add the label (LABEL_k) and score (softmax probability of that label) columns and save the file
+    """
+    probabilities = softmax(logits) if len(logits) > 0 else np.zeros((0, 1))
+    predicted = probabilities.argmax(axis=1)
+    df["label"] = [id2label[int(k)] for k in predicted]
+    df["score"] = probabilities.max(axis=1)
+    os.makedirs(os.path.dirname(output_file), exist_ok=True)
+    df.to_csv(output_file, index=False)
+
+
+class StreamingLabeler:
+    """
+    Description: Batch inference over many documents at once. Sentences from all files go into one queue; every
+    window of window_size sentences is sorted by token length and cut into batches, so batches mix files and carry
+    little padding. Predictions are scattered back to their files, and a file is written and released as soon as its
+    last sentence is scored, so memory is bounded by the window and not by the largest document.
+    With a PredictionCache only sentences never scored by this model before go through the model, and with a
+    RulePrefilter (cascade.py) only sentences the prefilter routes to it.
+    """
+    def __init__(self, model, tokenizer, device, batch_size: int = 64, max_length: int = 256, window_size: int = 4096, cache=None, prefilter=None):
+        self.model = model
+        self.tokenizer = tokenizer
+        self.device = device
+        self.batch_size = batch_size
+        self.max_length = max_length
+        self.window_size = window_size
+        self.num_labels = model.config.num_labels
+        self.throughput = TokenThroughputMeter()
+        self.cache = cache
+        self.prefilter = prefilter
+        self.forward_passes = 0
+
+    def tokenize(self, sentences):
+        sentences = [s if isinstance(s, str) else "" for s in sentences]
+        return self.tokenizer(sentences, truncation=True, max_length=self.max_length)['input_ids']
+
+    def forward_sorted(self, input_ids):
+        """
+        Description: Logits (N, num_labels) for a list of token id lists, computed in length-sorted batches
+        """
+        logits = np.zeros((len(input_ids), self.num_labels), dtype=np.float32)
+        order = sorted(range(len(input_ids)), key=lambda i: len(input_ids[i]))
+        with torch.inference_mode():
+            for start in range(0, len(order), self.batch_size):
+                batch_index = order[start:start + self.batch_size]
+                batch = self.tokenizer.pad({'input_ids': [input_ids[i] for i in batch_index]}, return_tensors='pt')
+                self.throughput.update(batch['attention_mask'])
+                self.forward_passes += len(batch_index)
+                outputs = self.model(input_ids=batch['input_ids'].to(self.device), attention_mask=batch['attention_mask'].to(self.device))
+                logits[batch_index] = outputs.logits.float().cpu().numpy()
+        return logits
+
+    def predict_logits(self, sentences):
+        """
+        Description: Logits for a list of sentences. Sentences the prefilter does not route to the model get its
+        fast path logits.
+        """
+        if len(sentences) == 0:
+            return np.zeros((0, self.num_labels), dtype=np.float32)
+        if self.prefilter is None:
+            return self.model_logits(sentences)
+
+        logits = np.tile(self.prefilter.fast_logits(self.num_labels), (len(sentences), 1))
+        routed = np.flatnonzero(self.prefilter.needs_model(sentences))
+        if len(routed) > 0:
+            logits[routed] = self.model_logits([sentences[i] for i in routed])
+        return logits
+
+    def model_logits(self, sentences):
+        """
+        Description: Model logits for a list of sentences, taken from the cache where possible; sentences repeated
+        within the list are only scored once
+        """
+        if len(sentences) == 0:
+            return np.zeros((0, self.num_labels), dtype=np.float32)
+        if self.cache is None:
+            return self.forward_sorted(self.tokenize(sentences))
+
+        logits = np.zeros((len(sentences), self.num_labels), dtype=np.float32)
+        keys = [self.cache.key(sentence) for sentence in sentences]
+        missing = {}
+        for i, value in enumerate(self.cache.lookup(keys)):
+            if value is None:
+                missing.setdefault(keys[i], []).append(i)
+            else:
+                logits[i] = value
+        if missing:
+            missing_keys = list(missing.keys())
+            computed = self.forward_sorted(self.tokenize([sentences[missing[key][0]] for key in missing_keys]))
+            self.cache.store(missing_keys, computed)
+            for key, row_logits in zip(missing_keys, computed):
+                logits[missing[key]] = row_logits
+        return logits
+
+    def classify(self, sentences):
+        """
+        Description: Pipeline style output, a {'label': 'LABEL_k', 'score': probability} dict per sentence
+        """
+        probabilities = softmax(self.predict_logits(sentences)) if len(sentences) > 0 else np.zeros((0, self.num_labels))
+        id2label = self.model.config.id2label
+        return [{'label': id2label[int(k)], 'score': float(p[k])} for p, k in zip(probabilities, probabilities.argmax(axis=1))]
+
+    def label_files(self, file_pairs, manifest=None, model_id: str = None):
+        """
+        Description: Label every (input csv, output csv) pair and return the number of sentences scored.
+        With a FileManifest, files whose content and model id are unchanged since the last run (and whose output
+        still exists) are skipped, and every newly written file is recorded.
+        """
+        if manifest is not None:
+            count_files = len(file_pairs)
+            file_pairs = [(input_file, output_file) for input_file, output_file in file_pairs
+                          if not (os.path.exists(output_file) and manifest.is_current(input_file, model_id=model_id, output_file=output_file))]
+            print("Skipping %d unchanged files, %d files to label" % (count_files - len(file_pairs), len(file_pairs)))
+
+        id2label = self.model.config.id2label
+        pending = {}
+        queue = []
+        count_sentences = 0
+        start_t = time()
+        self.throughput.reset()
+        self.forward_passes = 0
+        if self.prefilter is not None:
+            self.prefilter.reset()
+
+        def score_window(window):
+            logits = self.predict_logits([sentence for _, _, sentence in window])
+            for (file_index, row, _), row_logits in zip(window, logits):
+                state = pending[file_index]
+                state["logits"][row] = row_logits
+                state["remaining"] -= 1
+                if state["remaining"] == 0:
+                    write_labeled_file(state["df"], state["logits"], state["output_file"], id2label)
+                    if manifest is not None:
+                        manifest.record(state["input_file"], model_id=model_id, output_file=state["output_file"])
+                    del pending[file_index]
+            if manifest is not None:
+                manifest.save()
+
+        for file_index, (input_file, output_file) in enumerate(file_pairs):
+            df = pd.read_csv(input_file)
+            if len(df.index) == 0:
+                write_labeled_file(df, np.zeros((0, self.num_labels)), output_file, id2label)
+                if manifest is not None:
+                    manifest.record(input_file, model_id=model_id, output_file=output_file)
+                continue
+            sentences = df["sentence"].tolist()
+            pending[file_index] = {"df": df, "input_file": input_file, "output_file": output_file, "remaining": len(sentences),
+                                   "logits": np.zeros((len(sentences), self.num_labels), dtype=np.float32)}
+            queue.extend((file_index, row, sentence) for row, sentence in enumerate(sentences))
+            count_sentences += len(sentences)
+            while len(queue) >= self.window_size:
+                score_window(queue[:self.window_size])
+                queue = queue[self.window_size:]
+        if queue:
+            score_window(queue)
+        if manifest is not None:
+            manifest.save()
+
+        elapsed = time() - start_t
+        print("Labeled %d sentences from %d files in %.1fs (%.1f sentences/sec, %.0f tokens/sec, padding efficiency %.2f)"
+              % (count_sentences, len(file_pairs), elapsed, count_sentences / max(elapsed, 1e-9), self.throughput.tokens_per_second(), self.throughput.padding_efficiency()))
+        if self.cache is not None or self.prefilter is not None:
+            print("Forward passes: %d of %d sentences" % (self.forward_passes, count_sentences))
+        if self.prefilter is not None:
+            self.prefilter.report()
+        if self.cache is not None:
+            self.cache.report()
+        return count_sentences
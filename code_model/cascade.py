@@ -0,0 +1,89 @@
+import numpy as np
+import pandas as pd
+import sklearn.metrics as skm
+import torch
+
+from rule_based import matcher, labels_from_hits
+from batch_inference import TEST_DATA_DIR, load_classifier, read_test_splits, StreamingLabeler
+
+# logit of the fast path label, large enough that its softmax score is ~1
+FAST_PATH_LOGIT = 10.0
+
+
+class RulePrefilter:
+    """
+    Description: Cheap first stage of a cascade in front of the transformer. With route="any" only sentences with at
+    least one A1/A2/B1/B2 lexicon hit go to the model; with route="rule" only sentences the rule model does not label
+    neutral. All other sentences take the fast path and get fast_label without a forward pass.
+    """
+    def __init__(self, route: str = "any", fast_label: int = 2):
+        if route not in ("any", "rule"):
+            raise ValueError("route must be 'any' or 'rule', got %r" % route)
+        self.route = route
+        self.fast_label = fast_label
+        self.reset()
+
+    def reset(self):
+        self.routed = 0
+        self.skipped = 0
+
+    def needs_model(self, sentences):
+        """
+        Description: Boolean mask, True for the sentences that have to be scored by the model
+        """
+        hits = matcher.hit_matrix(sentences)
+        if self.route == "any":
+            routed = hits[:, :4].any(axis=1)
+        else:
+            routed = labels_from_hits(hits) != 2
+        self.routed += int(routed.sum())
+        self.skipped += int(len(routed) - routed.sum())
+        return routed
+
+    def fast_logits(self, num_labels: int):
+        logits = np.zeros(num_labels, dtype=np.float32)
+        logits[self.fast_label] = FAST_PATH_LOGIT
+        return logits
+
+    def saved_fraction(self):
+        total = self.routed + self.skipped
+        return self.skipped / total if total > 0 else 0.0
+
+    def report(self):
+        print("Rule prefilter (%s): %d sentences to the model, %d fast path (%.1f%% of forward passes saved)"
+              % (self.route, self.routed, self.skipped, 100 * self.saved_fraction()))
+
+
+def evaluate_cascade(model_path: str, test_data_dir: str = TEST_DATA_DIR, device="cpu", route: str = "any", fast_label: int = 2, output_path: str = None):
+    """
+    Description: Forward passes saved by the cascade and its divergence from the full model on the annotated test
+    files. The full model scores every sentence once; the cascade output is the same prediction with the fast path
+    label on the sentences the prefilter would not route, so both are compared on identical logits.
+    """
+    model, tokenizer = load_classifier(model_path, device)
+    labeler = StreamingLabeler(model, tokenizer, device)
+    prefilter = RulePrefilter(route, fast_label)
+
+    results = []
+    for f, sentences, actual in read_test_splits(test_data_dir):
+        full = labeler.predict_logits(sentences).argmax(axis=1)
+        routed = prefilter.needs_model(sentences)
+        cascade = np.where(routed, full, fast_label)
+        results.append([f, len(sentences), 1 - routed.mean(), (cascade != full).mean(),
+                        skm.f1_score(actual, full, average='weighted'), skm.f1_score(actual, cascade, average='weighted')])
+
+    df_results = pd.DataFrame(results, columns=["File", "Sentences", "Saved", "Divergence", "F1_full", "F1_cascade"])
+    print(df_results.to_string(index=False))
+    prefilter.report()
+    print("Mean divergence from the full model: %.4f, mean weighted F1 full %.4f, cascade %.4f"
+          % (df_results["Divergence"].mean(), df_results["F1_full"].mean(), df_results["F1_cascade"].mean()))
+    if output_path is not None:
+        df_results.to_excel(output_path, index=False)
+    return df_results
+
+
+if __name__ == "__main__":
+    device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
+    for route in ["any", "rule"]:
+        evaluate_cascade("gtfintechlab/FOMC-RoBERTa", TEST_DATA_DIR, device, route=route,
+                         output_path="../rule_based_results/cascade_" + route + ".xlsx")
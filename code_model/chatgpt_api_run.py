@@ -1,53 +1,41 @@
-import openai,os,sys
-openai.api_key = ""
-# messages = [
-#         {"role": "system", "content": "You are a helpful assistant."},
-# ]
 import os
+import asyncio
 
 import pandas as pd
-import numpy as np
-from time import sleep
-
-for seed in [5768, 78516, 944601]:
-    for data_category in ["lab-manual-combine", "lab-manual-sp", "lab-manual-mm", "lab-manual-pc", "lab-manual-mm-split", "lab-manual-pc-split", "lab-manual-sp-split", "lab-manual-split-combine"]:
-
-        # load training data
-        test_data_path = "../training_data/test-and-training/test_data/" + data_category + "-test" + "-" + str(seed) + ".xlsx"
-        data_df = pd.read_excel(test_data_path)
-
-
-        sentences = data_df['sentence'].to_list()
-        labels = data_df['label'].to_numpy()
-
-        # exit(0)
-        output_list = []
-        for i in range(len(sentences)): 
-            sen = sentences[i]
-            message = "Discard all the previous instructions. Behave like you are an expert sentence classifier. Classify the following sentence from FOMC into 'HAWKISH', 'DOVISH', or 'NEUTRAL' class. Label 'HAWKISH' if it is corresponding to tightening of the monetary policy, 'DOVISH' if it is corresponding to easing of the monetary policy, or 'NEUTRAL' if the stance is neutral. Provide the label in the first line and provide a short explanation in the second line. The sentence: " + sen
-            # messages.append(
-            #         {"role": "user", "content": message},
-            # )
-            messages = [
-                    {"role": "user", "content": message},
-            ]
-            try:
-                chat_completion = openai.ChatCompletion.create(
-                        model="gpt-3.5-turbo",
-                        messages=messages,
-                        temperature=0.0,
-                        max_tokens=1000
-                )
-            except Exception as e:
-                print(e)
-                i = i - 1
-                sleep(10.0)
-
-            answer = chat_completion.choices[0].message.content
-            
-            output_list.append([labels[i], sen, answer])
-            sleep(1.0) 
-
-            results = pd.DataFrame(output_list, columns=["true_label", "original_sent", "text_output"])
-
-            results.to_csv(f'../llm_prompt_test_labels/chatgpt_{data_category}_{seed}.csv', index=False)
+
+from llm_client import OPENAI_BASE_URL, ChatCompletionClient, ResponseCache, label_sentences
+from llm_labels import single_prompt, label_sentences_batched
+
+
+async def main(client: ChatCompletionClient, batch_size: int):
+    for seed in [5768, 78516, 944601]:
+        for data_category in ["lab-manual-combine", "lab-manual-sp", "lab-manual-mm", "lab-manual-pc", "lab-manual-mm-split", "lab-manual-pc-split", "lab-manual-sp-split", "lab-manual-split-combine"]:
+
+            # load test data
+            test_data_path = "../training_data/test-and-training/test_data/" + data_category + "-test" + "-" + str(seed) + ".xlsx"
+            data_df = pd.read_excel(test_data_path)
+
+            sentences = data_df['sentence'].to_list()
+            labels = data_df['label'].to_list()
+
+            if batch_size > 1:
+                failures, report = await label_sentences_batched(client, sentences, labels, f'../llm_prompt_test_labels/chatgpt_batched_{data_category}_{seed}.csv',
+                                                                 batch_size=batch_size)
+                print("Per labeled sentence: " + ", ".join("%s %.6g" % (key, value) for key, value in report.items()))
+            else:
+                failures = await label_sentences(client, sentences, labels, single_prompt, f'../llm_prompt_test_labels/chatgpt_{data_category}_{seed}.csv',
+                                                 temperature=0.0, max_tokens=1000)
+            print("%s %d: %d sentences, %d failed" % (data_category, seed, len(sentences), failures))
+            client.report()
+
+
+if __name__ == "__main__":
+    # sentences per request, 1 for the original one-sentence prompt; batched outputs go to chatgpt_batched_*.csv
+    batch_size = 1
+    # set OPENAI_BASE_URL to an OpenAI compatible server, e.g. llm_client.serve_mock(), to run without the API
+    client = ChatCompletionClient(model="gpt-3.5-turbo", base_url=os.environ.get("OPENAI_BASE_URL", OPENAI_BASE_URL), api_key=os.environ.get("OPENAI_API_KEY", ""),
+                                  max_in_flight=8, requests_per_minute=3500, tokens_per_minute=90000, cache=ResponseCache())
+    try:
+        asyncio.run(main(client, batch_size))
+    finally:
+        client.close()
@@ -1,29 +1,36 @@
+import os
+
 import numpy as np
 import pandas as pd
 
 from sklearn.metrics import f1_score
 from sklearn.metrics import accuracy_score
 
-def decode(x):
-    if x[:6] == "DOVISH":
-        return 0
-    elif x[:7] == "HAWKISH":
-        return 1
-    else: 
-        return 2
+from llm_labels import decode, parse_label, compare_modes
 
 for data_category in ["lab-manual-combine", "lab-manual-sp", "lab-manual-mm", "lab-manual-pc", "lab-manual-mm-split", "lab-manual-pc-split", "lab-manual-sp-split", "lab-manual-split-combine"]:
     acc_list = []
     f1_list = []
+    comparisons = []
     for seed in [5768, 78516, 944601]:
         df = pd.read_csv(f'../llm_prompt_test_labels/chatgpt_{data_category}_{seed}.csv')
-    
+
         df["predicted_label"] = df["text_output"].apply(lambda x: decode(x))
         acc_list.append(accuracy_score(df["true_label"], df["predicted_label"]))
         f1_list.append(f1_score(df["true_label"], df["predicted_label"], average='weighted'))
+        unparsed = df["text_output"].apply(parse_label).isna().sum()
+        if unparsed > 0:
+            print("%s %d: %d answers name no label, counted as NEUTRAL" % (data_category, seed, unparsed))
+
+        batched_path = f'../llm_prompt_test_labels/chatgpt_batched_{data_category}_{seed}.csv'
+        if os.path.exists(batched_path):
+            comparisons.append(compare_modes(df, pd.read_csv(batched_path)))
 
     print(data_category)
     print("f1 score mean: ", format(np.mean(f1_list), '.4f'))
     print("f1 score std: ", format(np.std(f1_list), '.4f'), "\n")
-
-    
\ No newline at end of file
+    if comparisons:
+        # batched prompting against the per-sentence outputs, on the sentences both modes labeled
+        comparisons = pd.DataFrame(comparisons)
+        print("batched vs per-sentence over %d seeds:" % len(comparisons))
+        print(comparisons.mean().to_string(float_format='%.4f'), "\n")
@@ -0,0 +1,100 @@
+import os
+import re
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.dataset as ds
+
+LABELED_DIRECTORIES = {
+    "mm": "../data/filtered_data/meeting_minutes_labeled/",
+    "sp": "../data/filtered_data/speech_labeled/",
+    "pc": "../data/filtered_data/press_conference_labeled/",
+}
+LABELED_DATASET_PATH = "../data/labeled_parquet"
+AGGREGATE_DIRECTORY = "../data/market_analysis_data"
+
+LABELED_SCHEMA = pa.schema([("source", pa.string()), ("year", pa.int32()), ("document_id", pa.string()), ("sentence_index", pa.int32()),
+                            ("sentence", pa.string()), ("label", pa.string()), ("score", pa.float64())])
+PARTITIONING = ds.partitioning(pa.schema([("source", pa.string()), ("year", pa.int32())]), flavor="hive")
+
+
+def document_id(labeled_file_path: str):
+    """
+    Description: Labeled file name without the labeled_ prefix and .csv extension, e.g. FOMCpresconf20110427_select_filtered
+    """
+    name = os.path.basename(labeled_file_path)
+    if name.startswith("labeled_"):
+        name = name[len("labeled_"):]
+    return os.path.splitext(name)[0]
+
+
+def document_year(doc_id: str):
+    match = re.search(r"(19|20)\d{2}", doc_id)
+    return int(match.group(0)) if match else 0
+
+
+def labeled_frame(labeled_file_path: str, source: str):
+    """
+    Description: One labeled csv as rows of (source, year, document_id, sentence_index, sentence, label, score)
+    """
+    df = pd.read_csv(labeled_file_path)
+    doc_id = document_id(labeled_file_path)
+    return pd.DataFrame({"source": source, "year": document_year(doc_id), "document_id": doc_id,
+                         "sentence_index": np.arange(len(df.index), dtype=np.int32), "sentence": df["sentence"],
+                         "label": df["label"], "score": df["score"] if "score" in df.columns else np.nan})
+
+
+def write_labeled_corpus(labeled_directories=LABELED_DIRECTORIES, dataset_path: str = LABELED_DATASET_PATH):
+    """
+    Description: Rewrite the labeled csv files of every source as one Parquet dataset partitioned by source and year
+    """
+    frames = []
+    for source, directory in labeled_directories.items():
+        for file in sorted(os.listdir(directory)):
+            if file.endswith(".csv"):
+                frames.append(labeled_frame(os.path.join(directory, file), source))
+    table = pa.Table.from_pandas(pd.concat(frames, ignore_index=True), schema=LABELED_SCHEMA, preserve_index=False)
+    ds.write_dataset(table, dataset_path, format="parquet", partitioning=PARTITIONING, existing_data_behavior="delete_matching")
+    print("Wrote %d sentences from %d files to %s" % (table.num_rows, len(frames), dataset_path))
+
+
+def read_labeled(columns=None, sources=None, years=None, dataset_path: str = LABELED_DATASET_PATH):
+    """
+    Description: Labeled sentences as a DataFrame, reading only the requested columns and only the partitions that
+    match the source and year filters
+    """
+    dataset = ds.dataset(dataset_path, format="parquet", partitioning=PARTITIONING)
+    expression = None
+    if sources is not None:
+        expression = ds.field("source").isin(list(sources))
+    if years is not None:
+        year_expression = ds.field("year").isin(list(years))
+        expression = year_expression if expression is None else expression & year_expression
+    return dataset.to_table(columns=columns, filter=expression).to_pandas()
+
+
+def aggregate_measure_path(source: str, directory: str = AGGREGATE_DIRECTORY):
+    return os.path.join(directory, "aggregate_measure_%s.parquet" % source)
+
+
+def write_aggregate_measure(df, source: str, directory: str = AGGREGATE_DIRECTORY, excel: bool = True):
+    """
+    Description: Store an aggregate measure table as Parquet, and as the usual xlsx if excel is set
+    """
+    df.to_parquet(aggregate_measure_path(source, directory), index=False)
+    if excel:
+        df.to_excel(os.path.join(directory, "aggregate_measure_%s.xlsx" % source), index=False)
+
+
+def read_aggregate_measure(source: str, columns=None, directory: str = AGGREGATE_DIRECTORY):
+    """
+    Description: Aggregate measure table of one source, from Parquet if it has been written, otherwise from the xlsx
+    """
+    if os.path.exists(aggregate_measure_path(source, directory)):
+        return pd.read_parquet(aggregate_measure_path(source, directory), columns=columns)
+    return pd.read_excel(os.path.join(directory, "aggregate_measure_%s.xlsx" % source), usecols=columns)
+
+
+if __name__ == "__main__":
+    write_labeled_corpus()
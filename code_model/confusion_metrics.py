@@ -0,0 +1,28 @@
+import numpy as np
+
+
+def confusion_matrix(actual, predicted, num_labels: int):
+    """
+    Description: (num_labels, num_labels) count matrix with actual labels as rows and predictions as columns
+    """
+    actual = np.asarray(actual, dtype=np.int64)
+    predicted = np.asarray(predicted, dtype=np.int64)
+    return np.bincount(actual * num_labels + predicted, minlength=num_labels ** 2).reshape(num_labels, num_labels)
+
+
+def accuracy_from_confusion(confusion):
+    total = confusion.sum()
+    return float(np.trace(confusion) / total) if total > 0 else 0.0
+
+
+def weighted_f1_from_confusion(confusion):
+    """
+    Description: Support weighted F1 as sklearn's f1_score(average='weighted'), with 0 for classes without predictions
+    """
+    true_positives = np.diag(confusion).astype(np.float64)
+    support = confusion.sum(axis=1)
+    predicted = confusion.sum(axis=0)
+    precision = np.divide(true_positives, predicted, out=np.zeros_like(true_positives), where=predicted > 0)
+    recall = np.divide(true_positives, support, out=np.zeros_like(true_positives), where=support > 0)
+    f1 = np.divide(2 * precision * recall, precision + recall, out=np.zeros_like(true_positives), where=precision + recall > 0)
+    return float((f1 * support).sum() / support.sum()) if support.sum() > 0 else 0.0
@@ -0,0 +1,162 @@
+import os
+import sys
+import json
+from time import time
+from types import SimpleNamespace
+
+import numpy as np
+import sklearn.metrics as skm
+import torch
+from transformers import AutoConfig, AutoTokenizer, AutoModelForSequenceClassification
+
+from batch_inference import TEST_DATA_DIR, load_classifier, read_test_splits, StreamingLabeler
+
+EXPORT_DIR = "../model_data/cpu_export"
+INT8_STATE_DICT = "pytorch_model_int8.bin"
+ONNX_FP32 = "model.onnx"
+ONNX_INT8 = "model_int8.onnx"
+
+
+def quantize_int8(model):
+    """
+    Description: Dynamically quantized copy of a classifier, INT8 weights for every nn.Linear and activations
+    quantized on the fly, for CPU inference
+    """
+    return torch.ao.quantization.quantize_dynamic(model.cpu().eval(), {torch.nn.Linear}, dtype=torch.qint8)
+
+
+def load_int8(export_dir: str = EXPORT_DIR):
+    """
+    Description: INT8 PyTorch classifier and tokenizer written by export_for_cpu
+    """
+    config = AutoConfig.from_pretrained(export_dir)
+    tokenizer = AutoTokenizer.from_pretrained(export_dir, do_lower_case=True, do_basic_tokenize=True)
+    model = quantize_int8(AutoModelForSequenceClassification.from_config(config))
+    model.load_state_dict(torch.load(os.path.join(export_dir, INT8_STATE_DICT), map_location="cpu"))
+    return model.eval(), tokenizer
+
+
+class _LogitsOnly(torch.nn.Module):
+    def __init__(self, model):
+        super().__init__()
+        self.model = model
+
+    def forward(self, input_ids, attention_mask):
+        return self.model(input_ids=input_ids, attention_mask=attention_mask).logits
+
+
+def export_onnx(model, tokenizer, onnx_path: str, opset_version: int = 14):
+    """
+    Description: fp32 ONNX graph with dynamic batch and sequence axes, inputs input_ids/attention_mask, output logits
+    """
+    sample = tokenizer(["The Committee decided to maintain the target range for the federal funds rate."], return_tensors='pt')
+    torch.onnx.export(_LogitsOnly(model.cpu().eval()), (sample['input_ids'], sample['attention_mask']), onnx_path,
+                      input_names=['input_ids', 'attention_mask'], output_names=['logits'], opset_version=opset_version,
+                      dynamic_axes={'input_ids': {0: 'batch', 1: 'sequence'}, 'attention_mask': {0: 'batch', 1: 'sequence'}, 'logits': {0: 'batch'}})
+
+
+def quantize_onnx(onnx_path: str, quantized_path: str):
+    from onnxruntime.quantization import quantize_dynamic, QuantType
+    quantize_dynamic(onnx_path, quantized_path, weight_type=QuantType.QInt8)
+
+
+class OnnxClassifier:
+    """
+    Description: ONNX Runtime session behind the interface StreamingLabeler expects from a model: a config and a
+    call with input_ids and attention_mask that returns an object with logits
+    """
+    def __init__(self, onnx_path: str, config, num_threads: int = None):
+        import onnxruntime as ort
+        options = ort.SessionOptions()
+        if num_threads is not None:
+            options.intra_op_num_threads = num_threads
+        self.session = ort.InferenceSession(onnx_path, options, providers=["CPUExecutionProvider"])
+        self.config = config
+
+    def __call__(self, input_ids, attention_mask):
+        logits = self.session.run(['logits'], {'input_ids': input_ids.cpu().numpy().astype(np.int64),
+                                               'attention_mask': attention_mask.cpu().numpy().astype(np.int64)})[0]
+        return SimpleNamespace(logits=torch.from_numpy(logits))
+
+    def eval(self):
+        return self
+
+
+def load_onnx(export_dir: str = EXPORT_DIR, quantized: bool = True, num_threads: int = None):
+    """
+    Description: ONNX Runtime classifier and tokenizer written by export_for_cpu
+    """
+    config = AutoConfig.from_pretrained(export_dir)
+    tokenizer = AutoTokenizer.from_pretrained(export_dir, do_lower_case=True, do_basic_tokenize=True)
+    return OnnxClassifier(os.path.join(export_dir, ONNX_INT8 if quantized else ONNX_FP32), config, num_threads), tokenizer
+
+
+def test_split_f1(model, tokenizer, test_data_dir: str = TEST_DATA_DIR, batch_size: int = 64):
+    """
+    Description: Mean weighted F1 over the annotated test splits and the sentences per second it was computed at, on CPU
+    """
+    labeler = StreamingLabeler(model, tokenizer, torch.device("cpu"), batch_size=batch_size)
+    f1_scores = []
+    count_sentences = 0
+    start_t = time()
+    for f, sentences, actual in read_test_splits(test_data_dir):
+        predicted = labeler.predict_logits(sentences).argmax(axis=1)
+        f1_scores.append(skm.f1_score(actual, predicted, average='weighted'))
+        count_sentences += len(sentences)
+    return float(np.mean(f1_scores)), count_sentences / max(time() - start_t, 1e-9)
+
+
+def export_for_cpu(model_path: str, export_dir: str = EXPORT_DIR, test_data_dir: str = TEST_DATA_DIR, max_f1_drop: float = 0.01, onnx: bool = True):
+    """
+    Description: Export a fine-tuned checkpoint (a save_pretrained directory such as ../model_data/final_model... or
+    a hub id) as a dynamically quantized INT8 PyTorch model and, if onnx is set, as fp32 and INT8 ONNX graphs.
+    Every artifact is scored on the test splits and only kept if its weighted F1 is at most max_f1_drop below the
+    fp32 checkpoint; the scores and decisions are written to export_report.json. Returns the report, raises a
+    RuntimeError if no artifact passes the accuracy guard.
+    """
+    os.makedirs(export_dir, exist_ok=True)
+    model, tokenizer = load_classifier(model_path, torch.device("cpu"))
+
+    report = {"model_path": model_path, "max_f1_drop": max_f1_drop}
+    f1_fp32, speed_fp32 = test_split_f1(model, tokenizer, test_data_dir)
+    report["fp32"] = {"f1": f1_fp32, "sentences_per_sec": speed_fp32}
+    print("fp32: weighted F1 %.4f, %.1f sentences/sec" % (f1_fp32, speed_fp32))
+
+    def guard(name, candidate, path):
+        f1, speed = test_split_f1(candidate, tokenizer, test_data_dir)
+        accepted = f1_fp32 - f1 <= max_f1_drop
+        report[name] = {"f1": f1, "sentences_per_sec": speed, "speedup": speed / speed_fp32, "accepted": accepted, "path": path}
+        print("%s: weighted F1 %.4f (%+.4f), %.1f sentences/sec (%.2fx) -> %s"
+              % (name, f1, f1 - f1_fp32, speed, speed / speed_fp32, "accepted" if accepted else "refused"))
+        return accepted
+
+    tokenizer.save_pretrained(export_dir)
+    model.config.save_pretrained(export_dir)
+
+    int8_model = quantize_int8(model)
+    int8_path = os.path.join(export_dir, INT8_STATE_DICT)
+    if guard("int8", int8_model, int8_path):
+        torch.save(int8_model.state_dict(), int8_path)
+    elif os.path.exists(int8_path):
+        os.remove(int8_path)
+
+    if onnx:
+        onnx_path = os.path.join(export_dir, ONNX_FP32)
+        onnx_int8_path = os.path.join(export_dir, ONNX_INT8)
+        export_onnx(model, tokenizer, onnx_path)
+        quantize_onnx(onnx_path, onnx_int8_path)
+        for name, path in [("onnx_fp32", onnx_path), ("onnx_int8", onnx_int8_path)]:
+            if not guard(name, OnnxClassifier(path, model.config), path):
+                os.remove(path)
+
+    with open(os.path.join(export_dir, "export_report.json"), 'w') as f:
+        json.dump(report, f, indent=1)
+    if not any(entry.get("accepted") for entry in report.values() if isinstance(entry, dict)):
+        raise RuntimeError("No CPU artifact of %s is within %.4f weighted F1 of the fp32 model, see %s"
+                           % (model_path, max_f1_drop, os.path.join(export_dir, "export_report.json")))
+    return report
+
+
+if __name__ == "__main__":
+    model_path = sys.argv[1] if len(sys.argv) > 1 else "gtfintechlab/FOMC-RoBERTa"
+    export_for_cpu(model_path)
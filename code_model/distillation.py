@@ -0,0 +1,214 @@
+import os
+from time import time
+
+import numpy as np
+import pandas as pd
+import torch
+import torch.nn.functional as F
+import torch.optim as optim
+from sklearn.metrics import f1_score
+
+from dynamic_padding import TokenizedSentenceDataset, bucketed_data_loader
+from model_registry import load_tokenizer, load_model
+from tokenization_cache import read_sentences
+from batch_inference import load_classifier, find_corpus_files, StreamingLabeler
+from file_manifest import model_identifier
+from prediction_cache import PredictionCache, normalize_sentence
+
+SOFT_LABEL_PATH = "../model_data/distillation/soft_labels.parquet"
+TEACHER_PATH = "../model_data/final_modelroberta-largelab-manual-split-combine-944601-1e-06-4"
+ANNOTATED_DIRECTORIES = ["../training_data/test-and-training/training_data/", "../training_data/test-and-training/test_data/"]
+
+
+class SoftLabelDataset(TokenizedSentenceDataset):
+    """
+    Description: Tokenized sentences with teacher logits. Sentences of the unlabeled corpus have label -100 and only
+    contribute to the soft target loss.
+    """
+    def __init__(self, input_ids, labels, teacher_logits):
+        super().__init__(input_ids, labels)
+        self.teacher_logits = np.asarray(teacher_logits, dtype=np.float32)
+
+    def __getitem__(self, idx):
+        return self.input_ids[idx], self.labels[idx], self.teacher_logits[idx]
+
+
+def soft_label_corpus(teacher, data_path: str = "../data/filtered_data", soft_label_path: str = SOFT_LABEL_PATH):
+    """
+    Description: Teacher logits for every distinct sentence of the filtered corpus, stored as a Parquet table with
+    a sentence and one logit_k column per label. teacher is a StreamingLabeler, ideally with a PredictionCache so
+    sentences the teacher already labeled for the corpus are not scored again.
+    """
+    sentences = []
+    for input_file, _ in find_corpus_files(data_path, data_path):
+        sentences.extend(s for s in pd.read_csv(input_file)["sentence"] if isinstance(s, str))
+    sentences = list(dict.fromkeys(sentences))
+    print("Soft labeling %d distinct corpus sentences" % len(sentences))
+
+    logits = np.concatenate([teacher.predict_logits(sentences[start:start + teacher.window_size])
+                             for start in range(0, len(sentences), teacher.window_size)] or [np.zeros((0, teacher.num_labels), dtype=np.float32)])
+    df = pd.DataFrame({"sentence": sentences})
+    for k in range(logits.shape[1]):
+        df["logit_%d" % k] = logits[:, k]
+    os.makedirs(os.path.dirname(soft_label_path), exist_ok=True)
+    df.to_parquet(soft_label_path, index=False)
+    return df
+
+
+def annotated_sentences(directories=ANNOTATED_DIRECTORIES):
+    """
+    Description: Normalized sentences of every annotated train and test split, of all categories and seeds
+    """
+    sentences = set()
+    for directory in directories:
+        for file in sorted(os.listdir(directory)):
+            if file.endswith(".xlsx"):
+                sentences.update(normalize_sentence(s) for s in read_sentences(os.path.join(directory, file))[0])
+    return sentences
+
+
+def drop_annotated(soft_labels, annotated):
+    """
+    Description: Soft label rows whose sentence is in none of the annotated splits. The filtered corpus contains most
+    annotated sentences, and a student trained on teacher logits of its own validation and test sentences would be
+    scored on what it was fit to.
+    """
+    keep = ~soft_labels["sentence"].map(normalize_sentence).isin(annotated)
+    print("Dropped %d soft labeled sentences that appear in the annotated splits" % (len(keep) - keep.sum()))
+    return soft_labels[keep].reset_index(drop=True)
+
+
+def distillation_loss(student_logits, teacher_logits, labels, temperature: float, alpha: float):
+    """
+    Description: alpha * T^2 * KL(teacher || student) on temperature softened distributions plus (1 - alpha) * cross
+    entropy on the rows with a gold label (label >= 0). Written without a data dependent branch, so it never syncs.
+    """
+    soft = F.kl_div(F.log_softmax(student_logits / temperature, dim=-1), F.softmax(teacher_logits / temperature, dim=-1),
+                    reduction='batchmean') * temperature ** 2
+    hard = F.cross_entropy(student_logits, labels, ignore_index=-100, reduction='sum') / (labels >= 0).sum().clamp(min=1)
+    return alpha * soft + (1 - alpha) * hard
+
+
+def evaluate(model, tokenizer, sentences, labels, device, batch_size: int = 64):
+    """
+    Description: Weighted F1 and milliseconds per sentence of a classifier on an annotated split
+    """
+    labeler = StreamingLabeler(model, tokenizer, device, batch_size=batch_size)
+    start_t = time()
+    predicted = labeler.predict_logits(sentences).argmax(axis=1)
+    elapsed = time() - start_t
+    return f1_score(labels, predicted, average='weighted'), 1000 * elapsed / max(len(sentences), 1)
+
+
+def train_student(student: str, teacher, soft_labels, train_data_path: str, seed: int, batch_size: int, learning_rate: float,
+                  temperature: float = 2.0, alpha: float = 0.5, max_num_epochs: int = 10, max_early_stopping: int = 3, test_sentences=None):
+    """
+    Description: Train a registered student model on the teacher logits of the corpus and of the annotated training
+    split (which also gives the hard label loss). 20% of the annotated split is held out with its gold labels for
+    early stopping on weighted F1; the weights of the best epoch are returned.
+    soft_labels must not contain annotated sentences (see drop_annotated), which is checked against the validation
+    part and test_sentences.
+    """
+    device = torch.device('cuda') if torch.cuda.is_available() else torch.device('cpu')
+    tokenizer = load_tokenizer(student)
+    max_length = 256
+
+    torch.manual_seed(seed)
+    np.random.seed(seed)
+
+    gold_sentences, gold_labels = read_sentences(train_data_path)
+    permutation = np.random.permutation(len(gold_sentences))
+    val_length = int(len(gold_sentences) * 0.2)
+    val_index, train_index = permutation[:val_length], permutation[val_length:]
+    held_out = [normalize_sentence(gold_sentences[i]) for i in val_index] + [normalize_sentence(s) for s in (test_sentences or [])]
+    assert not soft_labels["sentence"].map(normalize_sentence).isin(held_out).any(), \
+        "the soft label corpus contains validation or test sentences, filter it with drop_annotated"
+
+    train_sentences = [gold_sentences[i] for i in train_index] + soft_labels["sentence"].tolist()
+    train_labels = np.concatenate([gold_labels[train_index], np.full(len(soft_labels.index), -100, dtype=np.int64)])
+    logit_columns = [column for column in soft_labels.columns if column.startswith("logit_")]
+    train_logits = np.concatenate([teacher.predict_logits([gold_sentences[i] for i in train_index]), soft_labels[logit_columns].to_numpy(dtype=np.float32)])
+    print("Student %s: %d annotated and %d corpus sentences, %d validation sentences" % (student, len(train_index), len(soft_labels.index), val_length))
+
+    train = SoftLabelDataset(tokenizer(train_sentences, truncation=True, max_length=max_length)['input_ids'], train_labels, train_logits)
+    val_sentences = [gold_sentences[i] for i in val_index]
+    val_labels = gold_labels[val_index]
+
+    model = load_model(student, device)
+    optimizer = optim.AdamW(model.parameters(), lr=learning_rate)
+    train_loader = bucketed_data_loader(train, batch_size, tokenizer, shuffle=True)
+
+    best_f1 = float('-inf')
+    best_state = None
+    early_stopping_count = 0
+    eps = 1e-2
+    for epoch in range(max_num_epochs):
+        model.train()
+        curr_loss = torch.zeros((), device=device)
+        for input_ids, attention_masks, labels, teacher_logits in train_loader:
+            optimizer.zero_grad()
+            outputs = model(input_ids=input_ids.to(device), attention_mask=attention_masks.to(device))
+            loss = distillation_loss(outputs.logits, teacher_logits.to(device), labels.to(device), temperature, alpha)
+            loss.backward()
+            optimizer.step()
+            curr_loss += loss.detach() * input_ids.size(0)
+        model.eval()
+        val_f1, _ = evaluate(model, tokenizer, val_sentences, val_labels, device)
+        print("epoch(%d) distillation loss: %.4f, val F1: %.4f" % (epoch, curr_loss.item() / len(train), val_f1))
+        if val_f1 >= best_f1 + eps or best_state is None:
+            best_f1 = val_f1
+            best_state = {name: tensor.detach().cpu().clone() for name, tensor in model.state_dict().items()}
+            early_stopping_count = 0
+        else:
+            early_stopping_count += 1
+            if early_stopping_count >= max_early_stopping:
+                break
+    model.load_state_dict(best_state)
+    return model.eval(), tokenizer
+
+
+def distill(teacher_path: str = TEACHER_PATH, student: str = "distilroberta", data_category: str = "lab-manual-split-combine", seed: int = 944601,
+            batch_size: int = 32, learning_rate: float = 5e-5, temperature: float = 2.0, alpha: float = 0.5,
+            soft_label_path: str = SOFT_LABEL_PATH, save_model_path: str = "../model_data/final_model"):
+    """
+    Description: Soft label the corpus with the teacher (reusing an existing soft label table), train the student and
+    compare weighted F1 and CPU latency of teacher and student on the test split of the same seed
+    """
+    device = torch.device('cuda') if torch.cuda.is_available() else torch.device('cpu')
+    teacher_model, teacher_tokenizer = load_classifier(teacher_path, device)
+    teacher = StreamingLabeler(teacher_model, teacher_tokenizer, device, cache=PredictionCache(model_identifier(teacher_path)))
+
+    if os.path.exists(soft_label_path):
+        soft_labels = pd.read_parquet(soft_label_path)
+    else:
+        soft_labels = soft_label_corpus(teacher, soft_label_path=soft_label_path)
+    # no sentence of any annotated split (train, validation or test, of any category and seed) is distilled from the corpus
+    soft_labels = drop_annotated(soft_labels, annotated_sentences())
+
+    train_data_path = "../training_data/test-and-training/training_data/" + data_category + "-train-" + str(seed) + ".xlsx"
+    test_data_path = "../training_data/test-and-training/test_data/" + data_category + "-test-" + str(seed) + ".xlsx"
+    test_sentences, test_labels = read_sentences(test_data_path)
+    model, tokenizer = train_student(student, teacher, soft_labels, train_data_path, seed, batch_size, learning_rate, temperature, alpha,
+                                     test_sentences=test_sentences)
+
+    save_path = save_model_path + student + "-distilled-" + data_category + "-" + str(seed)
+    model.save_pretrained(save_path)
+    tokenizer.save_pretrained(save_path)
+
+    # latency is measured on CPU, where the corpus relabeling runs
+    cpu = torch.device('cpu')
+    results = []
+    for name, candidate, candidate_tokenizer in [("teacher", teacher_model, teacher_tokenizer), (student, model, tokenizer)]:
+        candidate = candidate.to(cpu)
+        f1, ms_per_sentence = evaluate(candidate, candidate_tokenizer, test_sentences, test_labels, cpu)
+        results.append([name, sum(p.numel() for p in candidate.parameters()) / 1e6, f1, ms_per_sentence])
+    df_results = pd.DataFrame(results, columns=["Model", "Parameters (M)", "Test F1 Score", "CPU ms/sentence"])
+    df_results["Speedup"] = df_results["CPU ms/sentence"].iloc[0] / df_results["CPU ms/sentence"]
+    print(df_results.to_string(index=False))
+    os.makedirs("../grid_search_results_repro", exist_ok=True)
+    df_results.to_excel("../grid_search_results_repro/distillation_%s_%s.xlsx" % (data_category, student), index=False)
+    return df_results
+
+
+if __name__ == "__main__":
+    distill()
@@ -0,0 +1,138 @@
+from time import time
+
+import torch
+from torch.utils.data import Dataset, Sampler, Subset, DataLoader
+
+
+class TokenizedSentenceDataset(Dataset):
+    """
+    Description: Sentences kept as unpadded token id lists so that each batch can be padded to its own max length
+    """
+    def __init__(self, input_ids, labels):
+        self.input_ids = input_ids
+        self.labels = [int(label) for label in labels]
+
+    @classmethod
+    def from_padded(cls, input_ids, attention_masks, labels):
+        """
+        Description: Build from padded (N, L) arrays by keeping a view of the unpadded part of every row
+        """
+        lengths = attention_masks.sum(axis=1)
+        starts = attention_masks.argmax(axis=1)
+        return cls([input_ids[i, starts[i]:starts[i] + lengths[i]] for i in range(len(lengths))], labels)
+
+    def __len__(self):
+        return len(self.input_ids)
+
+    def __getitem__(self, idx):
+        return self.input_ids[idx], self.labels[idx]
+
+    def lengths(self):
+        return [len(ids) for ids in self.input_ids]
+
+
+def get_lengths(dataset):
+    """
+    Description: Token lengths of a TokenizedSentenceDataset or of a Subset (e.g. from random_split) of one
+    """
+    if isinstance(dataset, Subset):
+        parent_lengths = get_lengths(dataset.dataset)
+        return [parent_lengths[i] for i in dataset.indices]
+    return dataset.lengths()
+
+
+class LengthBucketBatchSampler(Sampler):
+    """
+    Description: Shuffles the indices, cuts them into buckets of batch_size * bucket_size_multiplier, sorts every
+    bucket by token length and yields batches of similar length sentences in random order
+    """
+    def __init__(self, lengths, batch_size: int, shuffle: bool = True, bucket_size_multiplier: int = 50, generator=None):
+        self.lengths = list(lengths)
+        self.batch_size = batch_size
+        self.shuffle = shuffle
+        self.bucket_size = batch_size * bucket_size_multiplier
+        self.generator = generator
+
+    def __iter__(self):
+        if self.shuffle:
+            indices = torch.randperm(len(self.lengths), generator=self.generator).tolist()
+        else:
+            indices = list(range(len(self.lengths)))
+
+        batches = []
+        for start in range(0, len(indices), self.bucket_size):
+            bucket = sorted(indices[start:start + self.bucket_size], key=lambda i: self.lengths[i])
+            for batch_start in range(0, len(bucket), self.batch_size):
+                batches.append(bucket[batch_start:batch_start + self.batch_size])
+
+        if self.shuffle:
+            order = torch.randperm(len(batches), generator=self.generator).tolist()
+            batches = [batches[i] for i in order]
+        return iter(batches)
+
+    def __len__(self):
+        return (len(self.lengths) + self.batch_size - 1) // self.batch_size
+
+
+class DynamicPaddingCollator:
+    """
+    Description: Pads a list of (input_ids, label) pairs only up to the longest sentence in the batch.
+    Items may carry a third element, a vector of soft targets (e.g. teacher logits), which is stacked and returned
+    as a fourth tensor.
+    """
+    def __init__(self, pad_token_id: int, padding_side: str = 'right'):
+        self.pad_token_id = pad_token_id if pad_token_id is not None else 0
+        self.padding_side = padding_side
+
+    def __call__(self, batch):
+        max_length = max(len(item[0]) for item in batch)
+        input_ids = torch.full((len(batch), max_length), self.pad_token_id, dtype=torch.long)
+        attention_masks = torch.zeros((len(batch), max_length), dtype=torch.long)
+        for i, item in enumerate(batch):
+            ids = item[0]
+            if self.padding_side == 'left':
+                input_ids[i, max_length - len(ids):] = torch.tensor(ids, dtype=torch.long)
+                attention_masks[i, max_length - len(ids):] = 1
+            else:
+                input_ids[i, :len(ids)] = torch.tensor(ids, dtype=torch.long)
+                attention_masks[i, :len(ids)] = 1
+        labels = torch.tensor([item[1] for item in batch], dtype=torch.long)
+        if len(batch[0]) > 2:
+            return input_ids, attention_masks, labels, torch.stack([torch.as_tensor(item[2], dtype=torch.float) for item in batch])
+        return input_ids, attention_masks, labels
+
+
+def bucketed_data_loader(dataset, batch_size: int, tokenizer, shuffle: bool = True, bucket_size_multiplier: int = 50, generator=None):
+    """
+    Description: DataLoader over a TokenizedSentenceDataset (or a Subset of one) with length bucketing and per-batch padding
+    """
+    sampler = LengthBucketBatchSampler(get_lengths(dataset), batch_size, shuffle=shuffle, bucket_size_multiplier=bucket_size_multiplier, generator=generator)
+    collator = DynamicPaddingCollator(tokenizer.pad_token_id, getattr(tokenizer, 'padding_side', 'right'))
+    return DataLoader(dataset, batch_sampler=sampler, collate_fn=collator)
+
+
+class TokenThroughputMeter:
+    """
+    Description: Counts real (non-padding) and padded tokens fed to the model and reports tokens processed per second
+    """
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.tokens = 0
+        self.padded_tokens = 0
+        self.start_time = time()
+
+    def update(self, attention_masks):
+        # expects the CPU mask straight from the DataLoader so that counting never forces a device sync
+        self.tokens += int(attention_masks.sum())
+        self.padded_tokens += attention_masks.numel()
+
+    def elapsed(self):
+        return max(time() - self.start_time, 1e-9)
+
+    def tokens_per_second(self):
+        return self.tokens / self.elapsed()
+
+    def padding_efficiency(self):
+        return self.tokens / self.padded_tokens if self.padded_tokens > 0 else 1.0
@@ -0,0 +1,61 @@
+import os
+import json
+
+from tokenization_cache import file_hash
+
+
+def model_identifier(model_path: str):
+    """
+    Description: Stable id of a fine-tuned checkpoint: its absolute directory, or the hub id for remote models
+    """
+    return os.path.abspath(model_path) if os.path.isdir(model_path) else model_path
+
+
+class FileManifest:
+    """
+    Description: JSON manifest of processed files keyed by path, storing the content hash each file had when it was
+    processed plus arbitrary fields (model id, output file, computed measure). The hash is only recomputed when the
+    size or modification time of a file changed.
+    """
+    def __init__(self, path: str):
+        self.path = path
+        self.entries = {}
+        if os.path.exists(path):
+            with open(path) as f:
+                self.entries = json.load(f)
+
+    @staticmethod
+    def _key(file_path: str):
+        return os.path.normpath(file_path)
+
+    def content_hash(self, file_path: str):
+        stat = os.stat(file_path)
+        entry = self.entries.get(self._key(file_path))
+        if entry is not None and entry["size"] == stat.st_size and entry["mtime_ns"] == stat.st_mtime_ns:
+            return entry["hash"]
+        return file_hash(file_path)
+
+    def is_current(self, file_path: str, **fields):
+        """
+        Description: True if the file is unchanged since it was recorded and was recorded with the same fields
+        """
+        entry = self.entries.get(self._key(file_path))
+        if entry is None or not os.path.exists(file_path):
+            return False
+        if any(entry.get(name) != value for name, value in fields.items()):
+            return False
+        return self.content_hash(file_path) == entry["hash"]
+
+    def get(self, file_path: str, field: str, default=None):
+        return self.entries.get(self._key(file_path), {}).get(field, default)
+
+    def record(self, file_path: str, **fields):
+        stat = os.stat(file_path)
+        self.entries[self._key(file_path)] = dict(fields, hash=self.content_hash(file_path), size=stat.st_size, mtime_ns=stat.st_mtime_ns)
+
+    def save(self):
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump(self.entries, f, indent=1)
+        os.replace(tmp_path, self.path)
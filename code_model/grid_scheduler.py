@@ -0,0 +1,188 @@
+import os
+import json
+import uuid
+import itertools
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import pandas as pd
+
+SEEDS = [5768, 78516, 944601]
+BATCH_SIZES = [32, 16, 8, 4]
+LEARNING_RATES = [1e-4, 1e-5, 1e-6, 1e-7]
+RESULT_COLUMNS = ["Seed", "Learning Rate", "Batch Size", "Val Cross Entropy", "Val Accuracy", "Val F1 Score", "Test Cross Entropy", "Test Accuracy", "Test F1 Score",
+                  "Peak Memory (MB)", "Step Time (s)"]
+
+TRAIN_DATA_PATH_PREFIX = "../training_data/test-and-training/training_data/"
+TEST_DATA_PATH_PREFIX = "../training_data/test-and-training/test_data/"
+RESULTS_DIR = "../grid_search_results_repro"
+COMPLETED_JOBS_PATH = "../model_data/completed_jobs.jsonl"
+
+
+def expand_grid(language_models, data_categories, seeds=SEEDS, batch_sizes=BATCH_SIZES, learning_rates=LEARNING_RATES):
+    """
+    Description: One job per (model, data category, seed, batch size, learning rate) cell, in the order of the sequential loops
+    """
+    jobs = []
+    for language_model_to_use, data_category, seed, batch_size, learning_rate in itertools.product(language_models, data_categories, seeds, batch_sizes, learning_rates):
+        jobs.append({"language_model_to_use": language_model_to_use, "data_category": data_category, "seed": seed,
+                     "batch_size": batch_size, "learning_rate": learning_rate})
+    return jobs
+
+
+def job_id(job):
+    return "%s|%s|%d|%d|%g" % (job["language_model_to_use"], job["data_category"], job["seed"], job["batch_size"], job["learning_rate"])
+
+
+def load_completed_jobs(completed_jobs_path: str = COMPLETED_JOBS_PATH):
+    """
+    Description: Results of every finished job keyed by job id, read from the append-only completion log
+    """
+    completed = {}
+    if os.path.exists(completed_jobs_path):
+        with open(completed_jobs_path) as f:
+            for line in f:
+                line = line.strip()
+                if line:
+                    record = json.loads(line)
+                    completed[record["job_id"]] = record
+    return completed
+
+
+def record_completed_job(job, result, completed_jobs_path: str = COMPLETED_JOBS_PATH):
+    record = dict(job, job_id=job_id(job), result=result)
+    os.makedirs(os.path.dirname(completed_jobs_path), exist_ok=True)
+    with open(completed_jobs_path, 'a') as f:
+        f.write(json.dumps(record) + "\n")
+        f.flush()
+        os.fsync(f.fileno())
+    return record
+
+
+def grid_run_id(progress_path: str = COMPLETED_JOBS_PATH, resumed: bool = True):
+    """
+    Description: Id of the grid run a progress file (the completion log, or the checkpoint of the sequential loops)
+    belongs to, stored next to it. A resumed grid keeps the id of the run it continues, a fresh one gets a new id.
+    """
+    path = os.path.splitext(progress_path)[0] + "_run_id.txt"
+    if resumed and os.path.exists(path):
+        with open(path) as f:
+            return f.read().strip()
+    run_id = uuid.uuid4().hex[:12]
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'w') as f:
+        f.write(run_id + "\n")
+    return run_id
+
+
+def write_results(jobs, completed, language_model_to_use: str, data_category: str, results_dir: str = RESULTS_DIR):
+    """
+    Description: Rewrite final_{data_category}_{model}.xlsx from all finished cells of that model and category, in grid order
+    """
+    results = [completed[job_id(job)]["result"] for job in jobs
+               if job["language_model_to_use"] == language_model_to_use and job["data_category"] == data_category and job_id(job) in completed]
+    # jobs logged before peak memory and step time were recorded have shorter rows
+    results = [result + [None] * (len(RESULT_COLUMNS) - len(result)) for result in results]
+    df = pd.DataFrame(results, columns=RESULT_COLUMNS)
+    os.makedirs(results_dir, exist_ok=True)
+    df.to_excel(os.path.join(results_dir, f'final_{data_category}_{language_model_to_use}.xlsx'), index=False)
+
+
+def _init_worker(threads_per_job: int):
+    # each worker process gets its own slice of the CPU instead of every process spawning one thread per core
+    os.environ["OMP_NUM_THREADS"] = str(threads_per_job)
+    os.environ["MKL_NUM_THREADS"] = str(threads_per_job)
+    import torch
+    torch.set_num_threads(threads_per_job)
+
+
+_worker_language_model = None
+
+
+def _run_job(job, gpu_numbers: str, save_model_path: str, pruning: bool, run_id: str, training_options):
+    global _worker_language_model
+    from training_engine import train_lm_hawkish_dovish
+    from model_registry import clear_cache
+    from pruning import grid_pruner
+
+    # keep only the pristine weights of the model this worker is currently training
+    if _worker_language_model != job["language_model_to_use"]:
+        clear_cache()
+        _worker_language_model = job["language_model_to_use"]
+    train_data_path = TRAIN_DATA_PATH_PREFIX + job["data_category"] + "-train-" + str(job["seed"]) + ".xlsx"
+    test_data_path = TEST_DATA_PATH_PREFIX + job["data_category"] + "-test-" + str(job["seed"]) + ".xlsx"
+    pruner = grid_pruner(job["language_model_to_use"], job["data_category"], job["seed"], "%d-%g" % (job["batch_size"], job["learning_rate"]), run_id) if pruning else None
+    return train_lm_hawkish_dovish(gpu_numbers, train_data_path, test_data_path, job["language_model_to_use"], job["seed"], job["batch_size"],
+                                   job["learning_rate"], save_model_path, data_category=job["data_category"], pruner=pruner, **training_options)
+
+
+def _run_multi_seed_job(group_jobs, gpu_numbers: str, save_model_path: str, training_options):
+    """
+    Description: Train the seeds of one (model, data category, batch size, learning rate) cell together (see multi_seed.py),
+    one result per job
+    """
+    from multi_seed import train_lm_hawkish_dovish_multi_seed
+    from model_registry import clear_cache
+
+    clear_cache()
+    job = group_jobs[0]
+    seeds = [group_job["seed"] for group_job in group_jobs]
+    train_data_paths = [TRAIN_DATA_PATH_PREFIX + job["data_category"] + "-train-" + str(seed) + ".xlsx" for seed in seeds]
+    test_data_paths = [TEST_DATA_PATH_PREFIX + job["data_category"] + "-test-" + str(seed) + ".xlsx" for seed in seeds]
+    results = train_lm_hawkish_dovish_multi_seed(gpu_numbers, train_data_paths, test_data_paths, job["language_model_to_use"], seeds, job["batch_size"],
+                                                 job["learning_rate"], save_model_path, data_category=job["data_category"], **training_options)
+    return [-1] * len(group_jobs) if results == -1 else results
+
+
+def group_by_cell(jobs):
+    """
+    Description: Jobs that only differ in their seed, grouped in grid order
+    """
+    groups = {}
+    for job in jobs:
+        key = (job["language_model_to_use"], job["data_category"], job["batch_size"], job["learning_rate"])
+        groups.setdefault(key, []).append(job)
+    return list(groups.values())
+
+
+def run_grid(language_models, data_categories, num_workers: int, threads_per_job: int, gpu_numbers: str = "0",
+             save_model_path: str = "../model_data/final_model", completed_jobs_path: str = COMPLETED_JOBS_PATH, results_dir: str = RESULTS_DIR, pruning: bool = False,
+             training_options=None, multi_seed: bool = False):
+    """
+    Description: Run the full hyperparameter grid as a queue of independent jobs on num_workers processes.
+    Every finished job is appended to the completion log, so a restarted run only trains the unfinished cells.
+    With pruning, cells that fall behind the other cells of the same seed in this grid run are stopped early (see
+    pruning.py); a resumed grid keeps comparing against the run it continues, a fresh one starts a new history.
+    training_options are passed on to train_lm_hawkish_dovish (precision, gradient_accumulation_steps, gradient_checkpointing).
+    multi_seed: train the unfinished seeds of every cell as one vectorized ensemble, one worker job per cell;
+    every seed is still logged as its own job. Pruning is not available in this mode.
+    """
+    jobs = expand_grid(language_models, data_categories)
+    completed = load_completed_jobs(completed_jobs_path)
+    pending = [job for job in jobs if job_id(job) not in completed]
+    run_id = grid_run_id(completed_jobs_path, resumed=len(completed) > 0)
+    print("Grid: %d jobs, %d already finished, %d to run on %d workers x %d threads" % (len(jobs), len(jobs) - len(pending), len(pending), num_workers, threads_per_job))
+
+    # spawn rather than fork so CUDA and the torch thread pools are set up fresh in every worker
+    context = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(max_workers=num_workers, mp_context=context, initializer=_init_worker, initargs=(threads_per_job,)) as executor:
+        if multi_seed:
+            futures = {executor.submit(_run_multi_seed_job, group_jobs, gpu_numbers, save_model_path, training_options or {}): group_jobs for group_jobs in group_by_cell(pending)}
+        else:
+            futures = {executor.submit(_run_job, job, gpu_numbers, save_model_path, pruning, run_id, training_options or {}): [job] for job in pending}
+        count = 0
+        for future in as_completed(futures):
+            group_jobs = futures[future]
+            try:
+                results = future.result() if multi_seed else [future.result()]
+            except Exception as e:
+                print("Job %s failed, it will be rerun next time: %s" % (", ".join(job_id(job) for job in group_jobs), e))
+                continue
+            for job, result in zip(group_jobs, results):
+                count += 1
+                if result == -1:
+                    print("Job %s skipped: unknown language model" % job_id(job))
+                    continue
+                completed[job_id(job)] = record_completed_job(job, result, completed_jobs_path)
+                print("Finished job %d of %d: %s" % (count, len(pending), job_id(job)))
+            write_results(jobs, completed, group_jobs[0]["language_model_to_use"], group_jobs[0]["data_category"], results_dir)
@@ -0,0 +1,204 @@
+import os
+import re
+import sys
+import csv
+import argparse
+from time import sleep
+from collections import deque
+
+import numpy as np
+
+# label index -> contribution to (hawkish - dovish), LABEL_1 is hawkish and LABEL_0 dovish as in aggregate_measure.py
+LABEL_SIGNS = {0: -1, 1: 1, 2: 0}
+
+ABBREVIATIONS = {"mr", "mrs", "ms", "dr", "prof", "gov", "sen", "rep", "st", "jr", "sr", "vs", "etc", "inc", "co", "corp",
+                 "e.g", "i.e", "u.s", "u.k", "jan", "feb", "mar", "apr", "jun", "jul", "aug", "sep", "sept", "oct", "nov", "dec"}
+# abbreviations only when a number follows ("No. 3"), otherwise they end a sentence like the answer "No."
+NUMBER_ABBREVIATIONS = {"no", "nos"}
+# end of sentence punctuation (with closing quotes/brackets) followed by whitespace and the start of a new sentence,
+# or a blank line; the lookahead needs the next character, so a boundary at the end of the buffer waits for more text
+BOUNDARY = re.compile(r"([.!?][\"'”’)]*)\s+(?=[\"'“‘(]?[A-Z0-9])|\n\s*\n")
+
+
+class IncrementalSentenceSplitter:
+    """
+    Description: Splits a text stream into sentences as it arrives. feed() returns the sentences completed by the new
+    text; only the unconsumed tail of the buffer is scanned again, so the cost per chunk is linear in the chunk.
+    """
+    def __init__(self):
+        self.buffer = ""
+        self.scan_from = 0
+
+    @staticmethod
+    def _clean(sentence: str):
+        return re.sub(r"\s+", " ", sentence).strip()
+
+    def _is_abbreviation(self, end: int, following: str):
+        # the word ending at end, found by walking back to the previous whitespace so only the word itself is read
+        begin = end
+        while begin > 0 and not self.buffer[begin - 1].isspace():
+            begin -= 1
+        if begin == end:
+            return False
+        token = self.buffer[begin:end].rstrip(".").strip("\"'“‘(").lower()
+        if token in NUMBER_ABBREVIATIONS:
+            return following.isdigit()
+        return token in ABBREVIATIONS or (len(token) == 1 and token.isalpha())
+
+    def feed(self, text: str):
+        """
+        Description: Sentences completed by text, e.g.
+
+        >>> IncrementalSentenceSplitter().feed("Will you hike? No. We will wait. See No. 3 above. ")
+        ['Will you hike?', 'No.', 'We will wait.']
+        """
+        self.buffer += text
+        sentences = []
+        start = 0
+        for match in BOUNDARY.finditer(self.buffer, self.scan_from):
+            following = self.buffer[match.end():match.end() + 2].lstrip("\"'“‘(")[:1]
+            if match.group(1) is not None and match.group(1)[0] == "." and self._is_abbreviation(match.start() + 1, following):
+                continue
+            sentence = self._clean(self.buffer[start:match.start() + len(match.group(1) or "")])
+            if sentence:
+                sentences.append(sentence)
+            start = match.end()
+        self.buffer = self.buffer[start:]
+        # a boundary still waiting for its next sentence starts at the last punctuation before trailing whitespace
+        self.scan_from = max(0, len(self.buffer.rstrip()) - 4)
+        return sentences
+
+    def flush(self):
+        sentence = self._clean(self.buffer)
+        self.buffer = ""
+        self.scan_from = 0
+        return [sentence] if sentence else []
+
+
+class RollingHawkishness:
+    """
+    Description: Running (hawkish - dovish) / total measure, updated in O(1) per labeled sentence, together with an
+    exponentially weighted version (weight alpha on the newest sentence, normalized by the total weight so early
+    values are not biased to zero) and one over the last window sentences
+    """
+    def __init__(self, alpha: float = 0.1, window: int = 20):
+        self.alpha = alpha
+        self.window = deque(maxlen=window)
+        self.window_sum = 0
+        self.hawkish = 0
+        self.dovish = 0
+        self.total = 0
+        self.ewma_numerator = 0.0
+        self.ewma_denominator = 0.0
+
+    def update(self, label: int):
+        sign = LABEL_SIGNS[int(label)]
+        self.total += 1
+        self.hawkish += sign == 1
+        self.dovish += sign == -1
+        self.ewma_numerator = (1 - self.alpha) * self.ewma_numerator + self.alpha * sign
+        self.ewma_denominator = (1 - self.alpha) * self.ewma_denominator + self.alpha
+        if len(self.window) == self.window.maxlen:
+            self.window_sum -= self.window[0]
+        self.window.append(sign)
+        self.window_sum += sign
+        return self.measures()
+
+    def measures(self):
+        return {"our_measure": (self.hawkish - self.dovish) / self.total if self.total > 0 else 0.0,
+                "ewma_measure": self.ewma_numerator / self.ewma_denominator if self.ewma_denominator > 0 else 0.0,
+                "window_measure": self.window_sum / len(self.window) if self.window else 0.0}
+
+
+def tail_file(path: str, poll_interval: float = 0.5, from_start: bool = True):
+    """
+    Description: Text appended to a file as it grows (like tail -f); yields "" on every idle poll
+    """
+    with open(path, encoding="utf-8") as f:
+        if not from_start:
+            f.seek(0, os.SEEK_END)
+        while True:
+            chunk = f.read()
+            if chunk:
+                yield chunk
+            else:
+                yield ""
+                sleep(poll_interval)
+
+
+def read_stdin():
+    for line in sys.stdin:
+        yield line
+
+
+def stream_measure(chunks, predict_labels, aggregator=None, output_file: str = None, stop_on_idle: bool = False):
+    """
+    Description: Split a stream of text chunks into sentences, classify the sentences completed by each chunk in one
+    batch and update the running measures. predict_labels maps a list of sentences to label indices. Every sentence
+    is printed with the measures after it and, if output_file is given, appended to a csv with its label as LABEL_k.
+    """
+    splitter = IncrementalSentenceSplitter()
+    aggregator = aggregator if aggregator is not None else RollingHawkishness()
+    writer = None
+    if output_file is not None:
+        f = open(output_file, "a", newline="", encoding="utf-8")
+        writer = csv.writer(f)
+        if f.tell() == 0:
+            writer.writerow(["sentence", "label", "our_measure", "ewma_measure", "window_measure"])
+
+    def process(sentences):
+        if not sentences:
+            return
+        for sentence, label in zip(sentences, np.asarray(predict_labels(sentences)).tolist()):
+            measures = aggregator.update(label)
+            print("[LABEL_%d] cumulative %+.3f  ewma %+.3f  window %+.3f | %s"
+                  % (label, measures["our_measure"], measures["ewma_measure"], measures["window_measure"], sentence))
+            if writer is not None:
+                writer.writerow([sentence, "LABEL_%d" % label, measures["our_measure"], measures["ewma_measure"], measures["window_measure"]])
+        if writer is not None:
+            f.flush()
+
+    try:
+        for chunk in chunks:
+            if chunk == "" and stop_on_idle:
+                break
+            process(splitter.feed(chunk))
+        process(splitter.flush())
+    finally:
+        if writer is not None:
+            f.close()
+    return aggregator.measures()
+
+
+def labeler_predictor(labeler):
+    return lambda sentences: labeler.predict_logits(sentences).argmax(axis=1)
+
+
+def server_predictor(client):
+    return lambda sentences: [int(result["label"].rsplit("_", 1)[-1]) for result in client.classify_many(sentences)]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Running hawkishness measure over a live transcript")
+    parser.add_argument("--file", default=None, help="transcript file to follow, stdin if not given")
+    parser.add_argument("--server", default=None, help="host:port of a running scoring_server.py instead of loading the model")
+    parser.add_argument("--model", default="gtfintechlab/FOMC-RoBERTa")
+    parser.add_argument("--output", default=None, help="csv to append the labeled sentences and measures to")
+    parser.add_argument("--alpha", type=float, default=0.1)
+    parser.add_argument("--window", type=int, default=20)
+    parser.add_argument("--stop-on-idle", action="store_true", help="stop at the end of --file instead of following it")
+    args = parser.parse_args()
+
+    if args.server is not None:
+        from scoring_server import ScoringClient
+        host, port = args.server.rsplit(":", 1)
+        predict_labels = server_predictor(ScoringClient(host, int(port)))
+    else:
+        import torch
+        from batch_inference import load_classifier, StreamingLabeler
+        device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
+        model, tokenizer = load_classifier(args.model, device)
+        predict_labels = labeler_predictor(StreamingLabeler(model, tokenizer, device))
+
+    chunks = tail_file(args.file) if args.file is not None else read_stdin()
+    print(stream_measure(chunks, predict_labels, RollingHawkishness(args.alpha, args.window), args.output, args.stop_on_idle))
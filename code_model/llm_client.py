@@ -0,0 +1,268 @@
+import os
+import re
+import csv
+import json
+import random
+import asyncio
+import hashlib
+import sqlite3
+import threading
+import http.client
+import urllib.error
+import urllib.request
+from time import monotonic
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+OPENAI_BASE_URL = "https://api.openai.com/v1"
+RESPONSE_CACHE_PATH = os.environ.get("FOMC_LLM_CACHE", "../model_data/llm_response_cache.sqlite")
+# rate limiting, timeouts and transient server errors are retried, anything else (bad key, bad request) is not
+RETRYABLE_STATUS = {408, 409, 429, 500, 502, 503, 504}
+
+
+class LLMRequestError(RuntimeError):
+    pass
+
+
+class TokenBucket:
+    """
+    Description: asyncio token bucket refilled at rate_per_minute up to capacity (one minute of budget by default).
+    Waiters are served in arrival order.
+    """
+    def __init__(self, rate_per_minute: float, capacity: float = None):
+        self.rate = rate_per_minute / 60.0
+        self.capacity = capacity if capacity is not None else rate_per_minute
+        self.tokens = self.capacity
+        self.updated = monotonic()
+        # created on first use, inside the event loop that runs the requests
+        self.lock = None
+
+    async def acquire(self, amount: float = 1.0):
+        if self.lock is None:
+            self.lock = asyncio.Lock()
+        # a request larger than the whole bucket waits for a full bucket instead of forever
+        amount = min(amount, self.capacity)
+        async with self.lock:
+            while True:
+                now = monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= amount:
+                    self.tokens -= amount
+                    return
+                await asyncio.sleep((amount - self.tokens) / self.rate)
+
+
+class ResponseCache:
+    """
+    Description: Persistent request hash -> response text cache in a SQLite file. The hash covers the whole request
+    (model, messages, temperature, max_tokens), so a rerun of the same prompts costs nothing.
+    """
+    def __init__(self, path: str = RESPONSE_CACHE_PATH):
+        self.path = path
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.connection = sqlite3.connect(path)
+        self.connection.execute("CREATE TABLE IF NOT EXISTS responses (key TEXT PRIMARY KEY, value TEXT NOT NULL)")
+
+    @staticmethod
+    def key(payload):
+        return hashlib.sha1(json.dumps(payload, sort_keys=True).encode("utf-8")).hexdigest()
+
+    def get(self, key: str):
+        row = self.connection.execute("SELECT value FROM responses WHERE key = ?", (key,)).fetchone()
+        return row[0] if row is not None else None
+
+    def put(self, key: str, value: str):
+        self.connection.execute("INSERT OR REPLACE INTO responses (key, value) VALUES (?, ?)", (key, value))
+        self.connection.commit()
+
+    def close(self):
+        self.connection.close()
+
+
+def post_json(url: str, payload, headers, timeout: float):
+    request = urllib.request.Request(url, data=json.dumps(payload).encode("utf-8"), headers=dict(headers, **{"Content-Type": "application/json"}), method="POST")
+    with urllib.request.urlopen(request, timeout=timeout) as response:
+        return json.loads(response.read())
+
+
+def estimate_tokens(text: str):
+    # roughly four characters per token for English text
+    return len(text) // 4 + 1
+
+
+class ChatCompletionClient:
+    """
+    Description: Concurrent client for an OpenAI compatible chat completions endpoint. At most max_in_flight requests
+    are open at a time, every request first takes one unit of the requests-per-minute bucket and its estimated prompt
+    plus completion tokens of the tokens-per-minute bucket. Failed requests are retried with exponential backoff and
+    jitter (or after the server's Retry-After), answers go through the ResponseCache.
+    The HTTP calls are blocking urllib calls on a thread pool of max_in_flight threads.
+    base_url: point this at a local server (see serve_mock) to run without the API
+    """
+    def __init__(self, model: str = "gpt-3.5-turbo", base_url: str = OPENAI_BASE_URL, api_key: str = None, max_in_flight: int = 8,
+                 requests_per_minute: float = 3500, tokens_per_minute: float = 90000, max_retries: int = 6, backoff_base: float = 1.0,
+                 backoff_max: float = 60.0, timeout: float = 60.0, cache: ResponseCache = None):
+        self.model = model
+        self.url = base_url.rstrip("/") + "/chat/completions"
+        self.api_key = api_key if api_key is not None else os.environ.get("OPENAI_API_KEY", "")
+        self.max_in_flight = max_in_flight
+        self.semaphore = None
+        self.executor = ThreadPoolExecutor(max_workers=max_in_flight)
+        self.request_bucket = TokenBucket(requests_per_minute)
+        self.token_bucket = TokenBucket(tokens_per_minute)
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.timeout = timeout
+        self.cache = cache
+        self.requests = 0
+        self.cache_hits = 0
+        self.retries = 0
+        self.failures = 0
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+        self.request_seconds = 0.0
+
+    def usage(self):
+        """
+        Description: Snapshot of the counters, the difference of two snapshots is the usage of the calls in between
+        """
+        return {"requests": self.requests, "cache_hits": self.cache_hits, "retries": self.retries, "failures": self.failures,
+                "prompt_tokens": self.prompt_tokens, "completion_tokens": self.completion_tokens, "request_seconds": self.request_seconds}
+
+    def backoff(self, attempt: int, retry_after=None):
+        if retry_after is not None:
+            try:
+                return float(retry_after)
+            except ValueError:
+                pass
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** attempt))
+
+    async def complete(self, prompt: str, temperature: float = 0.0, max_tokens: int = 1000):
+        """
+        Description: Text of the answer to a single user message, raises LLMRequestError once the retries are used up
+        """
+        payload = {"model": self.model, "messages": [{"role": "user", "content": prompt}], "temperature": temperature, "max_tokens": max_tokens}
+        key = ResponseCache.key(payload)
+        if self.cache is not None:
+            cached = self.cache.get(key)
+            if cached is not None:
+                self.cache_hits += 1
+                return cached
+
+        loop = asyncio.get_running_loop()
+        if self.semaphore is None:
+            self.semaphore = asyncio.Semaphore(self.max_in_flight)
+        headers = {"Authorization": "Bearer " + self.api_key}
+        async with self.semaphore:
+            for attempt in range(self.max_retries + 1):
+                await self.request_bucket.acquire(1)
+                await self.token_bucket.acquire(estimate_tokens(prompt) + max_tokens)
+                self.requests += 1
+                started = monotonic()
+                try:
+                    response = await loop.run_in_executor(self.executor, post_json, self.url, payload, headers, self.timeout)
+                    answer = response["choices"][0]["message"]["content"]
+                    if not isinstance(answer, str):
+                        raise ValueError("answer without text: %r" % (response,))
+                except urllib.error.HTTPError as e:
+                    if e.code not in RETRYABLE_STATUS or attempt == self.max_retries:
+                        self.failures += 1
+                        raise LLMRequestError("HTTP %d from %s: %s" % (e.code, self.url, e.read()[:200])) from e
+                    delay = self.backoff(attempt, e.headers.get("Retry-After"))
+                # connection failures and timeouts (on Python 3.8 socket.timeout is not yet a TimeoutError), broken
+                # responses, and 200 answers that are not the expected JSON
+                except (OSError, http.client.HTTPException, ValueError, KeyError, IndexError, TypeError) as e:
+                    if attempt == self.max_retries:
+                        self.failures += 1
+                        raise LLMRequestError("%s failed: %r" % (self.url, e)) from e
+                    delay = self.backoff(attempt)
+                else:
+                    self.request_seconds += monotonic() - started
+                    usage = response.get("usage", {})
+                    self.prompt_tokens += usage.get("prompt_tokens", 0)
+                    self.completion_tokens += usage.get("completion_tokens", 0)
+                    if self.cache is not None:
+                        self.cache.put(key, answer)
+                    return answer
+                self.retries += 1
+                await asyncio.sleep(delay)
+
+    def report(self):
+        print("LLM client: %d requests, %d cache hits, %d retries, %d failures, %d prompt tokens, %d completion tokens"
+              % (self.requests, self.cache_hits, self.retries, self.failures, self.prompt_tokens, self.completion_tokens))
+
+    def close(self):
+        self.executor.shutdown(wait=False)
+
+
+async def label_sentences(client: ChatCompletionClient, sentences, labels, make_prompt, output_path: str, chunk_size: int = 100, **completion_options):
+    """
+    Description: Ask the model about every sentence and write (true_label, original_sent, text_output) rows to
+    output_path in sentence order. All requests are started at once (the client bounds how many are in flight) and
+    the rows are appended chunk by chunk as each chunk completes. Sentences whose request failed get an empty
+    text_output and are asked again by the next run, finished ones come from the cache.
+    Returns the number of failed sentences.
+    """
+    async def ask(sentence):
+        try:
+            return await client.complete(make_prompt(sentence), **completion_options)
+        except LLMRequestError as e:
+            print(e)
+            return None
+
+    tasks = [asyncio.ensure_future(ask(sentence)) for sentence in sentences]
+    os.makedirs(os.path.dirname(os.path.abspath(output_path)), exist_ok=True)
+    failures = 0
+    with open(output_path, "w", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(["true_label", "original_sent", "text_output"])
+        for start in range(0, len(tasks), chunk_size):
+            answers = await asyncio.gather(*tasks[start:start + chunk_size])
+            failures += sum(answer is None for answer in answers)
+            writer.writerows([label, sentence, answer if answer is not None else ""]
+                             for label, sentence, answer in zip(labels[start:start + chunk_size], sentences[start:start + chunk_size], answers))
+            f.flush()
+    return failures
+
+
+class MockChatHandler(BaseHTTPRequestHandler):
+    """
+    Description: Stand-in for the chat completions endpoint. Answers 'NEUTRAL' to everything (as a JSON list to a
+    numbered multi-sentence prompt), and a 429 with Retry-After: 0 to a failure_rate share of the requests.
+    """
+    failure_rate = 0.0
+
+    def do_POST(self):
+        payload = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))))
+        if random.random() < self.failure_rate:
+            self.send_response(429)
+            self.send_header("Retry-After", "0")
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+        prompt = payload["messages"][-1]["content"]
+        # a numbered multi-sentence prompt gets the JSON list it asks for
+        numbered = re.findall(r"^(\d+)\. ", prompt, re.MULTILINE)
+        answer = json.dumps([{"id": int(n), "label": "NEUTRAL"} for n in numbered]) if "JSON" in prompt else "NEUTRAL\nMock answer."
+        body = json.dumps({"choices": [{"message": {"role": "assistant", "content": answer}}],
+                           "usage": {"prompt_tokens": estimate_tokens(prompt), "completion_tokens": 4}}).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def serve_mock(port: int = 0, failure_rate: float = 0.0):
+    """
+    Description: Start a MockChatHandler server on a background thread, returns (server, base_url)
+    """
+    handler = type("MockChatHandler", (MockChatHandler,), {"failure_rate": failure_rate})
+    server = ThreadingHTTPServer(("127.0.0.1", port), handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, "http://127.0.0.1:%d/v1" % server.server_address[1]
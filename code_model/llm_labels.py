@@ -0,0 +1,207 @@
+import re
+import csv
+import json
+import asyncio
+from time import perf_counter
+
+import numpy as np
+
+from llm_client import LLMRequestError
+from confusion_metrics import confusion_matrix, accuracy_from_confusion, weighted_f1_from_confusion
+
+LABEL_IDS = {"DOVISH": 0, "HAWKISH": 1, "NEUTRAL": 2}
+LABEL_PATTERN = re.compile(r"\b(HAWKISH|DOVISH|NEUTRAL)\b", re.IGNORECASE)
+INSTRUCTION = "Discard all the previous instructions. Behave like you are an expert sentence classifier. Classify the following sentence from FOMC into 'HAWKISH', 'DOVISH', or 'NEUTRAL' class. Label 'HAWKISH' if it is corresponding to tightening of the monetary policy, 'DOVISH' if it is corresponding to easing of the monetary policy, or 'NEUTRAL' if the stance is neutral."
+# USD per 1K prompt and completion tokens, update when the price list changes
+PRICES_PER_1K_TOKENS = {"gpt-3.5-turbo": (0.0015, 0.002)}
+# completion tokens budgeted per sentence of a batch, one {"id": n, "label": "..."} object is about 12
+COMPLETION_TOKENS_PER_SENTENCE = 20
+
+
+def single_prompt(sen: str):
+    return INSTRUCTION + " Provide the label in the first line and provide a short explanation in the second line. The sentence: " + sen
+
+
+def batch_prompt(sentences):
+    """
+    Description: One request for several sentences, numbered from 1, answered by a JSON list of labels
+    """
+    numbered = "\n".join("%d. %s" % (i, " ".join(str(sen).split())) for i, sen in enumerate(sentences, start=1))
+    return (INSTRUCTION.replace("the following sentence", "each of the following %d sentences" % len(sentences))
+            + ' Answer with only a JSON list of %d objects of the form {"id": <sentence number>, "label": "HAWKISH" | "DOVISH" | "NEUTRAL"}, one per sentence and in order, without explanations.'
+            % len(sentences) + " The sentences:\n" + numbered)
+
+
+def parse_label(text):
+    """
+    Description: Label id of a per-sentence answer, None if it names no label. The first line is tried first
+    (the prompt asks for the label there), then the first label mentioned anywhere, so answers like
+    'Label: **Hawkish**' or 'The sentence is DOVISH.' are read correctly.
+    """
+    if not isinstance(text, str):
+        return None
+    lines = text.strip().splitlines()
+    for candidate in ([lines[0]] if lines else []) + [text]:
+        match = LABEL_PATTERN.search(candidate)
+        if match:
+            return LABEL_IDS[match.group(1).upper()]
+    return None
+
+
+def decode(text):
+    """
+    Description: parse_label with unreadable answers counted as NEUTRAL, as chatgpt_res.py always did
+    """
+    label = parse_label(text)
+    return LABEL_IDS["NEUTRAL"] if label is None else label
+
+
+def _labels_from_json(value, k: int):
+    if isinstance(value, dict):
+        value = next((v for v in value.values() if isinstance(v, list)), [])
+    labels = [None] * k
+    if not isinstance(value, list):
+        return labels
+    positional = all(not isinstance(item, dict) or "id" not in item for item in value)
+    for position, item in enumerate(value):
+        label = item.get("label") if isinstance(item, dict) else item
+        index = position if positional else item.get("id")
+        try:
+            index = int(index) - (0 if positional else 1)
+        except (TypeError, ValueError):
+            continue
+        if 0 <= index < k and isinstance(label, str) and label.strip().upper() in LABEL_IDS:
+            labels[index] = LABEL_IDS[label.strip().upper()]
+    return labels
+
+
+def parse_batch_labels(text, k: int):
+    """
+    Description: Label ids of the k sentences of a batch_prompt answer, None for every sentence whose label is
+    missing, out of range or not one of the three labels. Reads the JSON list (also inside a code fence or wrapped in
+    an object, and bare label strings in order); if that does not parse, e.g. a truncated answer, it falls back to
+    the id/label pairs and '3. HAWKISH' lines that can be found in the text.
+    """
+    if not isinstance(text, str):
+        return [None] * k
+    start, end = text.find("["), text.rfind("]")
+    if 0 <= start < end:
+        try:
+            return _labels_from_json(json.loads(text[start:end + 1]), k)
+        except json.JSONDecodeError:
+            pass
+    try:
+        return _labels_from_json(json.loads(text), k)
+    except json.JSONDecodeError:
+        pass
+    labels = [None] * k
+    pairs = re.findall(r'"?id"?\s*:\s*"?(\d+)"?\s*,\s*"?label"?\s*:\s*"?(HAWKISH|DOVISH|NEUTRAL)', text, re.IGNORECASE)
+    pairs += re.findall(r"^\W*(\d+)\s*[.):-]\W*(HAWKISH|DOVISH|NEUTRAL)\b", text, re.IGNORECASE | re.MULTILINE)
+    for number, label in pairs:
+        if 1 <= int(number) <= k and labels[int(number) - 1] is None:
+            labels[int(number) - 1] = LABEL_IDS[label.upper()]
+    return labels
+
+
+async def query_batches(client, sentences, indices, batch_size: int, temperature: float = 0.0):
+    """
+    Description: Labels of sentences[i] for i in indices, asked batch_size at a time, as {index: label id or None}
+    """
+    async def ask(batch):
+        try:
+            answer = await client.complete(batch_prompt([sentences[i] for i in batch]), temperature=temperature,
+                                           max_tokens=COMPLETION_TOKENS_PER_SENTENCE * len(batch) + 50)
+        except LLMRequestError as e:
+            print(e)
+            answer = None
+        return dict(zip(batch, parse_batch_labels(answer, len(batch))))
+
+    found = {}
+    for result in await asyncio.gather(*[ask(indices[start:start + batch_size]) for start in range(0, len(indices), batch_size)]):
+        found.update(result)
+    return found
+
+
+async def label_sentences_batched(client, sentences, labels, output_path: str, batch_size: int = 10, max_requery: int = 2, temperature: float = 0.0):
+    """
+    Description: Label the sentences batch_size to a request and write (true_label, original_sent, text_output) rows
+    in sentence order, text_output being the label name so chatgpt_res.py reads both modes alike. Only the sentences
+    whose label could not be parsed are asked again, in batches half as large for up to max_requery rounds (a
+    different batch is a different prompt, so the cached bad answer is not simply returned again) and finally one
+    at a time with the per-sentence prompt. Sentences still without a label get an empty text_output.
+    Returns (number of unlabeled sentences, usage report of this file, see usage_report).
+    """
+    names = {label_id: name for name, label_id in LABEL_IDS.items()}
+    before = client.usage()
+    started = perf_counter()
+    predicted = await query_batches(client, sentences, list(range(len(sentences))), batch_size, temperature)
+    for _ in range(max_requery):
+        failed = [i for i, label in predicted.items() if label is None]
+        batch_size = max(1, batch_size // 2)
+        if not failed or batch_size == 1:
+            break
+        predicted.update(await query_batches(client, sentences, failed, batch_size, temperature))
+
+    async def ask_single(i):
+        try:
+            return i, parse_label(await client.complete(single_prompt(sentences[i]), temperature=temperature, max_tokens=1000))
+        except LLMRequestError as e:
+            print(e)
+            return i, None
+
+    failed = [i for i, label in predicted.items() if label is None]
+    predicted.update(await asyncio.gather(*[ask_single(i) for i in failed]))
+    report = usage_report(before, client.usage(), len(sentences), perf_counter() - started, client.model)
+
+    with open(output_path, "w", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(["true_label", "original_sent", "text_output"])
+        writer.writerows([label, sen, names.get(predicted[i], "")] for i, (label, sen) in enumerate(zip(labels, sentences)))
+    return sum(predicted[i] is None for i in range(len(sentences))), report
+
+
+def usage_report(before, after, num_sentences: int, elapsed: float, model: str):
+    """
+    Description: Requests, tokens, USD and seconds per labeled sentence between two ChatCompletionClient.usage() snapshots.
+    Answers served from the response cache cost nothing and are not counted.
+    """
+    usage = {key: after[key] - before[key] for key in after}
+    prompt_price, completion_price = PRICES_PER_1K_TOKENS.get(model, (0.0, 0.0))
+    cost = (usage["prompt_tokens"] * prompt_price + usage["completion_tokens"] * completion_price) / 1000
+    n = max(num_sentences, 1)
+    return {"sentences": num_sentences, "requests_per_sentence": usage["requests"] / n, "prompt_tokens_per_sentence": usage["prompt_tokens"] / n,
+            "completion_tokens_per_sentence": usage["completion_tokens"] / n, "usd_per_sentence": cost / n,
+            "seconds_per_sentence": elapsed / n, "request_seconds_per_sentence": usage["request_seconds"] / n}
+
+
+def agreement(labels_a, labels_b):
+    """
+    Description: (share of equal labels, Cohen's kappa) of two labelings of the same sentences
+    """
+    confusion = confusion_matrix(labels_a, labels_b, len(LABEL_IDS))
+    observed = accuracy_from_confusion(confusion)
+    total = confusion.sum()
+    expected = float((confusion.sum(axis=0) * confusion.sum(axis=1)).sum() / total ** 2) if total > 0 else 0.0
+    kappa = (observed - expected) / (1 - expected) if expected < 1 else 1.0
+    return observed, kappa
+
+
+def compare_modes(single_df, batched_df):
+    """
+    Description: Accuracy and weighted F1 of the per-sentence and batched outputs of one test file (as read from
+    their csv files) against the true labels, and the agreement of the two modes, on the sentences both labeled
+    """
+    merged = single_df.merge(batched_df, on="original_sent", suffixes=("_single", "_batched"))
+    merged = merged.drop_duplicates("original_sent")
+    single = merged["text_output_single"].apply(parse_label)
+    batched = merged["text_output_batched"].apply(parse_label)
+    keep = single.notna() & batched.notna()
+    true_labels = merged["true_label_single"][keep].to_numpy(dtype=np.int64)
+    single, batched = single[keep].to_numpy(dtype=np.int64), batched[keep].to_numpy(dtype=np.int64)
+    result = {"sentences": int(keep.sum())}
+    for mode, predicted in (("single", single), ("batched", batched)):
+        confusion = confusion_matrix(true_labels, predicted, len(LABEL_IDS))
+        result["accuracy_" + mode] = accuracy_from_confusion(confusion)
+        result["f1_" + mode] = weighted_f1_from_confusion(confusion)
+    result["agreement"], result["kappa"] = agreement(single, batched)
+    return result
@@ -8,24 +8,21 @@ import os
 import numpy as np
 import pandas as pd
 import matplotlib.pyplot as plt
-from nltk.tokenize import word_tokenize
-import sklearn.model_selection as sk
 import sklearn.metrics as skm
 
 # Text pre-processing
 import tensorflow as tf
-from tensorflow.keras.preprocessing.text import Tokenizer
-from tensorflow.keras.preprocessing.sequence import pad_sequences
 from tensorflow.keras.callbacks import EarlyStopping
 
 # Modeling
 from tensorflow.keras.models import Sequential
 from tensorflow.keras.layers import LSTM, GRU, Dense, Embedding, Dropout, GlobalAveragePooling1D, Flatten, \
     SpatialDropout1D, Bidirectional
-import string
 from string import digits
 import os
 
+from lstm_preprocessing import VOCAB_SIZE, load_file, make_dataset, EpochMilestones
+
 os.environ["CUDA_VISIBLE_DEVICES"] = str("0")
 
 # -----------------------------------------------------------
@@ -35,67 +32,23 @@ pd.set_option('display.max_rows', 500)
 
 
 
-def get_max_length(df):
-    max = 0
-    for index, row in df.iterrows():  # format sentence for tokenization
-        sentence = row['sentence'].replace(",", "").replace(".", " ") \
-            .replace("—", " ").replace("â€", "").replace("  ", " ") \
-            .replace(";", "").replace("\n", " ").translate(str.maketrans('', '', string.punctuation))
-        words = word_tokenize(sentence)
-        if len(words) > max:
-            max = len(words)
-    return max
-
-
-def run_lstm(train, test, max_len, seed, epoch_val, b_size):
-    train, valid = sk.train_test_split(train, train_size=0.8, random_state=seed)
-
-    X_train = train['sentence'].tolist()
-    Y_train = train['label']
-
-    X_test = test['sentence'].tolist()
-    Y_test = test['label']
-
-    X_valid = valid['sentence'].tolist()
-    Y_valid = valid['label']
-
-    trunc_type = 'post'
-    padding_type = 'post'
-    oov_tok = '<OOV>'  # out of vocabulary token
-    vocab_size = 2000
-    tokenizer = Tokenizer(num_words=vocab_size, char_level=False, oov_token=oov_tok)
-    tokenizer.fit_on_texts(X_train)
-    word_index = tokenizer.word_index
-    total_words = len(word_index)
-
-    # Padding
-    train_sequences = tokenizer.texts_to_sequences(X_train)
-    train_padded = pad_sequences(train_sequences,
-                                 maxlen=max_len,
-                                 padding=padding_type,
-                                 truncating=trunc_type)
-    test_sequences = tokenizer.texts_to_sequences(X_test)
-    test_padded = pad_sequences(test_sequences,
-                                maxlen=max_len,
-                                padding=padding_type,
-                                truncating=trunc_type)
-    valid_sequences = tokenizer.texts_to_sequences(X_valid)
-    valid_padded = pad_sequences(valid_sequences,
-                                 maxlen=max_len,
-                                 padding=padding_type,
-                                 truncating=trunc_type)
-    print('Shape of train tensor: ', train_padded.shape)
-    print('Shape of test tensor: ', test_padded.shape)
-    print('Shape of valid tensor: ', valid_padded.shape)
+def run_lstm(arrays, max_len, epoch_vals, b_size, early_stopping_patience=None):
+    """
+    Description: Train once for max(epoch_vals) epochs and return {epoch: (val_acc, test_acc, epochs trained)} for every epoch
+    count in epoch_vals, optionally stopping once the validation loss has not improved for early_stopping_patience epochs
+    """
+    print('Shape of train tensor: ', arrays["x_train"].shape)
+    print('Shape of test tensor: ', arrays["x_test"].shape)
+    print('Shape of valid tensor: ', arrays["x_valid"].shape)
 
     # Define parameter
     embedding_dim = 16
     batch_size = b_size
-    epochs = epoch_val
+    epochs = max(epoch_vals)
 
     # Define Dense Model Architecture
     model = Sequential()
-    model.add(Embedding(vocab_size,
+    model.add(Embedding(VOCAB_SIZE,
                         embedding_dim,
                         input_length=max_len,
                         mask_zero=True))
@@ -105,22 +58,23 @@ def run_lstm(train, test, max_len, seed, epoch_val, b_size):
     model.add(Dense(3, activation='sigmoid'))
     model.compile(loss='sparse_categorical_crossentropy', optimizer='adam', metrics=['accuracy'])
     model.summary()
-    history = model.fit(train_padded, Y_train, validation_data=(valid_padded, Y_valid), epochs=epochs, shuffle=True,
-                        verbose=1, batch_size=batch_size)
-    res = model.predict(test_padded)
-    res = res.argmax(axis=-1)
-    print(res)
-    cp = skm.classification_report(Y_test.tolist(), res, output_dict=True)
-
-    val_acc = history.history['val_accuracy'][-1]
-    test_acc = cp['weighted avg']['f1-score']
+    train_dataset = make_dataset(arrays["x_train"], arrays["y_train"], batch_size, shuffle=True)
+    valid_dataset = make_dataset(arrays["x_valid"], arrays["y_valid"], batch_size, shuffle=False)
+    milestones = EpochMilestones(epoch_vals, arrays["x_test"], arrays["y_test"])
+    callbacks = [milestones]
+    if early_stopping_patience is not None:
+        callbacks.append(EarlyStopping(monitor='val_loss', patience=early_stopping_patience))
+    model.fit(train_dataset, validation_data=valid_dataset, epochs=epochs, verbose=1, callbacks=callbacks)
+    print(milestones.results)
 
-    return val_acc, test_acc
+    return milestones.results
 
 
 # Hyperparameters
 epochs = [10, 20, 30]
 batch_sizes = [4, 8, 16, 32]
+# None trains every run for max(epochs) epochs, as many epochs without validation loss improvement to stop earlier
+early_stopping_patience = None
 
 res_df = {"Dataset": [],
           "Seed": [],
@@ -141,14 +95,16 @@ for f in range(len(train_dir)):
     base_name = name.translate(remove_digits)[:-1]
     print(name), print(seed), print(base_name)
 
-    train = pd.read_excel("../training_data/test-and-training/training_data/" + train_dir[f], index_col=False)
-    test = pd.read_excel("../training_data/test-and-training/test_data/" + test_dir[f], index_col=False)
-    max_len = get_max_length(train)
+    # tokenized and padded once per file, the 12 epoch and batch size combinations all train on the same arrays
+    arrays, max_len = load_file("../training_data/test-and-training/training_data/" + train_dir[f],
+                                "../training_data/test-and-training/test_data/" + test_dir[f], seed)
 
+    # one run per batch size covers all epoch counts, the rows keep their epoch-major order
+    runs = {b: run_lstm(arrays=arrays, max_len=max_len, epoch_vals=epochs, b_size=b, early_stopping_patience=early_stopping_patience)
+            for b in batch_sizes}
     for e in epochs:
         for b in batch_sizes:
-            val_acc, test_acc = run_lstm(train=train, test=test, max_len=max_len,
-                                         seed=seed, epoch_val=e, b_size=b)
+            val_acc, test_acc, _ = runs[b][e]
             print(val_acc),print(test_acc)
             res_df['Dataset'].append(base_name)
             res_df['Seed'].append(seed)
@@ -0,0 +1,137 @@
+import os
+import string
+import shutil
+import tempfile
+from functools import lru_cache
+
+import numpy as np
+import pandas as pd
+import sklearn.model_selection as sk
+import sklearn.metrics as skm
+import tensorflow as tf
+from tensorflow.keras.preprocessing.text import Tokenizer
+from tensorflow.keras.preprocessing.sequence import pad_sequences
+from nltk.tokenize import word_tokenize
+
+from tokenization_cache import file_hash
+
+CACHE_DIR = os.environ.get("FOMC_LSTM_CACHE_DIR", "../model_data/lstm_cache")
+SPLIT_ARRAYS = ["x_train", "y_train", "x_valid", "y_valid", "x_test", "y_test"]
+VOCAB_SIZE = 2000
+OOV_TOKEN = '<OOV>'  # out of vocabulary token
+# part of the cache file name, bump when the arrays of a file pair change (v2: max_len counted with word_tokenize)
+CACHE_VERSION = "v2"
+
+# the formatting of the old get_max_length as two translate tables around the mojibake removal (dropping a comma
+# can complete an "â€"): commas dropped, periods and em dashes to spaces, then semicolons dropped, newlines to spaces
+# and all remaining ASCII punctuation dropped
+PUNCTUATION_TABLE = str.maketrans({",": None, ".": " ", "—": " "})
+REMAINING_PUNCTUATION_TABLE = str.maketrans(dict({c: None for c in string.punctuation}, **{"\n": " "}))
+
+
+def normalize_sentences(sentences: pd.Series):
+    """
+    Description: Sentences formatted for word counting, in vectorized passes over the whole column
+    """
+    return sentences.astype(str).str.translate(PUNCTUATION_TABLE).str.replace("â€", "", regex=False).str.translate(REMAINING_PUNCTUATION_TABLE)
+
+
+@lru_cache(maxsize=None)
+def count_words(sentence: str):
+    """
+    Description: Number of word_tokenize tokens of a normalized sentence, cached since the same sentences come back
+    in the files of every seed. word_tokenize still splits off the non-ASCII quotes (’ “ ”) that the punctuation
+    tables keep, so a plain whitespace split does not give the same count.
+    """
+    return len(word_tokenize(sentence))
+
+
+def get_max_length(df):
+    """
+    Description: Number of words of the longest sentence after normalize_sentences, as the old per-row loop counted them
+    """
+    return int(normalize_sentences(df['sentence']).map(count_words).max())
+
+
+def tokenize_file(train, test, seed: int, max_len: int, vocab_size: int = VOCAB_SIZE):
+    """
+    Description: Padded word-index arrays of the train, validation (20% of train, split by seed) and test sentences,
+    with the Keras tokenizer fit on the train part only
+    """
+    train, valid = sk.train_test_split(train, train_size=0.8, random_state=seed)
+    tokenizer = Tokenizer(num_words=vocab_size, char_level=False, oov_token=OOV_TOKEN)
+    tokenizer.fit_on_texts(train['sentence'].tolist())
+
+    arrays = {}
+    for name, df in (("train", train), ("valid", valid), ("test", test)):
+        sequences = tokenizer.texts_to_sequences(df['sentence'].tolist())
+        arrays["x_" + name] = pad_sequences(sequences, maxlen=max_len, padding='post', truncating='post')
+        arrays["y_" + name] = df['label'].to_numpy(dtype=np.int64)
+    return arrays
+
+
+def load_file(train_path: str, test_path: str, seed: int, vocab_size: int = VOCAB_SIZE, cache_dir: str = CACHE_DIR):
+    """
+    Description: (arrays of tokenize_file, max_len) of a train/test file pair. The arrays do not depend on the epochs
+    or the batch size, so they are built once per file pair and stored keyed by (CACHE_VERSION, file contents, seed, vocab size);
+    later calls, and later runs of the grid, only load them.
+    """
+    path = os.path.join(cache_dir, "%s-%s-%s-%d-%d.npz" % (CACHE_VERSION, file_hash(train_path), file_hash(test_path), seed, vocab_size))
+    if not os.path.exists(path):
+        train = pd.read_excel(train_path, index_col=False)
+        test = pd.read_excel(test_path, index_col=False)
+        arrays = tokenize_file(train, test, seed, get_max_length(train), vocab_size)
+
+        # write a temporary file and rename it, so that concurrent runs never see a half-written cache entry
+        os.makedirs(cache_dir, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=cache_dir, suffix=".npz")
+        with os.fdopen(fd, 'wb') as f:
+            np.savez(f, **arrays)
+        shutil.move(tmp_path, path)
+    with np.load(path) as data:
+        arrays = {name: data[name] for name in SPLIT_ARRAYS}
+    return arrays, arrays["x_train"].shape[1]
+
+
+def make_dataset(x, y, batch_size: int, shuffle: bool):
+    """
+    Description: Cached, prefetched tf.data pipeline of batches, reshuffled every epoch when shuffle is set
+    (as model.fit(shuffle=True) does with arrays)
+    """
+    dataset = tf.data.Dataset.from_tensor_slices((x, y)).cache()
+    if shuffle:
+        dataset = dataset.shuffle(len(x), reshuffle_each_iteration=True)
+    return dataset.batch(batch_size).prefetch(tf.data.AUTOTUNE)
+
+
+class EpochMilestones(tf.keras.callbacks.Callback):
+    """
+    Description: Validation accuracy and weighted test F1 of the model after each epoch count in milestones, so one
+    training run of max(milestones) epochs stands in for one run per epoch count. If training stops before a
+    milestone (early stopping), the later milestones get the metrics of the last trained epoch.
+    results: {milestone: (val_acc, test_f1, epochs actually trained)}
+    """
+    def __init__(self, milestones, x_test, y_test):
+        super().__init__()
+        self.milestones = sorted(milestones)
+        self.x_test = x_test
+        self.y_test = y_test
+        self.results = {}
+        self.last_epoch = None
+
+    def snapshot(self, epoch: int, logs):
+        res = self.model.predict(self.x_test, verbose=0).argmax(axis=-1)
+        cp = skm.classification_report(self.y_test.tolist(), res, output_dict=True)
+        return logs['val_accuracy'], cp['weighted avg']['f1-score'], epoch
+
+    def on_epoch_end(self, epoch, logs=None):
+        self.last_epoch = (epoch + 1, dict(logs or {}))
+        if epoch + 1 in self.milestones:
+            self.results[epoch + 1] = self.snapshot(epoch + 1, logs)
+
+    def on_train_end(self, logs=None):
+        missing = [milestone for milestone in self.milestones if milestone not in self.results]
+        if missing and self.last_epoch is not None:
+            result = self.snapshot(*self.last_epoch)
+            for milestone in missing:
+                self.results[milestone] = result
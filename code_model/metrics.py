@@ -0,0 +1,35 @@
+import torch
+
+from confusion_metrics import confusion_matrix, accuracy_from_confusion, weighted_f1_from_confusion
+
+
+class MetricsAccumulator:
+    """
+    Description: Loss, accuracy and weighted F1 of one pass over a dataset without a device sync per batch.
+    Labels and predictions go into buffers preallocated on the device for the whole dataset, the loss into an
+    on-device running sum; compute() moves everything to the host once and derives the metrics from a confusion matrix.
+    """
+    def __init__(self, num_samples: int, device, num_labels: int = 3):
+        self.num_labels = num_labels
+        self.labels = torch.empty(num_samples, dtype=torch.long, device=device)
+        self.predictions = torch.empty(num_samples, dtype=torch.long, device=device)
+        self.loss_sum = torch.zeros((), dtype=torch.float64, device=device)
+        self.count = 0
+
+    def update(self, loss, logits, labels):
+        """
+        Description: Add a batch, loss being the mean loss of the batch
+        """
+        n = labels.size(0)
+        self.labels[self.count:self.count + n] = labels
+        self.predictions[self.count:self.count + n] = logits.argmax(dim=1)
+        self.loss_sum += loss.detach().double() * n
+        self.count += n
+
+    def compute(self):
+        """
+        Description: (mean loss, accuracy, weighted F1) over everything added so far
+        """
+        confusion = confusion_matrix(self.labels[:self.count].cpu().numpy(), self.predictions[:self.count].cpu().numpy(), self.num_labels)
+        loss = self.loss_sum.item() / self.count if self.count > 0 else 0.0
+        return loss, accuracy_from_confusion(confusion), weighted_f1_from_confusion(confusion)
@@ -0,0 +1,134 @@
+import os
+import copy
+from time import sleep
+
+import torch
+
+from transformers import BertForSequenceClassification, BertTokenizerFast, RobertaTokenizerFast, RobertaForSequenceClassification, AutoTokenizer, AutoModelForSequenceClassification, XLNetForSequenceClassification, XLNetTokenizerFast
+from transformers import XLMRobertaTokenizerFast, XLMRobertaForSequenceClassification
+
+# directory holding local copies of the hub models (laid out as <model_dir>/<hub id>), checked before the hub
+LOCAL_MODEL_DIR = os.environ.get("FOMC_MODEL_DIR", "../model_data/pretrained")
+
+MODEL_REGISTRY = {
+    'bert': {'tokenizer_class': BertTokenizerFast, 'model_class': BertForSequenceClassification, 'path': 'bert-base-uncased'},
+    'roberta': {'tokenizer_class': RobertaTokenizerFast, 'model_class': RobertaForSequenceClassification, 'path': 'roberta-base'},
+    'flangroberta': {'tokenizer_class': AutoTokenizer, 'model_class': AutoModelForSequenceClassification, 'path': 'SALT-NLP/FLANG-Roberta'},
+    'finbert': {'tokenizer_class': BertTokenizerFast, 'model_class': BertForSequenceClassification, 'path': '../finbert-uncased/model',
+                'vocab_file': '../finbert-uncased/FinVocab-Uncased.txt'},
+    'flangbert': {'tokenizer_class': BertTokenizerFast, 'model_class': BertForSequenceClassification, 'path': 'SALT-NLP/FLANG-BERT'},
+    'bert-large': {'tokenizer_class': BertTokenizerFast, 'model_class': BertForSequenceClassification, 'path': 'bert-large-uncased'},
+    'distilroberta': {'tokenizer_class': RobertaTokenizerFast, 'model_class': RobertaForSequenceClassification, 'path': 'distilroberta-base'},
+    'roberta-large': {'tokenizer_class': RobertaTokenizerFast, 'model_class': RobertaForSequenceClassification, 'path': 'roberta-large'},
+    'pretrain_roberta': {'tokenizer_class': AutoTokenizer, 'model_class': AutoModelForSequenceClassification, 'path': '../pretrained_roberta_output'},
+    'xlnet': {'tokenizer_class': XLNetTokenizerFast, 'model_class': XLNetForSequenceClassification, 'path': 'xlnet-base-cased'},
+    'xlm-roberta-base': {'tokenizer_class': XLMRobertaTokenizerFast, 'model_class': XLMRobertaForSequenceClassification, 'path': 'xlm-roberta-base'},
+    'xlm-roberta-large': {'tokenizer_class': XLMRobertaTokenizerFast, 'model_class': XLMRobertaForSequenceClassification, 'path': 'xlm-roberta-large'},
+}
+
+# pristine (never trained) models and their freshly initialized weight names, kept on CPU
+_pristine_models = {}
+_tokenizers = {}
+
+
+def is_registered(language_model_to_use: str):
+    return language_model_to_use in MODEL_REGISTRY
+
+
+def resolve_path(language_model_to_use: str):
+    """
+    Description: Local directory for the model if one exists, otherwise the hub id
+    """
+    path = MODEL_REGISTRY[language_model_to_use]['path']
+    local_path = os.path.join(LOCAL_MODEL_DIR, path)
+    if not os.path.isdir(path) and os.path.isdir(local_path):
+        return local_path
+    return path
+
+
+def _from_pretrained(load, path: str, max_retries: int = 3, retry_wait: float = 10.0):
+    """
+    Description: Load from a local directory or the local hub cache first and only go to the network on a cache miss,
+    retrying a few times with a short backoff instead of sleeping for minutes
+    """
+    if os.path.isdir(path):
+        return load(path, local_files_only=True)
+    try:
+        return load(path, local_files_only=True)
+    except (OSError, ValueError):
+        if os.environ.get("TRANSFORMERS_OFFLINE") == "1" or os.environ.get("HF_HUB_OFFLINE") == "1":
+            raise
+    for attempt in range(max_retries):
+        try:
+            return load(path)
+        except OSError as e:
+            if attempt == max_retries - 1:
+                raise
+            print(e)
+            sleep(retry_wait * (2 ** attempt))
+
+
+def load_tokenizer(language_model_to_use: str):
+    """
+    Description: Tokenizer for a registered language model, loaded once per process
+    """
+    if language_model_to_use not in _tokenizers:
+        entry = MODEL_REGISTRY[language_model_to_use]
+        if 'vocab_file' in entry:
+            tokenizer = entry['tokenizer_class'](vocab_file=entry['vocab_file'], do_lower_case=True, do_basic_tokenize=True)
+        else:
+            tokenizer = _from_pretrained(lambda path, **kwargs: entry['tokenizer_class'].from_pretrained(path, do_lower_case=True, do_basic_tokenize=True, **kwargs),
+                                         resolve_path(language_model_to_use))
+        _tokenizers[language_model_to_use] = tokenizer
+    return _tokenizers[language_model_to_use]
+
+
+def _reinitialize_new_weights(model, missing_keys):
+    # weights missing from the checkpoint (the classification head) are re-drawn so every copy depends on the current torch seed
+    module_names = {key.rsplit('.', 1)[0] for key in missing_keys}
+    for name, module in model.named_modules():
+        if name in module_names:
+            model._init_weights(module)
+
+
+def load_model(language_model_to_use: str, device, num_labels: int = 3):
+    """
+    Description: Fresh copy of a registered pretrained model with a newly initialized classification head.
+    The pretrained weights are read from disk once per process and deep copied for every run, including the first,
+    so the random numbers a run draws after torch.manual_seed (head, split, dropout) do not depend on which model
+    was loaded earlier in the process.
+    """
+    key = (language_model_to_use, num_labels)
+    if key not in _pristine_models:
+        entry = MODEL_REGISTRY[language_model_to_use]
+        # from_pretrained runs the default init of every layer, keep those draws out of the caller's random stream
+        with torch.random.fork_rng(devices=[]):
+            model, loading_info = _from_pretrained(lambda path, **kwargs: entry['model_class'].from_pretrained(path, num_labels=num_labels, output_loading_info=True, **kwargs),
+                                                   resolve_path(language_model_to_use))
+        _pristine_models[key] = (model, loading_info['missing_keys'])
+    pristine_model, missing_keys = _pristine_models[key]
+    model = copy.deepcopy(pristine_model)
+    _reinitialize_new_weights(model, missing_keys)
+    return model.to(device)
+
+
+def clear_cache():
+    _pristine_models.clear()
+    _tokenizers.clear()
+
+
+def warm_cache(language_models, model_dir: str = LOCAL_MODEL_DIR):
+    """
+    Description: Download the given models on a connected machine and store them under model_dir,
+    so that a later run (e.g. on an air-gapped box) resolves them from disk
+    """
+    for language_model_to_use in language_models:
+        entry = MODEL_REGISTRY[language_model_to_use]
+        if os.path.isdir(entry['path']):
+            continue
+        save_path = os.path.join(model_dir, entry['path'])
+        load_tokenizer(language_model_to_use).save_pretrained(save_path)
+        model = load_model(language_model_to_use, 'cpu')
+        # only the pretrained encoder is stored, so the classification head is still freshly drawn on every load
+        getattr(model, model.base_model_prefix).save_pretrained(save_path)
+        print("Saved %s to %s" % (language_model_to_use, save_path))
@@ -0,0 +1,274 @@
+import os
+import copy
+
+import numpy as np
+import pandas as pd
+import torch
+import torch.nn.functional as F
+from functorch import combine_state_for_ensemble, vmap
+
+from dynamic_padding import bucketed_data_loader, TokenThroughputMeter
+from model_registry import is_registered, load_tokenizer, load_model
+from metrics import MetricsAccumulator
+from training_engine import MAX_NUM_EPOCHS, MAX_EARLY_STOPPING, EARLY_STOPPING_EPS, EPOCH_RESULT_COLUMNS, load_split, make_loader, save_checkpoint, reset_peak_memory, peak_memory_mb, micro_batch_size_for
+
+
+def stack_batches(batches, batch_size: int, pad_token_id: int, padding_side: str = 'right'):
+    """
+    Description: (R, batch_size, L) input_ids / attention_mask / labels from one (input_ids, attention_mask, labels)
+    batch per replica, padded to the longest sentence over all replicas. Missing rows have label -100 and an empty
+    attention mask. Also returns the number of real rows of every replica.
+    """
+    max_length = max([batch[0].size(1) for batch in batches if batch[0].size(0) > 0] or [1])
+    input_ids = torch.full((len(batches), batch_size, max_length), pad_token_id if pad_token_id is not None else 0, dtype=torch.long)
+    attention_masks = torch.zeros((len(batches), batch_size, max_length), dtype=torch.long)
+    labels = torch.full((len(batches), batch_size), -100, dtype=torch.long)
+    sizes = []
+    for r, (ids, masks, batch_labels) in enumerate(batches):
+        n, length = ids.shape
+        offset = max_length - length if padding_side == 'left' else 0
+        input_ids[r, :n, offset:offset + length] = ids
+        attention_masks[r, :n, offset:offset + length] = masks
+        labels[r, :n] = batch_labels
+        sizes.append(n)
+    return input_ids, attention_masks, labels, sizes
+
+
+class StackedAdamW:
+    """
+    Description: torch.optim.AdamW (same defaults and update order) over parameters stacked along a leading replica
+    dimension, with a step count per replica. step(active) updates only the replicas in the boolean mask active and
+    clears their gradients; the others keep their weights, moments and step count, so each replica is updated as a
+    separate AdamW would update it from the same gradients.
+    """
+    def __init__(self, params, num_replicas: int, lr: float = 1e-3, betas=(0.9, 0.999), eps: float = 1e-8, weight_decay: float = 1e-2):
+        self.params = list(params)
+        self.lr = lr
+        self.beta1, self.beta2 = betas
+        self.eps = eps
+        self.weight_decay = weight_decay
+        self.steps = torch.zeros(num_replicas, device=self.params[0].device)
+        self.exp_avg = [torch.zeros_like(p) for p in self.params]
+        self.exp_avg_sq = [torch.zeros_like(p) for p in self.params]
+
+    def zero_grad(self):
+        for p in self.params:
+            p.grad = None
+
+    @torch.no_grad()
+    def step(self, active):
+        self.steps += active
+        bias_correction1 = 1 - self.beta1 ** self.steps
+        bias_correction2_sqrt = (1 - self.beta2 ** self.steps).sqrt()
+        for p, exp_avg, exp_avg_sq in zip(self.params, self.exp_avg, self.exp_avg_sq):
+            if p.grad is None:
+                continue
+            shape = (-1,) + (1,) * (p.dim() - 1)
+            mask = active.view(shape)
+            grad = p.grad
+            p.copy_(torch.where(mask, p * (1 - self.lr * self.weight_decay), p))
+            exp_avg.copy_(torch.where(mask, exp_avg * self.beta1 + grad * (1 - self.beta1), exp_avg))
+            exp_avg_sq.copy_(torch.where(mask, exp_avg_sq * self.beta2 + grad * grad * (1 - self.beta2), exp_avg_sq))
+            # inactive replicas may have a zero step count, clamp so their (discarded) update stays finite
+            denom = (exp_avg_sq.sqrt() / bias_correction2_sqrt.clamp(min=self.eps).view(shape)).add_(self.eps)
+            step_size = self.lr / bias_correction1.clamp(min=self.eps).view(shape)
+            p.copy_(torch.where(mask, p - step_size * exp_avg / denom, p))
+            grad.masked_fill_(mask, 0)
+
+
+class StackedReplicas:
+    """
+    Description: R copies of one architecture (one per seed) trained as a single vectorized model. The parameters of
+    all copies are stacked along a leading replica dimension (functorch.combine_state_for_ensemble) and the forward
+    pass is vmapped over it, so every step runs all seeds in one set of kernels. StackedAdamW updates every replica
+    as a separate AdamW would, and leaves alone the replicas that take no part in a step.
+    """
+    def __init__(self, models, learning_rate: float):
+        self.template = copy.deepcopy(models[0]).cpu()
+        # non-persistent buffers (e.g. constant token_type_ids) are stacked too, but are no part of a saved state dict
+        self.state_keys = set(self.template.state_dict())
+        self.fmodel, params, buffers = combine_state_for_ensemble(models)
+        self.params = [param.requires_grad_() for param in params]
+        self.buffers = list(buffers)
+        self.num_replicas = len(models)
+        self.optimizer = StackedAdamW(self.params, self.num_replicas, lr=learning_rate)
+
+    def _forward(self, params, buffers, input_ids, attention_mask):
+        return self.fmodel(params, buffers, input_ids=input_ids, attention_mask=attention_mask).logits
+
+    def logits(self, input_ids, attention_masks):
+        return vmap(self._forward, randomness='different')(self.params, self.buffers, input_ids, attention_masks)
+
+    def train(self, mode: bool = True):
+        self.fmodel.train(mode)
+
+    def replica_state_dict(self, r: int):
+        state = {name: param[r].detach().cpu() for name, param in zip(self.fmodel.param_names, self.params)}
+        state.update({name: buffer[r].cpu() for name, buffer in zip(self.fmodel.buffer_names, self.buffers) if name in self.state_keys})
+        return state
+
+    def replica_model(self, r: int):
+        model = copy.deepcopy(self.template)
+        # strict, a key missing from the replica would silently keep the template's (replica 0's) weights
+        model.load_state_dict(self.replica_state_dict(r))
+        return model
+
+
+def run_stacked_epoch(replicas, loaders, micro_batch_size: int, tokenizer, device, training: bool, gradient_accumulation_steps: int = 1, autocast_dtype=None):
+    """
+    Description: One pass of every replica over its own loader, None for a replica that sits the pass out (stopped
+    early). The number of steps is that of the longest loader; a replica whose loader has run out gets empty rows,
+    which add nothing to its loss or gradient, and takes no optimizer steps: every replica sees each of its samples
+    once per epoch and takes as many optimizer steps as a single run. The batches are not those of a single run of
+    the same seed (each replica shuffles from its own generator, a single run from the global RNG, and dropout masks
+    are drawn per replica inside vmap), so the results are statistically equivalent to single runs, not identical.
+    Its last accumulation group is averaged over the micro-batches it really has, as in training_engine.run_epoch.
+    Returns one (loss, accuracy, weighted F1) per replica, the combined TokenThroughputMeter and the number of
+    optimizer steps.
+    """
+    lengths = [len(loader) if loader is not None else 0 for loader in loaders]
+    steps = max(lengths)
+    iterators = [iter(loader) if loader is not None else None for loader in loaders]
+    metrics = [MetricsAccumulator(n * micro_batch_size, device) for n in lengths]
+    gas = gradient_accumulation_steps
+    last_group_starts = [n - (n % gas or gas) for n in lengths]
+    empty = (torch.zeros((0, 1), dtype=torch.long), torch.zeros((0, 1), dtype=torch.long), torch.zeros(0, dtype=torch.long))
+    throughput = TokenThroughputMeter()
+    optimizer_steps = 0
+    replicas.train(training)
+    if training:
+        replicas.optimizer.zero_grad()
+
+    for step in range(1, steps + 1):
+        batches = [next(iterators[r]) if step <= n else empty for r, n in enumerate(lengths)]
+        input_ids, attention_masks, labels, sizes = stack_batches(batches, micro_batch_size, tokenizer.pad_token_id, getattr(tokenizer, 'padding_side', 'right'))
+        throughput.update(attention_masks)
+        input_ids = input_ids.to(device)
+        attention_masks = attention_masks.to(device)
+        labels = labels.to(device)
+        with torch.set_grad_enabled(training):
+            with torch.autocast(device_type=device.type, dtype=autocast_dtype, enabled=autocast_dtype is not None):
+                logits = replicas.logits(input_ids, attention_masks)
+            losses = F.cross_entropy(logits.flatten(0, 1).float(), labels.flatten(), ignore_index=-100, reduction='none').view(labels.shape)
+            # mean loss over the real rows of every replica, as the model computes it for a single run
+            replica_losses = losses.sum(dim=1) / (labels >= 0).sum(dim=1).clamp(min=1)
+            if training:
+                group_sizes = torch.tensor([gas if step <= start else max(n - start, 1) for n, start in zip(lengths, last_group_starts)], dtype=replica_losses.dtype, device=device)
+                (replica_losses / group_sizes).sum().backward()
+                stepping = [step <= n and (step % gas == 0 or step == n) for n in lengths]
+                if any(stepping):
+                    replicas.optimizer.step(torch.tensor(stepping, device=device))
+                    optimizer_steps += 1
+        for r, n in enumerate(sizes):
+            if n > 0:
+                metrics[r].update(replica_losses[r], logits[r, :n], labels[r, :n])
+    return [m.compute() for m in metrics], throughput, optimizer_steps
+
+
+def train_lm_hawkish_dovish_multi_seed(gpu_numbers: str, train_data_paths, test_data_paths, language_model_to_use: str, seeds, batch_size: int, learning_rate: float, save_model_path: str,
+                                       data_category: str = '', precision: str = 'fp32', gradient_accumulation_steps: int = 1, gradient_checkpointing: bool = False):
+    """
+    Description: train_lm_hawkish_dovish for several seeds at once, as one vmapped ensemble (see StackedReplicas).
+    The tokenizer, the pretrained weights and the token cache are shared; every seed still gets its own training file,
+    head initialization, train-val split, shuffling order and early stopping. Returns one experiment_results row
+    per seed, in the same format as train_lm_hawkish_dovish; they are statistically equivalent to, not identical with,
+    the rows of separate runs (see run_stacked_epoch).
+    Gradient checkpointing is not combined with vmap and is ignored here.
+    """
+    if precision not in ('fp32', 'bf16'):
+        raise ValueError("precision must be 'fp32' or 'bf16', got %r" % precision)
+    micro_batch_size = micro_batch_size_for(batch_size, gradient_accumulation_steps)
+    os.environ["CUDA_VISIBLE_DEVICES"] = str(gpu_numbers)
+    device = torch.device('cuda') if torch.cuda.is_available() else torch.device('cpu')
+    print("Device assigned: ", device)
+    if not is_registered(language_model_to_use):
+        return -1
+    if gradient_checkpointing:
+        print("Gradient checkpointing is not supported for stacked seeds, training without it")
+    tokenizer = load_tokenizer(language_model_to_use)
+    autocast_dtype = torch.bfloat16 if precision == 'bf16' else None
+
+    models, train_loaders, val_loaders, test_loaders, sizes = [], [], [], [], []
+    for seed, train_data_path, test_data_path in zip(seeds, train_data_paths, test_data_paths):
+        dataset = load_split(train_data_path, tokenizer, language_model_to_use)
+        dataset_test = load_split(test_data_path, tokenizer, language_model_to_use)
+        val_length = int(len(dataset) * 0.2)
+        train_length = len(dataset) - val_length
+
+        # same seeding order as a single run: seed, model (head initialization), train-val split
+        torch.manual_seed(seed)
+        np.random.seed(seed)
+        models.append(load_model(language_model_to_use, device))
+        train, val = torch.utils.data.random_split(dataset=dataset, lengths=[train_length, val_length], generator=torch.Generator().manual_seed(seed))
+        # every seed shuffles its own batches from its own generator
+        generator = torch.Generator().manual_seed(seed)
+        train_loaders.append(bucketed_data_loader(train, micro_batch_size, tokenizer, shuffle=True, generator=generator))
+        val_loaders.append(bucketed_data_loader(val, micro_batch_size, tokenizer, shuffle=True, generator=generator))
+        test_loaders.append(make_loader(dataset_test, micro_batch_size, tokenizer, False))
+        sizes.append((train_length, val_length, len(dataset_test)))
+        print(f'Seed {seed}: Train Size: {train_length}, Validation Size: {val_length}, Test Size: {len(dataset_test)}')
+
+    replicas = StackedReplicas(models, learning_rate)
+    del models
+    reset_peak_memory(device)
+
+    num_replicas = len(seeds)
+    early_stopping_count = [0] * num_replicas
+    best_ce = [float('inf')] * num_replicas
+    best_accuracy = [float('-inf')] * num_replicas
+    best_f1 = [float('-inf')] * num_replicas
+    epoch_result_train = [[] for _ in seeds]
+    epoch_result_val = [[] for _ in seeds]
+    eps = EARLY_STOPPING_EPS
+    stopped = set()
+
+    for epoch in range(MAX_NUM_EPOCHS):
+        print("epoch(%d)" % epoch)
+        for r in range(num_replicas):
+            if early_stopping_count[r] >= MAX_EARLY_STOPPING and r not in stopped:
+                print("Seed %d stopped after epoch %d" % (seeds[r], epoch))
+                stopped.add(r)
+        active = [r for r in range(num_replicas) if r not in stopped]
+        if not active:
+            break
+        for r in active:
+            early_stopping_count[r] += 1
+
+        # stopped seeds sit the epoch out and keep their weights
+        epoch_train_loaders = [loader if r not in stopped else None for r, loader in enumerate(train_loaders)]
+        epoch_val_loaders = [loader if r not in stopped else None for r, loader in enumerate(val_loaders)]
+        train_metrics, throughput, optimizer_steps = run_stacked_epoch(replicas, epoch_train_loaders, micro_batch_size, tokenizer, device, True, gradient_accumulation_steps, autocast_dtype)
+        step_time = throughput.elapsed() / max(optimizer_steps, 1)
+        print("Train Tokens/sec (all seeds): ", throughput.tokens_per_second())
+        for r in active:
+            epoch_result_train[r].append(list(train_metrics[r]) + [throughput.tokens_per_second() / num_replicas, step_time, peak_memory_mb(device)])
+
+        val_metrics, throughput, _ = run_stacked_epoch(replicas, epoch_val_loaders, micro_batch_size, tokenizer, device, False, autocast_dtype=autocast_dtype)
+        for r in active:
+            curr_ce, curr_accuracy, currF1 = val_metrics[r]
+            epoch_result_val[r].append([curr_ce, curr_accuracy, currF1, throughput.tokens_per_second() / num_replicas])
+            if curr_ce <= best_ce[r] - eps:
+                best_ce[r] = curr_ce
+                early_stopping_count[r] = 0
+            if curr_accuracy >= best_accuracy[r] + eps:
+                best_accuracy[r] = curr_accuracy
+                early_stopping_count[r] = 0
+            if currF1 >= best_f1[r] + eps:
+                best_f1[r] = currF1
+                early_stopping_count[r] = 0
+            print("Seed %d Val CE: %f, Val Accuracy: %f, Val F1: %f, Early Stopping Count: %d" % (seeds[r], curr_ce, curr_accuracy, currF1, early_stopping_count[r]))
+
+    ## ------------------testing---------------------
+    test_metrics, throughput, _ = run_stacked_epoch(replicas, test_loaders, micro_batch_size, tokenizer, device, False, autocast_dtype=autocast_dtype)
+    print("Test Tokens/sec (all seeds): ", throughput.tokens_per_second())
+
+    results = []
+    for r, seed in enumerate(seeds):
+        test_ce, test_accuracy, test_f1 = test_metrics[r]
+        mean_step_time = float(np.mean([result[4] for result in epoch_result_train[r]])) if epoch_result_train[r] else 0.0
+        results.append([seed, learning_rate, batch_size, best_ce[r], best_accuracy[r], best_f1[r], test_ce, test_accuracy, test_f1, peak_memory_mb(device), mean_step_time])
+        if save_model_path != None:
+            df_epoch_results = pd.DataFrame([train + valid for train, valid in zip(epoch_result_train[r], epoch_result_val[r])], columns=EPOCH_RESULT_COLUMNS)
+            save_path = save_model_path + language_model_to_use + data_category + '-' + str(seed) + '-' + str(learning_rate) + '-' + str(batch_size)
+            save_checkpoint(replicas.replica_model(r), tokenizer, save_path, df_epoch_results)
+    return results
@@ -0,0 +1,94 @@
+import os
+import re
+import hashlib
+import sqlite3
+import unicodedata
+from collections import OrderedDict
+
+import numpy as np
+
+CACHE_PATH = os.environ.get("FOMC_PREDICTION_CACHE", "../model_data/prediction_cache.sqlite")
+
+
+def normalize_sentence(sentence: str):
+    """
+    Description: Unicode NFKC with collapsed whitespace, so copies of a boilerplate sentence that only differ in
+    spacing or typographic encoding share one cache entry. Case is kept since the cased models see it.
+    """
+    return re.sub(r"\s+", " ", unicodedata.normalize("NFKC", sentence)).strip()
+
+
+class PredictionCache:
+    """
+    Description: Persistent sentence -> logits cache keyed by (normalized sentence hash, model id). Entries live in
+    a SQLite file as float32 blobs behind an in-memory LRU of the most recently used sentences.
+    """
+    def __init__(self, model_id: str, path: str = CACHE_PATH, capacity: int = 100000):
+        self.model_id = model_id
+        self.path = path
+        self.capacity = capacity
+        self.memory = OrderedDict()
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.connection = sqlite3.connect(path)
+        self.connection.execute("CREATE TABLE IF NOT EXISTS logits (key BLOB PRIMARY KEY, value BLOB NOT NULL)")
+
+    def key(self, sentence):
+        sentence = normalize_sentence(sentence) if isinstance(sentence, str) else ""
+        return hashlib.sha1((self.model_id + "\0" + sentence).encode("utf-8")).digest()
+
+    def _remember(self, key, value):
+        self.memory[key] = value
+        self.memory.move_to_end(key)
+        if len(self.memory) > self.capacity:
+            self.memory.popitem(last=False)
+
+    def lookup(self, keys):
+        """
+        Description: Cached logits for each key, None where the sentence has not been scored by this model yet
+        """
+        found = [None] * len(keys)
+        disk_keys = []
+        for i, key in enumerate(keys):
+            if key in self.memory:
+                self.memory.move_to_end(key)
+                found[i] = self.memory[key]
+                self.memory_hits += 1
+            else:
+                disk_keys.append(i)
+
+        # SQLite limits the number of bound parameters, so look the remaining keys up in chunks
+        for start in range(0, len(disk_keys), 500):
+            chunk = disk_keys[start:start + 500]
+            rows = self.connection.execute("SELECT key, value FROM logits WHERE key IN (%s)" % ",".join("?" * len(chunk)),
+                                           [keys[i] for i in chunk]).fetchall()
+            values = {key: np.frombuffer(value, dtype=np.float32) for key, value in rows}
+            for i in chunk:
+                if keys[i] in values:
+                    found[i] = values[keys[i]]
+                    self._remember(keys[i], found[i])
+                    self.disk_hits += 1
+                else:
+                    self.misses += 1
+        return found
+
+    def store(self, keys, logits):
+        logits = np.asarray(logits, dtype=np.float32)
+        for key, value in zip(keys, logits):
+            self._remember(key, value)
+        self.connection.executemany("INSERT OR REPLACE INTO logits (key, value) VALUES (?, ?)",
+                                    [(key, value.tobytes()) for key, value in zip(keys, logits)])
+        self.connection.commit()
+
+    def hit_rate(self):
+        total = self.memory_hits + self.disk_hits + self.misses
+        return (self.memory_hits + self.disk_hits) / total if total > 0 else 0.0
+
+    def report(self):
+        print("Prediction cache: %d memory hits, %d disk hits, %d misses (hit rate %.1f%%)"
+              % (self.memory_hits, self.disk_hits, self.misses, 100 * self.hit_rate()))
+
+    def close(self):
+        self.connection.close()
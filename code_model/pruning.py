@@ -0,0 +1,66 @@
+import os
+import json
+import math
+
+PRUNING_DIR = "../model_data/pruning"
+
+
+class SuccessiveHalvingPruner:
+    """
+    Description: Asynchronous successive halving over the hyperparameter grid. At every rung (an epoch budget) a run
+    reports its validation metric and is stopped unless it ranks within the top 1/reduction_factor of all runs of the
+    same group that reached that rung so far. With reduction_factor=2 this is median pruning. Reports are appended to
+    a shared file, so runs in different grid worker processes are compared with each other.
+    """
+    def __init__(self, history_path: str, trial_id: str, rungs=(3, 9, 27), reduction_factor: int = 2, min_trials: int = 4, metric: str = 'f1'):
+        self.history_path = history_path
+        self.trial_id = trial_id
+        self.rungs = set(rungs)
+        self.reduction_factor = reduction_factor
+        self.min_trials = min_trials
+        self.metric = metric
+
+    def _read_rung(self, epoch: int):
+        values = {}
+        if os.path.exists(self.history_path):
+            with open(self.history_path) as f:
+                for line in f:
+                    line = line.strip()
+                    if line:
+                        record = json.loads(line)
+                        if record["epoch"] == epoch:
+                            values[record["trial_id"]] = record["value"]
+        return values
+
+    def _report(self, epoch: int, value: float):
+        os.makedirs(os.path.dirname(self.history_path), exist_ok=True)
+        with open(self.history_path, 'a') as f:
+            f.write(json.dumps({"trial_id": self.trial_id, "epoch": epoch, "value": value}) + "\n")
+
+    def should_stop(self, epoch: int, val_f1: float, val_ce: float):
+        """
+        Description: Called after every validation pass with the number of finished epochs; True if this run should stop
+        """
+        if epoch not in self.rungs:
+            return False
+        value = float(val_f1) if self.metric == 'f1' else -float(val_ce)
+        peers = self._read_rung(epoch)
+        peers.pop(self.trial_id, None)
+        self._report(epoch, value)
+
+        values = list(peers.values()) + [value]
+        if len(values) < self.min_trials:
+            return False
+        keep = max(1, math.ceil(len(values) / self.reduction_factor))
+        rank = sum(1 for v in values if v > value)
+        return rank >= keep
+
+
+def grid_pruner(language_model_to_use: str, data_category: str, seed: int, trial_id: str, run_id: str, pruning_dir: str = PRUNING_DIR):
+    """
+    Description: Pruner comparing all batch size / learning rate cells of one model, data category and seed within
+    one grid run (see grid_scheduler.grid_run_id), so a rerun of the grid is not ranked against the rung values of
+    earlier runs
+    """
+    history_path = os.path.join(pruning_dir, run_id, "%s_%s_%d.jsonl" % (language_model_to_use, data_category, seed))
+    return SuccessiveHalvingPruner(history_path, trial_id)
@@ -20,56 +20,113 @@ B2 = ["ease", "easing", "rise", "rising", "increase", "expand", "improve", "stro
 
 C = ["weren't", "were not", "wasn't", "was not", 'did not', "didn't", "do not", "don't", 'will not', "won't"]
 
+GROUP_NAMES = ["A1", "A2", "B1", "B2", "C"]
+LEXICONS = [A1, A2, B1, B2, C]
+
 dir = "../training_data/test-and-training/test_data/"
 output_dir = "../rule_based_results/"
-test_dir = sorted(os.listdir(dir))
 
 
-def rule_model(df):
-    sentences = df['sentence'].tolist()
-    pred = []
-    for s in sentences:
-        label = 0
-        if (any(word in s.lower() for word in A1) and any(word in s.lower() for word in A2)) or \
-                (any(word in s.lower() for word in B1) and any(word in s.lower() for word in B2)):
-            label = 0
-        elif (any(word in s.lower() for word in A1) and any(word in s.lower() for word in B2)) or \
-                (any(word in s.lower() for word in B1) and any(word in s.lower() for word in A2)):
-            label = 1
+class LexiconMatcher:
+    """
+    Description: All lexicon groups compiled into one regex. The alternation sits inside a lookahead, so a single
+    finditer over the lowercased sentence tries every start position and finds overlapping hits such as
+    "employment" inside "unemployment", matching the substring semantics of `word in s.lower()`.
+    At a start position the regex only reports one term, which is exact as long as no term is a prefix of a term
+    from another group; for lexicons where that does not hold, one regex per group is used instead.
+    """
+    def __init__(self, lexicons=LEXICONS):
+        self.num_groups = len(lexicons)
+        self.group_of = {}
+        for group, words in enumerate(lexicons):
+            for word in words:
+                self.group_of.setdefault(word.lower(), []).append(group)
+        words = sorted(self.group_of, key=len, reverse=True)
+        self.single_pass = not any(other.startswith(word) and self.group_of[other] != self.group_of[word]
+                                   for word in words for other in words)
+        if self.single_pass:
+            self.pattern = re.compile("(?=(%s))" % "|".join(re.escape(word) for word in words))
         else:
-            label = 2
-        if label != 2 and (any(word in s.lower() for word in C)):
-            pred.append(1 - label)  # turn 0 to 1, and 1 to 0
+            self.group_patterns = [re.compile("|".join(re.escape(word.lower()) for word in sorted(group_words, key=len, reverse=True)))
+                                   for group_words in lexicons]
+
+    def hits(self, sentence: str):
+        """
+        Description: Boolean vector with one entry per lexicon group, True if any word of the group occurs in the sentence
+        """
+        row = np.zeros(self.num_groups, dtype=bool)
+        if not isinstance(sentence, str):
+            return row
+        lowered = sentence.lower()
+        if self.single_pass:
+            for match in self.pattern.finditer(lowered):
+                row[self.group_of[match.group(1)]] = True
         else:
-            pred.append(label)
+            for group, pattern in enumerate(self.group_patterns):
+                row[group] = pattern.search(lowered) is not None
+        return row
+
+    def hit_matrix(self, sentences):
+        """
+        Description: (N, number of groups) boolean matrix of lexicon hits for a list of sentences
+        """
+        matrix = np.zeros((len(sentences), self.num_groups), dtype=bool)
+        for i, sentence in enumerate(sentences):
+            matrix[i] = self.hits(sentence)
+        return matrix
+
+
+matcher = LexiconMatcher()
+
+
+def labels_from_hits(hit_matrix):
+    """
+    Description: Rule labels from an (N, 5) A1/A2/B1/B2/C hit matrix: 0 for A1&A2 or B1&B2, otherwise 1 for A1&B2 or
+    B1&A2, otherwise 2. A negation (C) flips 0 and 1.
+    """
+    a1, a2, b1, b2, c = hit_matrix.T
+    labels = np.full(len(hit_matrix), 2, dtype=np.int64)
+    labels[(a1 & b2) | (b1 & a2)] = 1
+    labels[(a1 & a2) | (b1 & b2)] = 0
+    negated = (labels != 2) & c
+    labels[negated] = 1 - labels[negated]
+    return labels
 
-    return pred
+
+def rule_labels(sentences):
+    return labels_from_hits(matcher.hit_matrix(sentences))
+
+
+def rule_model(df):
+    return rule_labels(df['sentence'].tolist()).tolist()
 
 
 remove_digits = str.maketrans('', '', digits)
 
-score_dict = {}
-for i, f in enumerate(test_dir):
-    file = pd.read_excel(os.path.join(dir, f))
-
-    predicted = rule_model(file)  # make predictions
-    actual = [int(x) for x in file['label'].tolist()]  # actual labels
-    file['pred_label'] = predicted  # add column for predicted labels
-    file = file[['sentence', 'year', 'label', 'pred_label']]
-    name = f.replace(".xlsx", "").replace("-test", "")
-    seed = int(re.findall("\d+", name)[0])  # find specific seed of file
-    base_name = name.translate(remove_digits)[:-1]  # file type (mm, pres conf, speed)
-    file.to_excel(output_dir + base_name + "-results-" + str(seed) + ".xlsx", index=False)  # save test results
-
-    cp = skm.classification_report(y_true=actual, y_pred=predicted, output_dict=True)
-    print(base_name)
-    print(cp['weighted avg']['f1-score'])
-    if base_name in score_dict:
-        score_dict[base_name].append(cp['weighted avg']['f1-score'])
-    else:
-        score_dict[base_name] = [cp['weighted avg']['f1-score']]
-
-for data in score_dict:
-    score_dict[data] = (np.mean(score_dict[data]), np.std(score_dict[data]))
-print(score_dict)
+if __name__ == "__main__":
+    test_dir = sorted(os.listdir(dir))
+    score_dict = {}
+    for i, f in enumerate(test_dir):
+        file = pd.read_excel(os.path.join(dir, f))
+
+        predicted = rule_model(file)  # make predictions
+        actual = [int(x) for x in file['label'].tolist()]  # actual labels
+        file['pred_label'] = predicted  # add column for predicted labels
+        file = file[['sentence', 'year', 'label', 'pred_label']]
+        name = f.replace(".xlsx", "").replace("-test", "")
+        seed = int(re.findall("\d+", name)[0])  # find specific seed of file
+        base_name = name.translate(remove_digits)[:-1]  # file type (mm, pres conf, speed)
+        file.to_excel(output_dir + base_name + "-results-" + str(seed) + ".xlsx", index=False)  # save test results
+
+        cp = skm.classification_report(y_true=actual, y_pred=predicted, output_dict=True)
+        print(base_name)
+        print(cp['weighted avg']['f1-score'])
+        if base_name in score_dict:
+            score_dict[base_name].append(cp['weighted avg']['f1-score'])
+        else:
+            score_dict[base_name] = [cp['weighted avg']['f1-score']]
+
+    for data in score_dict:
+        score_dict[data] = (np.mean(score_dict[data]), np.std(score_dict[data]))
+    print(score_dict)
 
@@ -0,0 +1,263 @@
+import sys
+import json
+import socket
+import asyncio
+import argparse
+import http.client
+from time import perf_counter
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import torch
+
+from batch_inference import load_classifier, softmax, StreamingLabeler
+
+
+class MicroBatcher:
+    """
+    Description: asyncio request queue in front of a StreamingLabeler. Concurrent requests are coalesced into one
+    model call once max_batch_size sentences are waiting or the oldest has waited max_wait_ms. The model runs in a
+    single worker thread so the event loop keeps accepting requests while a batch is scored.
+    """
+    def __init__(self, labeler, max_batch_size: int = 32, max_wait_ms: float = 5.0, latency_window: int = 10000):
+        self.labeler = labeler
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000.0
+        self.id2label = labeler.model.config.id2label
+        self.queue = None
+        self.executor = ThreadPoolExecutor(max_workers=1)
+        self.latencies = []
+        self.latency_window = latency_window
+        self.batch_sizes = []
+
+    async def start(self):
+        self.queue = asyncio.Queue()
+        return asyncio.get_running_loop().create_task(self.run())
+
+    async def classify(self, sentences):
+        """
+        Description: {'label', 'score', 'probabilities'} per sentence, resolved once their micro-batch is scored
+        """
+        loop = asyncio.get_running_loop()
+        futures = []
+        for sentence in sentences:
+            future = loop.create_future()
+            await self.queue.put((sentence, future, perf_counter()))
+            futures.append(future)
+        return await asyncio.gather(*futures)
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self.queue.get()]
+            deadline = loop.time() + self.max_wait
+            while len(batch) < self.max_batch_size:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self.queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+            try:
+                logits = await loop.run_in_executor(self.executor, self.labeler.predict_logits, [sentence for sentence, _, _ in batch])
+            except Exception as e:
+                for _, future, _ in batch:
+                    if not future.done():
+                        future.set_exception(e)
+                continue
+            probabilities = softmax(logits)
+            now = perf_counter()
+            for (_, future, enqueued), p in zip(batch, probabilities):
+                k = int(p.argmax())
+                if not future.done():
+                    future.set_result({'label': self.id2label[k], 'score': float(p[k]),
+                                       'probabilities': {self.id2label[j]: float(p[j]) for j in range(len(p))}})
+                self.latencies.append(now - enqueued)
+            self.batch_sizes.append(len(batch))
+            del self.latencies[:-self.latency_window]
+            del self.batch_sizes[:-self.latency_window]
+
+    def stats(self):
+        latencies = np.array(self.latencies) * 1000 if self.latencies else np.zeros(1)
+        return {'requests': len(self.latencies), 'mean_batch_size': float(np.mean(self.batch_sizes)) if self.batch_sizes else 0.0,
+                'p50_ms': float(np.percentile(latencies, 50)), 'p99_ms': float(np.percentile(latencies, 99)), 'max_ms': float(latencies.max())}
+
+
+class BadRequest(ValueError):
+    pass
+
+
+async def read_request(reader):
+    """
+    Description: (method, path, headers, body) of one HTTP/1.1 request, None when the client closed the connection.
+    Raises BadRequest for a malformed request line or Content-Length.
+    """
+    request_line = await reader.readline()
+    if not request_line:
+        return None
+    try:
+        method, path, _ = request_line.decode('latin-1').split(' ', 2)
+    except ValueError:
+        raise BadRequest("malformed request line %r" % request_line[:100])
+    headers = {}
+    while True:
+        line = await reader.readline()
+        if line in (b'\r\n', b'\n', b''):
+            break
+        name, _, value = line.decode('latin-1').partition(':')
+        headers[name.strip().lower()] = value.strip()
+    try:
+        content_length = int(headers.get('content-length', 0))
+    except ValueError:
+        raise BadRequest("invalid Content-Length %r" % headers['content-length'])
+    if content_length < 0:
+        raise BadRequest("invalid Content-Length %r" % headers['content-length'])
+    body = await reader.readexactly(content_length)
+    return method, path, headers, body
+
+
+def write_response(writer, status: int, payload, keep_alive: bool = True):
+    body = json.dumps(payload).encode('utf-8')
+    reason = {200: 'OK', 400: 'Bad Request', 404: 'Not Found', 500: 'Internal Server Error'}[status]
+    writer.write(('HTTP/1.1 %d %s\r\nContent-Type: application/json\r\nContent-Length: %d\r\nConnection: %s\r\n\r\n'
+                  % (status, reason, len(body), 'keep-alive' if keep_alive else 'close')).encode('latin-1') + body)
+
+
+def make_handler(batcher):
+    """
+    Description: Connection handler for asyncio.start_server / start_unix_server. Routes:
+    POST /classify with {"sentence": str} or {"sentences": [str, ...]}, GET /stats and GET /health
+    """
+    async def handle(reader, writer):
+        try:
+            while True:
+                try:
+                    request = await read_request(reader)
+                except BadRequest as e:
+                    # the rest of the stream cannot be framed any more, so answer and close
+                    write_response(writer, 400, {'error': str(e)}, keep_alive=False)
+                    await writer.drain()
+                    break
+                if request is None:
+                    break
+                method, path, headers, body = request
+                keep_alive = headers.get('connection', '').lower() != 'close'
+                if method == 'POST' and path == '/classify':
+                    try:
+                        payload = json.loads(body or b'{}')
+                        if not isinstance(payload, dict):
+                            raise ValueError("body must be a JSON object")
+                        single = 'sentence' in payload
+                        sentences = [payload['sentence']] if single else payload['sentences']
+                        # a bare string would pass as a sequence of one-character sentences
+                        if not isinstance(sentences, list) or not all(isinstance(s, str) for s in sentences):
+                            raise ValueError("sentence must be a string and sentences a list of strings")
+                    except (ValueError, KeyError, TypeError) as e:
+                        write_response(writer, 400, {'error': str(e)}, keep_alive)
+                    else:
+                        try:
+                            results = await batcher.classify(sentences)
+                            write_response(writer, 200, results[0] if single else results, keep_alive)
+                        except Exception as e:
+                            write_response(writer, 500, {'error': str(e)}, keep_alive)
+                elif method == 'GET' and path == '/stats':
+                    write_response(writer, 200, batcher.stats(), keep_alive)
+                elif method == 'GET' and path == '/health':
+                    write_response(writer, 200, {'status': 'ok'}, keep_alive)
+                else:
+                    write_response(writer, 404, {'error': 'unknown route %s %s' % (method, path)}, keep_alive)
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+    return handle
+
+
+async def serve(labeler, host: str = "127.0.0.1", port: int = 8765, unix_socket: str = None, max_batch_size: int = 32, max_wait_ms: float = 5.0):
+    batcher = MicroBatcher(labeler, max_batch_size, max_wait_ms)
+    worker = await batcher.start()
+    if unix_socket is not None:
+        server = await asyncio.start_unix_server(make_handler(batcher), path=unix_socket)
+        print("Scoring server listening on %s" % unix_socket)
+    else:
+        server = await asyncio.start_server(make_handler(batcher), host, port)
+        print("Scoring server listening on http://%s:%d" % (host, port))
+    async with server:
+        try:
+            await server.serve_forever()
+        finally:
+            worker.cancel()
+
+
+class UnixHTTPConnection(http.client.HTTPConnection):
+    def __init__(self, path: str, timeout: float = 30.0):
+        super().__init__("localhost", timeout=timeout)
+        self.unix_socket = path
+
+    def connect(self):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.settimeout(self.timeout)
+        self.sock.connect(self.unix_socket)
+
+
+class ScoringClient:
+    """
+    Description: Minimal client for the scoring server over TCP or a Unix socket, keeping one connection open
+    """
+    def __init__(self, host: str = "127.0.0.1", port: int = 8765, unix_socket: str = None, timeout: float = 30.0):
+        if unix_socket is not None:
+            self.connection = UnixHTTPConnection(unix_socket, timeout)
+        else:
+            self.connection = http.client.HTTPConnection(host, port, timeout=timeout)
+
+    def request(self, method: str, path: str, payload=None):
+        body = json.dumps(payload) if payload is not None else None
+        self.connection.request(method, path, body=body, headers={'Content-Type': 'application/json'})
+        response = self.connection.getresponse()
+        result = json.loads(response.read())
+        if response.status != 200:
+            raise RuntimeError("Scoring server returned %d: %s" % (response.status, result.get('error')))
+        return result
+
+    def classify(self, sentence: str):
+        return self.request('POST', '/classify', {'sentence': sentence})
+
+    def classify_many(self, sentences):
+        return self.request('POST', '/classify', {'sentences': list(sentences)})
+
+    def stats(self):
+        return self.request('GET', '/stats')
+
+    def close(self):
+        self.connection.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="FOMC hawkish-dovish scoring server")
+    parser.add_argument("--model", default="gtfintechlab/FOMC-RoBERTa", help="save_pretrained directory or hub id")
+    parser.add_argument("--onnx", default=None, help="cpu_export directory, serves the INT8 ONNX model instead of --model")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--unix-socket", default=None)
+    parser.add_argument("--max-batch-size", type=int, default=32)
+    parser.add_argument("--max-wait-ms", type=float, default=5.0)
+    args = parser.parse_args()
+
+    device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
+    if args.onnx is not None:
+        from cpu_export import load_onnx
+        device = torch.device("cpu")
+        model, tokenizer = load_onnx(args.onnx)
+    else:
+        model, tokenizer = load_classifier(args.model, device)
+    labeler = StreamingLabeler(model, tokenizer, device, batch_size=args.max_batch_size)
+    # warm up the kernels before the first real request
+    labeler.predict_logits(["The Committee decided to maintain the target range for the federal funds rate."])
+    try:
+        asyncio.run(serve(labeler, args.host, args.port, args.unix_socket, args.max_batch_size, args.max_wait_ms))
+    except KeyboardInterrupt:
+        sys.exit(0)
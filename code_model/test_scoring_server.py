@@ -0,0 +1,119 @@
+import json
+import socket
+import asyncio
+import threading
+import http.client
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+
+pytest.importorskip("torch")
+from scoring_server import MicroBatcher, make_handler
+
+
+class FakeLabeler:
+    """
+    Description: Stands in for a StreamingLabeler, LABEL_1 wins with the sentence length as its logit and the
+    sentence "fail" makes the model call raise
+    """
+    def __init__(self):
+        self.model = SimpleNamespace(config=SimpleNamespace(id2label={0: 'LABEL_0', 1: 'LABEL_1', 2: 'LABEL_2'}))
+
+    def predict_logits(self, sentences):
+        if "fail" in sentences:
+            raise RuntimeError("model failed")
+        return np.array([[0.0, float(len(sentence)), 0.0] for sentence in sentences])
+
+
+@pytest.fixture
+def port():
+    loop = asyncio.new_event_loop()
+    batcher = MicroBatcher(FakeLabeler(), max_batch_size=4, max_wait_ms=1.0)
+
+    async def start():
+        await batcher.start()
+        return await asyncio.start_server(make_handler(batcher), "127.0.0.1", 0)
+
+    server = loop.run_until_complete(start())
+    thread = threading.Thread(target=loop.run_forever, daemon=True)
+    thread.start()
+    yield server.sockets[0].getsockname()[1]
+    loop.call_soon_threadsafe(loop.stop)
+    thread.join()
+    server.close()
+    tasks = asyncio.all_tasks(loop)
+    for task in tasks:
+        task.cancel()
+    loop.run_until_complete(asyncio.gather(*tasks, return_exceptions=True))
+    loop.close()
+    batcher.executor.shutdown()
+
+
+def request(connection, method, path, body=None):
+    connection.request(method, path, body=body, headers={'Content-Type': 'application/json'})
+    response = connection.getresponse()
+    return response.status, json.loads(response.read()), response.getheader('Connection')
+
+
+def raw_request(port, data: bytes):
+    with socket.create_connection(("127.0.0.1", port), timeout=5) as sock:
+        sock.sendall(data)
+        received = b""
+        while True:
+            chunk = sock.recv(4096)
+            if not chunk:
+                return received
+            received += chunk
+
+
+def test_classify_keeps_the_connection_alive(port):
+    connection = http.client.HTTPConnection("127.0.0.1", port, timeout=5)
+    status, result, _ = request(connection, 'POST', '/classify', json.dumps({'sentence': 'Rates rise.'}))
+    sock = connection.sock
+    assert status == 200 and result['label'] == 'LABEL_1'
+    status, results, header = request(connection, 'POST', '/classify', json.dumps({'sentences': ['a', 'bb', 'ccc']}))
+    assert status == 200 and [r['label'] for r in results] == ['LABEL_1'] * 3
+    assert header == 'keep-alive' and connection.sock is sock
+    connection.close()
+
+
+@pytest.mark.parametrize("body", [json.dumps({'sentences': 'abc'}), json.dumps({'sentences': ['a', 3]}), json.dumps({'sentence': 5}),
+                                  json.dumps(['a']), json.dumps({}), '{not json'])
+def test_invalid_payload_is_a_bad_request(port, body):
+    connection = http.client.HTTPConnection("127.0.0.1", port, timeout=5)
+    status, result, header = request(connection, 'POST', '/classify', body)
+    assert status == 400 and 'error' in result and header == 'keep-alive'
+    # the connection stays usable after a rejected payload
+    status, _, _ = request(connection, 'GET', '/health')
+    assert status == 200
+    connection.close()
+
+
+def test_unknown_route_is_not_found(port):
+    connection = http.client.HTTPConnection("127.0.0.1", port, timeout=5)
+    status, result, _ = request(connection, 'GET', '/nowhere')
+    assert status == 404 and 'nowhere' in result['error']
+    connection.close()
+
+
+def test_model_failure_is_an_internal_server_error(port):
+    connection = http.client.HTTPConnection("127.0.0.1", port, timeout=5)
+    status, result, _ = request(connection, 'POST', '/classify', json.dumps({'sentence': 'fail'}))
+    assert status == 500 and result['error'] == 'model failed'
+    status, _, _ = request(connection, 'POST', '/classify', json.dumps({'sentence': 'fine'}))
+    assert status == 200
+    connection.close()
+
+
+@pytest.mark.parametrize("data", [b"garbage\r\n\r\n", b"POST /classify HTTP/1.1\r\nContent-Length: abc\r\n\r\n",
+                                  b"POST /classify HTTP/1.1\r\nContent-Length: -5\r\n\r\n"])
+def test_malformed_request_is_answered_and_closed(port, data):
+    response = raw_request(port, data)
+    assert response.startswith(b"HTTP/1.1 400 Bad Request\r\n") and b"Connection: close\r\n" in response
+
+
+def test_connection_close_is_honored(port):
+    response = raw_request(port, b"GET /health HTTP/1.1\r\nConnection: close\r\n\r\n")
+    assert response.startswith(b"HTTP/1.1 200 OK\r\n") and b"Connection: close\r\n" in response
+    assert response.endswith(b'{"status": "ok"}')
@@ -0,0 +1,89 @@
+import os
+import json
+import hashlib
+import shutil
+import tempfile
+import weakref
+
+import numpy as np
+import pandas as pd
+
+CACHE_DIR = os.environ.get("FOMC_TOKEN_CACHE_DIR", "../model_data/token_cache")
+CACHE_FILES = ["input_ids.npy", "attention_mask.npy", "labels.npy"]
+_fingerprints = weakref.WeakKeyDictionary()
+
+
+def file_hash(path: str):
+    """
+    Description: sha1 of the file content, so a renamed or touched file still hits the cache and an edited one does not
+    """
+    sha = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            sha.update(chunk)
+    return sha.hexdigest()
+
+
+def tokenizer_fingerprint(tokenizer):
+    """
+    Description: sha1 of everything that decides the token ids, so a retrained or updated tokenizer under the same
+    registry name misses the cache: the serialized backend of a fast tokenizer (vocabulary, merges, normalizer,
+    special tokens), or the vocabulary and the tokenizer files of its local directory for a slow one, and the padding and
+    truncation sides. The vocabulary part is hashed once per tokenizer object.
+    """
+    if tokenizer not in _fingerprints:
+        sha = hashlib.sha1()
+        if getattr(tokenizer, 'is_fast', False):
+            sha.update(tokenizer.backend_tokenizer.to_str().encode('utf-8'))
+        else:
+            sha.update(json.dumps(sorted(tokenizer.get_vocab().items())).encode('utf-8'))
+            directory = getattr(tokenizer, 'name_or_path', '')
+            if directory and os.path.isdir(directory):
+                # only the tokenizer's own files, the directory may also hold the model weights
+                names = set(getattr(tokenizer, 'vocab_files_names', {}).values()) | {"tokenizer_config.json", "special_tokens_map.json", "added_tokens.json"}
+                for name in sorted(names):
+                    if os.path.isfile(os.path.join(directory, name)):
+                        sha.update(name.encode('utf-8'))
+                        sha.update(file_hash(os.path.join(directory, name)).encode('utf-8'))
+        _fingerprints[tokenizer] = sha.hexdigest()
+    sides = json.dumps([getattr(tokenizer, 'padding_side', None), getattr(tokenizer, 'truncation_side', None)])
+    return hashlib.sha1((_fingerprints[tokenizer] + sides).encode('utf-8')).hexdigest()
+
+
+def cache_path(data_path: str, tokenizer, tokenizer_name: str, max_length: int, cache_dir: str = CACHE_DIR):
+    return os.path.join(cache_dir, "%s-%s-%d-%s" % (tokenizer_name.replace('/', '_'), tokenizer_fingerprint(tokenizer)[:16], max_length, file_hash(data_path)))
+
+
+def read_sentences(data_path: str):
+    """
+    Description: Sentences and labels of an annotated xlsx split, skipping rows whose sentence is not a string
+    """
+    data_df = pd.read_excel(data_path)
+    data_df = data_df[data_df['sentence'].apply(lambda x: isinstance(x, str))]
+    return data_df['sentence'].to_list(), data_df['label'].to_numpy(dtype=np.int64)
+
+
+def load_tokenized(data_path: str, tokenizer, tokenizer_name: str, max_length: int, cache_dir: str = CACHE_DIR):
+    """
+    Description: input_ids and attention_mask (padded to the longest sentence in the file) and labels of an
+    annotated xlsx split. The first call parses and tokenizes the file and stores the arrays as .npy files keyed by
+    (file content hash, tokenizer name and fingerprint, max_length); later calls memory-map them copy-on-write, so they can be handed
+    to torch.from_numpy without copying.
+    """
+    path = cache_path(data_path, tokenizer, tokenizer_name, max_length, cache_dir)
+    if not all(os.path.exists(os.path.join(path, f)) for f in CACHE_FILES):
+        sentences, labels = read_sentences(data_path)
+        tokens = tokenizer(sentences, return_tensors='np', padding=True, truncation=True, max_length=max_length)
+
+        # write into a temporary directory and rename it, so that concurrent runs never see half-written arrays
+        os.makedirs(cache_dir, exist_ok=True)
+        tmp_path = tempfile.mkdtemp(dir=cache_dir)
+        np.save(os.path.join(tmp_path, "input_ids.npy"), tokens['input_ids'].astype(np.int64))
+        np.save(os.path.join(tmp_path, "attention_mask.npy"), tokens['attention_mask'].astype(np.int64))
+        np.save(os.path.join(tmp_path, "labels.npy"), labels)
+        try:
+            os.rename(tmp_path, path)
+        except OSError:
+            # another run stored the same split first
+            shutil.rmtree(tmp_path, ignore_errors=True)
+    return tuple(np.load(os.path.join(path, f), mmap_mode='c') for f in CACHE_FILES)
@@ -0,0 +1,266 @@
+import os
+import threading
+from time import sleep
+
+import numpy as np
+import pandas as pd
+import psutil
+import torch
+import torch.optim as optim
+from torch.utils.data import TensorDataset, DataLoader
+
+from dynamic_padding import TokenizedSentenceDataset, bucketed_data_loader, TokenThroughputMeter
+from model_registry import is_registered, load_tokenizer, load_model
+from tokenization_cache import load_tokenized
+from metrics import MetricsAccumulator
+
+MAX_NUM_EPOCHS = 100
+MAX_EARLY_STOPPING = 7
+EARLY_STOPPING_EPS = 1e-2
+EPOCH_RESULT_COLUMNS = ['Loss_train', 'Accuracy_train', 'F1_train', 'Tokens_per_sec_train', 'Step_time_train', 'Peak_memory_MB',
+                        'Loss_valid', 'Accuracy_valid', 'F1_valid', 'Tokens_per_sec_valid']
+
+
+class PeakRSSSampler:
+    """
+    Description: Peak resident set size of the process since the last reset, sampled by a daemon thread every interval
+    seconds. Grid workers run many jobs one after another, so the lifetime peak of the process would mostly report
+    the largest earlier job.
+    """
+    def __init__(self, interval: float = 0.05):
+        self.process = psutil.Process()
+        self.interval = interval
+        self.peak = 0
+        self.lock = threading.Lock()
+        self.thread = None
+
+    def _sample(self):
+        rss = self.process.memory_info().rss
+        with self.lock:
+            self.peak = max(self.peak, rss)
+
+    def _run(self):
+        while True:
+            self._sample()
+            sleep(self.interval)
+
+    def reset(self):
+        with self.lock:
+            self.peak = 0
+        self._sample()
+        if self.thread is None:
+            self.thread = threading.Thread(target=self._run, daemon=True)
+            self.thread.start()
+
+    def peak_mb(self):
+        self._sample()
+        return self.peak / 2 ** 20
+
+
+_rss_sampler = PeakRSSSampler()
+
+
+def reset_peak_memory(device):
+    if device.type == 'cuda':
+        torch.cuda.reset_peak_memory_stats(device)
+    else:
+        _rss_sampler.reset()
+
+
+def peak_memory_mb(device):
+    """
+    Description: Peak memory in MB since the last reset_peak_memory, allocated CUDA memory on GPU and the sampled
+    resident set size of the process on CPU
+    """
+    if device.type == 'cuda':
+        return torch.cuda.max_memory_allocated(device) / 2 ** 20
+    return _rss_sampler.peak_mb()
+
+
+def max_length_for(language_model_to_use: str):
+    return 128 if language_model_to_use == 'flangroberta' else 256
+
+
+def micro_batch_size_for(batch_size: int, gradient_accumulation_steps: int):
+    """
+    Description: Sentences per micro-batch, so that gradient_accumulation_steps micro-batches make exactly batch_size
+    (the batch size reported in the results); raises ValueError if batch_size does not split that way
+    """
+    if gradient_accumulation_steps < 1 or batch_size % gradient_accumulation_steps != 0:
+        raise ValueError("batch_size %d is not a multiple of gradient_accumulation_steps %d" % (batch_size, gradient_accumulation_steps))
+    return batch_size // gradient_accumulation_steps
+
+
+def load_split(data_path: str, tokenizer, language_model_to_use: str, dynamic_padding: bool = True):
+    """
+    Description: Dataset of an annotated xlsx split, tokenized through the on-disk token cache
+    """
+    input_ids, attention_masks, labels = load_tokenized(data_path, tokenizer, language_model_to_use, max_length_for(language_model_to_use))
+    if dynamic_padding:
+        return TokenizedSentenceDataset.from_padded(input_ids, attention_masks, labels)
+    return TensorDataset(torch.from_numpy(input_ids), torch.from_numpy(attention_masks), torch.from_numpy(labels))
+
+
+def make_loader(dataset, batch_size: int, tokenizer, shuffle: bool, dynamic_padding: bool = True):
+    if dynamic_padding:
+        return bucketed_data_loader(dataset, batch_size, tokenizer, shuffle=shuffle)
+    return DataLoader(dataset, batch_size=batch_size, shuffle=shuffle)
+
+
+def run_epoch(model, loader, num_samples: int, device, optimizer=None, gradient_accumulation_steps: int = 1, autocast_dtype=None):
+    """
+    Description: One pass over a loader, training if an optimizer is given and evaluating otherwise.
+    Returns (loss, accuracy, weighted F1, TokenThroughputMeter of the pass, number of optimizer steps).
+    """
+    training = optimizer is not None
+    metrics = MetricsAccumulator(num_samples, device)
+    # the last optimizer step may average fewer micro-batches, when the loader length is not a multiple of the steps
+    last_group_start = len(loader) - (len(loader) % gradient_accumulation_steps or gradient_accumulation_steps)
+    throughput = TokenThroughputMeter()
+    optimizer_steps = 0
+    if training:
+        optimizer.zero_grad()
+
+    for step, (input_ids, attention_masks, labels) in enumerate(loader, start=1):
+        throughput.update(attention_masks)
+        input_ids = input_ids.to(device)
+        attention_masks = attention_masks.to(device)
+        labels = labels.to(device)
+        with torch.set_grad_enabled(training):
+            with torch.autocast(device_type=device.type, dtype=autocast_dtype, enabled=autocast_dtype is not None):
+                outputs = model(input_ids = input_ids, attention_mask = attention_masks, labels=labels)
+            loss = outputs.loss
+            if training:
+                group_size = gradient_accumulation_steps if step <= last_group_start else len(loader) - last_group_start
+                (loss / group_size).backward()
+                if step % gradient_accumulation_steps == 0 or step == len(loader):
+                    optimizer.step()
+                    optimizer.zero_grad()
+                    optimizer_steps += 1
+        metrics.update(loss, outputs.logits, labels)
+    return metrics.compute() + (throughput, optimizer_steps)
+
+
+def save_checkpoint(model, tokenizer, save_path: str, df_epoch_results=None):
+    model.save_pretrained(save_path)
+    tokenizer.save_pretrained(save_path)
+    if df_epoch_results is not None:
+        df_epoch_results.to_excel(save_path + "/epoch_results.xlsx", index=True)
+
+
+def train_lm_hawkish_dovish(gpu_numbers: str, train_data_path: str, test_data_path: str, language_model_to_use: str, seed: int, batch_size: int, learning_rate: float, save_model_path: str, dynamic_padding: bool = True, data_category: str = '', pruner=None,
+                            precision: str = 'fp32', gradient_accumulation_steps: int = 1, gradient_checkpointing: bool = False):
+    """
+    Description: Run experiment over particular batch size, learning rate and seed
+    dynamic_padding: pad every batch only to its longest sentence and group similar lengths together,
+    set to False for the legacy behavior of padding the whole file to the longest sentence
+    data_category: only used to name the saved model directory
+    pruner: optional SuccessiveHalvingPruner that can stop an unpromising run early, it still gets tested and reported
+    precision: 'fp32', or 'bf16' to run forward passes and losses under bfloat16 autocast (on CPU and GPU)
+    gradient_accumulation_steps: batch_size stays the effective batch size of an optimizer step, made up of this many
+    micro-batches of batch_size // gradient_accumulation_steps sentences, so large batches fit in memory; it has to
+    divide batch_size
+    gradient_checkpointing: recompute activations in the backward pass instead of storing them
+    save_model_path: prefix of the saved model directory, None to not save the model
+    """
+    if precision not in ('fp32', 'bf16'):
+        raise ValueError("precision must be 'fp32' or 'bf16', got %r" % precision)
+    micro_batch_size = micro_batch_size_for(batch_size, gradient_accumulation_steps)
+    # set gpu
+    os.environ["CUDA_VISIBLE_DEVICES"] = str(gpu_numbers)
+    device = torch.device('cuda') if torch.cuda.is_available() else torch.device('cpu')
+    print("Device assigned: ", device)
+    print("Precision: %s, micro-batch size: %d, accumulation steps: %d, gradient checkpointing: %s" % (precision, micro_batch_size, gradient_accumulation_steps, gradient_checkpointing))
+
+    # load tokenizer
+    if not is_registered(language_model_to_use):
+        return -1
+    tokenizer = load_tokenizer(language_model_to_use)
+
+    # load tokenized training and test data, cached on disk per (file content, tokenizer, max length)
+    dataset = load_split(train_data_path, tokenizer, language_model_to_use, dynamic_padding)
+    dataset_test = load_split(test_data_path, tokenizer, language_model_to_use, dynamic_padding)
+    val_length = int(len(dataset) * 0.2)
+    train_length = len(dataset) - val_length
+    print(f'Train Size: {train_length}, Validation Size: {val_length}')
+
+    # assign seed to numpy and PyTorch
+    torch.manual_seed(seed)
+    np.random.seed(seed)
+
+    # select language model
+    model = load_model(language_model_to_use, device)
+    if gradient_checkpointing:
+        if model.supports_gradient_checkpointing:
+            model.gradient_checkpointing_enable()
+        else:
+            print("%s does not support gradient checkpointing, training without it" % language_model_to_use)
+    autocast_dtype = torch.bfloat16 if precision == 'bf16' else None
+    reset_peak_memory(device)
+
+    # create train-val split
+    train, val = torch.utils.data.random_split(dataset=dataset, lengths=[train_length, val_length], generator=torch.Generator().manual_seed(seed))
+    dataloaders_dict = {'train': make_loader(train, micro_batch_size, tokenizer, True, dynamic_padding), 'val': make_loader(val, micro_batch_size, tokenizer, True, dynamic_padding)}
+    # select optimizer
+    optimizer = optim.AdamW(model.parameters(), lr=learning_rate)
+    early_stopping_count = 0
+    best_ce = float('inf')
+    best_accuracy = float('-inf')
+    best_f1 = float('-inf')
+    eps = EARLY_STOPPING_EPS
+
+    epoch_result_train = []
+    epoch_result_val = []
+
+    print("max num epochs:%d" % MAX_NUM_EPOCHS)
+
+    for epoch in range(MAX_NUM_EPOCHS):
+        print("epoch(%d)" % epoch)
+        if (early_stopping_count >= MAX_EARLY_STOPPING):
+            break
+        model.train()
+        early_stopping_count += 1
+        curr_ce_train, curr_accuracy_train, currF1_train, throughput, optimizer_steps = run_epoch(model, dataloaders_dict['train'], len(train), device, optimizer,
+                                                                                                  gradient_accumulation_steps, autocast_dtype)
+        step_time = throughput.elapsed() / max(optimizer_steps, 1)
+        epoch_result_train.append([curr_ce_train, curr_accuracy_train, currF1_train, throughput.tokens_per_second(), step_time, peak_memory_mb(device)])
+        print("Train Tokens/sec: ", throughput.tokens_per_second())
+        print("Train Step Time (s): ", step_time)
+        print("Peak Memory (MB): ", peak_memory_mb(device))
+        print("Train Padding Efficiency: ", throughput.padding_efficiency())
+
+        model.eval()
+        curr_ce, curr_accuracy, currF1, throughput, _ = run_epoch(model, dataloaders_dict['val'], len(val), device, autocast_dtype=autocast_dtype)
+        epoch_result_val.append([curr_ce, curr_accuracy, currF1, throughput.tokens_per_second()])
+        if curr_ce <= best_ce - eps:
+            best_ce = curr_ce
+            early_stopping_count = 0
+        if curr_accuracy >= best_accuracy + eps:
+            best_accuracy = curr_accuracy
+            early_stopping_count = 0
+        if currF1 >= best_f1 + eps:
+            best_f1 = currF1
+            early_stopping_count = 0
+        print("Val CE: ", curr_ce)
+        print("Val Accuracy: ", curr_accuracy)
+        print("Val F1: ", currF1)
+        print("Val Tokens/sec: ", throughput.tokens_per_second())
+        print("Early Stopping Count: ", early_stopping_count)
+        if pruner is not None and pruner.should_stop(epoch + 1, currF1, curr_ce):
+            print("Pruned after epoch %d" % (epoch + 1))
+            break
+
+    ## ------------------testing---------------------
+    test_ce, test_accuracy, test_f1, throughput, _ = run_epoch(model, make_loader(dataset_test, micro_batch_size, tokenizer, False, dynamic_padding), len(dataset_test), device,
+                                                               autocast_dtype=autocast_dtype)
+    print("Test Tokens/sec: ", throughput.tokens_per_second())
+    mean_step_time = float(np.mean([result[4] for result in epoch_result_train])) if epoch_result_train else 0.0
+    experiment_results = [seed, learning_rate, batch_size, best_ce, best_accuracy, best_f1, test_ce, test_accuracy, test_f1, peak_memory_mb(device), mean_step_time]
+    df_epoch_results = pd.DataFrame([train + valid for train, valid in zip(epoch_result_train, epoch_result_val)], columns=EPOCH_RESULT_COLUMNS)
+
+    # save model
+    if save_model_path != None:
+        save_path = save_model_path + language_model_to_use + data_category + '-' + str(seed) + '-' + str(learning_rate) + '-' + str(batch_size)
+        save_checkpoint(model, tokenizer, save_path, df_epoch_results)
+
+    return experiment_results
@@ -1,3 +1,6 @@
+import os
+import sys
+import torch
 from transformers import pipeline
 from transformers import AutoTokenizer, AutoModelForSequenceClassification, AutoConfig
 
@@ -7,9 +10,30 @@ model = AutoModelForSequenceClassification.from_pretrained("gtfintechlab/FOMC-Ro
 
 config = AutoConfig.from_pretrained("gtfintechlab/FOMC-RoBERTa")
 
-classifier = pipeline('text-classification', model=model, tokenizer=tokenizer, config=config, device=0, framework="pt")
+classifier = pipeline('text-classification', model=model, tokenizer=tokenizer, config=config, device=0 if torch.cuda.is_available() else -1, framework="pt")
 results = classifier(["Such a directive would imply that any tightening should be implemented promptly if developments were perceived as pointing to rising inflation.", 
                       "The International Monetary Fund projects that global economic growth in 2019 will be the slowest since the financial crisis."], 
                       batch_size=128, truncation="only_first")
 
-print(results)
\ No newline at end of file
+print(results)
+
+# same output, but sentences already scored by this model (e.g. recurring boilerplate) are read from the prediction cache
+sys.path.append('code_model')
+from batch_inference import StreamingLabeler
+from prediction_cache import PredictionCache
+
+cache = PredictionCache("gtfintechlab/FOMC-RoBERTa", path="model_data/prediction_cache.sqlite")
+cached_classifier = StreamingLabeler(model.to(classifier.device), tokenizer, classifier.device, batch_size=128, cache=cache)
+results = cached_classifier.classify(["Such a directive would imply that any tightening should be implemented promptly if developments were perceived as pointing to rising inflation.", 
+                                      "The International Monetary Fund projects that global economic growth in 2019 will be the slowest since the financial crisis."])
+
+print(results)
+cache.report()
+
+# on hosts without a GPU, the INT8 / ONNX Runtime export of code_model/cpu_export.py is a drop-in replacement for the model
+from cpu_export import load_onnx
+
+if os.path.exists("model_data/cpu_export/model_int8.onnx"):
+    onnx_model, onnx_tokenizer = load_onnx("model_data/cpu_export")
+    onnx_classifier = StreamingLabeler(onnx_model, onnx_tokenizer, torch.device("cpu"), batch_size=128)
+    print(onnx_classifier.classify(["Such a directive would imply that any tightening should be implemented promptly if developments were perceived as pointing to rising inflation."]))